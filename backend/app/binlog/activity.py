@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: This module tracks which patient parameters are active (still receiving data).
+             Every (patient_id, param_type) has a deadline, last_update + threshold, kept in a
+             min-heap. Updates only refresh last_update; the heap entry is re-pushed lazily when
+             it expires and the parameter turns out to have been updated in the meantime, so an
+             expiry check costs O(expired entries) instead of a scan of every parameter ever seen.
+             Parameters that stay inactive for evict_after seconds are removed, and on_evict is
+             told so that per-stream state kept elsewhere (the notifier's seen streams) is
+             released with them.
+"""
+
+import heapq
+import time
+from threading import Lock
+
+from config.logger import logger
+
+
+class ActivityTracker:
+    def __init__(self, threshold, evict_after, on_change=None, on_evict=None):
+        """
+        Parameters:
+            threshold (float): Seconds without data after which a parameter becomes inactive.
+            evict_after (float): Seconds without data after which an inactive parameter is removed.
+            on_change: Optional callable receiving a list of (patient_id, param_type, active,
+                       last_update) transitions. Called outside the lock.
+            on_evict: Optional callable receiving a list of evicted (patient_id, param_type)
+                      keys. Called outside the lock.
+        """
+        self.threshold = threshold
+        self.evict_after = max(evict_after, threshold)
+        self.on_change = on_change
+        self.on_evict = on_evict
+        # {(patient_id, param_type): {"active": bool, "last_update": timestamp, "deadline": float}}
+        # "deadline" is the deadline of the key's live heap entry; other entries are stale.
+        self.params = {}
+        self.lock = Lock()
+        self._heap = []
+        self.evicted = 0
+
+    def touch(self, key, last_update):
+        """
+        Record data for one parameter.
+
+        Parameters:
+            key (tuple): (patient_id, param_type).
+            last_update (float): Collection timestamp of the data.
+        """
+        self.touch_many(((key, last_update),))
+
+    def touch_many(self, updates):
+        """
+        Record data for several parameters under one lock.
+
+        Parameters:
+            updates: Iterable of ((patient_id, param_type), last_update).
+        """
+        activated = []
+        with self.lock:
+            for key, last_update in updates:
+                info = self.params.get(key)
+                if info is not None and info["active"]:
+                    info["last_update"] = last_update
+                    continue
+                # New or reactivated parameter: schedule its inactivity deadline.
+                deadline = last_update + self.threshold
+                self.params[key] = {"active": True, "last_update": last_update, "deadline": deadline}
+                heapq.heappush(self._heap, (deadline, key))
+                activated.append((key[0], key[1], True, last_update))
+
+        if activated:
+            for patient_id, param_type, _, _ in activated:
+                logger.info(f"Active device: Patient {patient_id} --- {param_type} is now active")
+            self._notify(activated)
+
+    def expire(self, now=None):
+        """
+        Mark parameters whose deadline has passed as inactive and evict long-inactive ones.
+
+        Parameters:
+            now (float, optional): Current time (epoch seconds); defaults to time.time().
+
+        Returns:
+            list: (patient_id, param_type, active, last_update) transitions to inactive.
+        """
+        if now is None:
+            now = time.time()
+        deactivated = []
+        evicted = []
+        with self.lock:
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                deadline, key = heapq.heappop(heap)
+                info = self.params.get(key)
+                if info is None or info["deadline"] != deadline:
+                    # Superseded entry.
+                    continue
+
+                if not info["active"]:
+                    del self.params[key]
+                    self.evicted += 1
+                    evicted.append(key)
+                    continue
+
+                actual = info["last_update"] + self.threshold
+                if actual > now:
+                    # Updated since the entry was pushed: re-push at the real deadline.
+                    info["deadline"] = actual
+                    heapq.heappush(heap, (actual, key))
+                    continue
+
+                info["active"] = False
+                info["deadline"] = info["last_update"] + self.evict_after
+                heapq.heappush(heap, (info["deadline"], key))
+                deactivated.append((key[0], key[1], False, info["last_update"]))
+
+        if deactivated:
+            for patient_id, param_type, _, _ in deactivated:
+                logger.info(f"Active device: Patient {patient_id} --- {param_type} is now inactive")
+            self._notify(deactivated)
+        if evicted and self.on_evict is not None:
+            try:
+                self.on_evict(evicted)
+            except Exception as e:
+                logger.error(f"Failed to release evicted parameters: {str(e)}")
+        return deactivated
+
+    def is_active(self, key):
+        with self.lock:
+            info = self.params.get(key)
+            return info is not None and info["active"]
+
+    def active_keys(self):
+        """
+        Return the (patient_id, param_type) keys that are currently active.
+        """
+        with self.lock:
+            return [key for key, info in self.params.items() if info["active"]]
+
+    def stats(self):
+        with self.lock:
+            active = sum(1 for info in self.params.values() if info["active"])
+            return {
+                "tracked": len(self.params),
+                "active": active,
+                "heap_entries": len(self._heap),
+                "evicted": self.evicted
+            }
+
+    def _notify(self, transitions):
+        if self.on_change is None:
+            return
+        try:
+            self.on_change(transitions)
+        except Exception as e:
+            logger.error(f"Failed to publish parameter status changes: {str(e)}")
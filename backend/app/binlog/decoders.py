@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: This module decodes binlog rows of the sensor tables into cache payloads.
+             Waveform tables (pressure_flow_params, ecg_params) are decoded straight into
+             contiguous NumPy arrays; the other tables are decoded from their JSON columns.
+             It has no dependency on the cache or send pipeline so it can be used on its own.
+"""
+
+import json
+
+import numpy as np
+
+from config.logger import logger
+from config.settings import settings
+
+# dtype of decoded waveform sample arrays (float32 halves memory, float64 keeps full precision).
+WAVEFORM_DTYPE = np.dtype(settings.WAVEFORM_DTYPE)
+
+PRESSURE_FLOW_CHANNELS = ("pressure", "flow")
+ECG_CHANNELS = ("ecg", "emg", "impedance", "eeg")
+
+
+def _lookup(mapping, key, key_bytes):
+    """
+    Get a JSON member by name. Binlog JSON documents use bytes keys, documents
+    decoded with json.loads use str keys; both are accepted.
+    """
+    value = mapping.get(key_bytes)
+    if value is None:
+        value = mapping[key]
+    return value
+
+
+def decode_waveform_channels(raw_params, channels, dtype=None):
+    """
+    Decode the given channels of a waveform JSON document.
+
+    Only the requested channels are touched. Each channel's samples are converted in a single
+    call into a contiguous NumPy array instead of one Python float per sample.
+
+    Parameters:
+        raw_params (dict): The "parameters" JSON document ({channel: {"unit": ..., "values": [...]}}).
+        channels (tuple): Channel names to decode.
+        dtype: NumPy dtype of the sample arrays (defaults to WAVEFORM_DTYPE).
+
+    Returns:
+        dict: {channel: {"unit": str, "values": np.ndarray}}
+
+    Raises:
+        KeyError: If a channel, its unit or its values are missing.
+        ValueError: If the samples cannot be converted to floats.
+    """
+    dtype = WAVEFORM_DTYPE if dtype is None else dtype
+    data = {}
+    for channel in channels:
+        raw_channel = _lookup(raw_params, channel, channel.encode('utf-8'))
+        unit = _lookup(raw_channel, "unit", b"unit")
+        if isinstance(unit, bytes):
+            unit = unit.decode('utf-8')
+        samples = _lookup(raw_channel, "values", b"values")
+        data[channel] = {
+            "unit": unit,
+            # fromiter with a known count fills a preallocated buffer in one pass.
+            "values": np.fromiter(samples, dtype=dtype, count=len(samples))
+        }
+    return data
+
+
+def process_pressure_flow(values):
+    param_type = "pressure_flow"
+    data = decode_waveform_channels(values["parameters"], PRESSURE_FLOW_CHANNELS)
+    return param_type, data
+
+def process_ecg(values):
+    param_type = "ECG"
+    data = decode_waveform_channels(values["parameters"], ECG_CHANNELS)
+    return param_type, data
+
+def process_ella_sensor(values):
+    param_type = "breath_cycle"
+    raw_params = values["parameters"]
+    
+    if isinstance(raw_params, dict):
+        decoded_params = raw_params
+    elif isinstance(raw_params, bytes):
+        decoded_params = json.loads(raw_params.decode('utf-8'))
+    elif isinstance(raw_params, str):
+        decoded_params = json.loads(raw_params)
+    else:
+        raise ValueError("Unsupported type for parameters in ella_sensor_params")
+    
+    return param_type, decoded_params
+
+def process_mepap_sensor(values):
+    """
+    Process MePAP sensor data from the binlog event.
+    
+    Args:
+        values: Dictionary containing the row values from mepap_sensor_params table
+        
+    Returns:
+        tuple: (param_type, data) where param_type is "MePAP" and data contains 
+               the expected and actual pressure values
+    """
+    param_type = "MePAP"
+    raw_params = values["parameters"]
+    
+    # Handle different parameter formats (dict, bytes, string)
+    if isinstance(raw_params, dict):
+        decoded_params = raw_params
+    elif isinstance(raw_params, bytes):
+        decoded_params = json.loads(raw_params.decode('utf-8'))
+    elif isinstance(raw_params, str):
+        decoded_params = json.loads(raw_params)
+    else:
+        raise ValueError("Unsupported type for parameters in mepap_sensor_params")
+
+    
+    return param_type, decoded_params
+
+def process_ecg_model(values):
+    param_type = "ECG_QRS_INFO"
+    
+    raw_analysis = values["analysis_data"]
+    if isinstance(raw_analysis, dict):
+        analysis = raw_analysis
+    elif isinstance(raw_analysis, bytes):
+        analysis = json.loads(raw_analysis.decode('utf-8'))
+    elif isinstance(raw_analysis, str):
+        analysis = json.loads(raw_analysis)
+    else:
+        raise ValueError("Unsupported type for analysis_data")
+    
+    raw_vitals = values["vitals_data"]
+    if isinstance(raw_vitals, dict):
+        vitals = raw_vitals
+    elif isinstance(raw_vitals, bytes):
+        vitals = json.loads(raw_vitals.decode('utf-8'))
+    elif isinstance(raw_vitals, str):
+        vitals = json.loads(raw_vitals)
+    else:
+        raise ValueError("Unsupported type for vitals_data")
+    
+    data = {
+        "analysis": analysis,
+        "vitals": vitals
+    }
+    
+    return param_type, data
+
+def process_photodiode(values):
+    param_type = "photodiode"
+    raw_params = values["parameters"]
+
+    
+    if isinstance(raw_params, dict):
+        params = raw_params
+    elif isinstance(raw_params, bytes):
+        params = json.loads(raw_params.decode('utf-8'))
+    elif isinstance(raw_params, str):
+        params = json.loads(raw_params)
+    else:
+        raise ValueError("Unsupported type for parameters in photodiode_params")
+    
+    return param_type, params
+
+
+# Mapping from binlog table name to the function that decodes its rows.
+TABLE_HANDLERS = {
+    "pressure_flow_params": process_pressure_flow,
+    "ecg_params": process_ecg,
+    "ella_sensor_params": process_ella_sensor,
+    "mepap_sensor_params": process_mepap_sensor,
+    "ecg_model_output": process_ecg_model,
+    "photodiode_params": process_photodiode
+}
+
+
+def decode_rows(table, rows):
+    """
+    Decode the rows of one WriteRowsEvent.
+    Rows that fail to decode are logged and skipped.
+
+    Parameters:
+        table (str): The binlog table name.
+        rows: List of binlog rows ({"values": {...}}).
+
+    Returns:
+        list: (patient_id, param_type, data, timestamp) tuples in row order.
+    """
+    handler = TABLE_HANDLERS.get(table)
+    if handler is None:
+        return []
+
+    decoded = []
+    for row in rows:
+        try:
+            values = row["values"]
+            patient_id = values["patient_id"]
+            collection_time = values["collection_time"]
+            timestamp = collection_time.timestamp()
+
+            param_type, data = handler(values)
+            decoded.append((patient_id, param_type, data, timestamp))
+
+        except KeyError as e:
+            logger.error(f"Missing required field {str(e)} in {table} data")
+        except UnicodeDecodeError as e:
+            logger.error(f"Encoding error in {table}: {str(e)}")
+        except ValueError as e:
+            logger.error(f"Data conversion failed in {table}: {str(e)}")
+        except Exception as e:
+            logger.error(f"Unexpected error processing {table}: {str(e)}")
+    return decoded
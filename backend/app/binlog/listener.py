@@ -10,26 +10,53 @@ Description: This module listens to MySQL binlog events (specifically for pressu
 
 # app/binlog/listener.py
 import time
-import json
-from threading import Thread, Lock
+from threading import Thread
 
-from pymysqlreplication import BinLogStreamReader
 from pymysqlreplication.row_event import WriteRowsEvent
+from pymysqlreplication.event import XidEvent, QueryEvent
 
 from app.core.cache import data_cache
+from app.core.shared_cache import SharedCacheFeed
 from app.core.send_data import send_data_manager
 from config.logger import logger
 from config.settings import settings
 from app.core.events import notifier
+from app.core.metrics import ingest_metrics
+from app.binlog.batcher import IngestBatcher
+from app.binlog.sharded import ShardedIngest
+from app.binlog.checkpoint import BinlogCheckpoint, CatchUpGate
+from app.binlog.activity import ActivityTracker
+from app.binlog.sources import BinlogEventSource, CaptureWriter, RecordedRowsEvent
+from app.database.writer import write_behind
+from app.binlog.decoders import (
+    TABLE_HANDLERS,
+    decode_rows,
+    process_pressure_flow,
+    process_ecg,
+    process_ella_sensor,
+    process_mepap_sensor,
+    process_ecg_model,
+    process_photodiode
+)
 
-# Dictionary to store active parameters and their last update timestamp.
-# Structure: {(patient_id, param_type): {"active": bool, "last_update": timestamp}}
-active_params = {}
-# Lock for thread-safe access to active_params dictionary.
-active_params_lock = Lock()
-
+INACTIVITY_THRESHOLD = settings.INACTIVITY_THRESHOLD
 
-INACTIVITY_THRESHOLD = 20
+# Tracks which parameters are active and pushes status changes to their subscribers.
+activity_tracker = ActivityTracker(
+    threshold=INACTIVITY_THRESHOLD,
+    evict_after=settings.ACTIVITY_EVICT_AFTER,
+    on_change=send_data_manager.send_status,
+    on_evict=notifier.forget_streams
+)
+# Dictionary of active parameters and their last update timestamp (owned by activity_tracker).
+# Structure: {(patient_id, param_type): {"active": bool, "last_update": timestamp, "deadline": float}}
+active_params = activity_tracker.params
+# Lock for thread-safe access to active_params dictionary.
+active_params_lock = activity_tracker.lock
+# {(patient_id, param_type): collection time (epoch seconds) of the newest row loaded by the
+# warm-start}, filled before the listener starts (see app/binlog/warm_start.py). Catch-up rows
+# up to it are already cached.
+warm_start_marks = {}
 
 
 def print_active_parameters():
@@ -38,44 +65,41 @@ def print_active_parameters():
     If there are no active parameters, log that no active devices are found.
     """
     grouped = {}
-    with active_params_lock:
-        # Group active parameters by patient_id.
-        for (patient_id, param_type), info in active_params.items():
-            if info["active"]:
-                grouped.setdefault(patient_id, []).append(param_type)
+    # Group active parameters by patient_id.
+    for patient_id, param_type in activity_tracker.active_keys():
+        grouped.setdefault(patient_id, []).append(param_type)
     if not grouped:
         logger.info("Active device: No active parameters")
     else:
-        for patient_id in sorted(grouped.keys()):
-            params = grouped[patient_id]
-            if params:
-                logger.info(f"Active device: Patient {patient_id} --- " + ", ".join(params))
-            else:
-                logger.info(f"Active device: Patient {patient_id} --- None")
+        for patient_id in sorted(grouped.keys(), key=str):
+            logger.info(f"Active device: Patient {patient_id} --- " + ", ".join(grouped[patient_id]))
 
 
 def monitor_active_params():
     """
-    Continuously monitor the active parameters.
-    If a parameter hasn't been updated within the INACTIVITY_THRESHOLD, mark it as inactive.
-    Periodically prints the list of active parameters and logs subscription events.
+    Continuously expire inactive parameters.
+    Every ACTIVITY_CHECK_INTERVAL seconds the parameters whose deadline has passed are marked
+    inactive (see ActivityTracker.expire), so a device is reported inactive at most about one
+    interval after INACTIVITY_THRESHOLD. The active parameter table and the subscriptions are
+    logged every ACTIVITY_LOG_INTERVAL seconds, and the cache is swept (TTL and memory budget
+    eviction) every CACHE_SWEEP_INTERVAL seconds.
     """
+    last_log = 0.0
+    last_sweep = time.monotonic()
     while True:
-        current_time = time.time()
-        with active_params_lock:
-            # Check each active parameter and update its status if needed.
+        activity_tracker.expire()
+
+        if time.monotonic() - last_sweep >= settings.CACHE_SWEEP_INTERVAL:
+            last_sweep = time.monotonic()
+            data_cache.sweep()
 
-            for key, info in list(active_params.items()):
-                if info["active"] and (current_time - info["last_update"] > INACTIVITY_THRESHOLD):
-                    logger.info(f"time: {current_time}, last_update: {info['last_update']}")
-                    active_params[key]["active"] = False
-                    logger.info(f"Active device: Patient {key[0]} --- {key[1]} is now inactive")
-        print_active_parameters()
-        # Log subscription events (using notifier).
-        notifier._log_subscriptions()
-        # Sleep for the threshold duration before next check.
+        if time.monotonic() - last_log >= settings.ACTIVITY_LOG_INTERVAL:
+            last_log = time.monotonic()
+            print_active_parameters()
+            # Log subscription events (using notifier).
+            notifier._log_subscriptions()
 
-        time.sleep(INACTIVITY_THRESHOLD)
+        time.sleep(settings.ACTIVITY_CHECK_INTERVAL)
 
 
 def start_monitoring_active_params():
@@ -91,231 +115,231 @@ def start_monitoring_active_params():
     return monitor_thread
 
 
-def process_pressure_flow(values):
-    param_type = "pressure_flow"
-    raw_params = values["parameters"]
-    
-    decoded_params = {
-        key.decode('utf-8'): {
-            sub_key.decode('utf-8'): sub_val if not isinstance(sub_val, bytes)
-            else sub_val.decode('utf-8')
-            for sub_key, sub_val in value.items()
-        }
-        for key, value in raw_params.items()
-    }
-
-    pressure_values = [float(v) for v in decoded_params["pressure"]["values"]]
-    flow_values = [float(v) for v in decoded_params["flow"]["values"]]
-    
-    data = {
-        "pressure": {
-            "unit": decoded_params["pressure"]["unit"],
-            "values": pressure_values
-        },
-        "flow": {
-            "unit": decoded_params["flow"]["unit"],
-            "values": flow_values
-        }
-    }
-    
-    return param_type, data
+def dispatch_shared_records(patient_id, param_type, seqs, last_timestamp):
+    """
+    Handle records published by the writer process (reader processes): queue their send
+    events and mark the parameter active, as commit_row does for binlog rows.
+    """
+    send_data_manager.add_events(patient_id, param_type, seqs)
+    activity_tracker.touch((patient_id, param_type), last_timestamp)
 
-def process_ecg(values):
-    param_type = "ECG"
-    raw_params = values["parameters"]
-    
-    decoded_params = {
-        key.decode('utf-8'): {
-            sub_key.decode('utf-8'): sub_val if not isinstance(sub_val, bytes)
-            else sub_val.decode('utf-8')
-            for sub_key, sub_val in value.items()
-        }
-        for key, value in raw_params.items()
-    }
-    
-    ecg_values = [float(v) for v in decoded_params["ecg"]["values"]]
-    emg_values = [float(v) for v in decoded_params["emg"]["values"]]
-    impedance_values = [float(v) for v in decoded_params["impedance"]["values"]]
-    eeg_values = [float(v) for v in decoded_params["eeg"]["values"]]
-    
-    data = {
-        "ecg": {
-            "unit": decoded_params["ecg"]["unit"],
-            "values": ecg_values
-        },
-        "emg": {
-            "unit": decoded_params["emg"]["unit"],
-            "values": emg_values
-        },
-        "impedance": {
-            "unit": decoded_params["impedance"]["unit"],
-            "values": impedance_values
-        },
-        "eeg": {
-            "unit": decoded_params["eeg"]["unit"],
-            "values": eeg_values
-        }
-    }
-    
-    return param_type, data
 
-def process_ella_sensor(values):
-    param_type = "breath_cycle"
-    raw_params = values["parameters"]
-    
-    if isinstance(raw_params, dict):
-        decoded_params = raw_params
-    elif isinstance(raw_params, bytes):
-        decoded_params = json.loads(raw_params.decode('utf-8'))
-    elif isinstance(raw_params, str):
-        decoded_params = json.loads(raw_params)
-    else:
-        raise ValueError("Unsupported type for parameters in ella_sensor_params")
-    
-    return param_type, decoded_params
+def start_shared_cache_feed():
+    """
+    Start polling the shared cache for new records (SHARED_CACHE_ROLE "reader"), in place of
+    the binlog listener.
 
-def process_mepap_sensor(values):
+    Returns:
+        Thread: The polling thread instance running in daemon mode.
     """
-    Process MePAP sensor data from the binlog event.
-    
-    Args:
-        values: Dictionary containing the row values from mepap_sensor_params table
-        
+    feed = SharedCacheFeed(data_cache, dispatch_shared_records, interval=settings.SHARED_CACHE_POLL_INTERVAL)
+    return feed.start()
+
+
+def commit_row(patient_id, param_type, data, timestamp, fanout=True):
+    """
+    Commit one decoded row: update the cache, queue a send event and mark the parameter active.
+    With fanout=False (binlog catch-up) no send event is queued.
+    """
+    seq = data_cache.update_data(
+        patient_id=patient_id,
+        param_type=param_type,
+        data=data,
+        timestamp=timestamp
+    )
+
+    if fanout:
+        send_data_manager.add_event(
+            patient_id=patient_id,
+            param_type=param_type,
+            seq=seq
+        )
+
+    activity_tracker.touch((patient_id, param_type), timestamp)
+
+
+def commit_groups(groups):
+    """
+    Commit a batch of decoded rows grouped per (patient_id, param_type).
+    The cache and the send queue are updated once per group and the active parameter
+    table once per batch. A group that fails is logged and skipped, the others are committed.
+
+    Parameters:
+        groups: {(patient_id, param_type): [(data, timestamp), ...]} in arrival order.
+
     Returns:
-        tuple: (param_type, data) where param_type is "MePAP" and data contains 
-               the expected and actual pressure values
+        tuple: (rows, groups) committed, failed groups excluded.
     """
-    param_type = "MePAP"
-    raw_params = values["parameters"]
-    
-    # Handle different parameter formats (dict, bytes, string)
-    if isinstance(raw_params, dict):
-        decoded_params = raw_params
-    elif isinstance(raw_params, bytes):
-        decoded_params = json.loads(raw_params.decode('utf-8'))
-    elif isinstance(raw_params, str):
-        decoded_params = json.loads(raw_params)
-    else:
-        raise ValueError("Unsupported type for parameters in mepap_sensor_params")
+    committed = []
+    committed_rows = 0
+    for (patient_id, param_type), rows in groups.items():
+        try:
+            seqs = data_cache.update_batch(patient_id, param_type, rows)
+            send_data_manager.add_events(patient_id, param_type, seqs)
+        except Exception as e:
+            logger.error(f"Failed to commit {len(rows)} {param_type} rows of patient {patient_id}: {str(e)}")
+            continue
+        committed.append(((patient_id, param_type), rows[-1][1]))
+        committed_rows += len(rows)
 
-    
-    return param_type, decoded_params
+    activity_tracker.touch_many(committed)
+    return committed_rows, len(committed)
 
-def process_ecg_model(values):
-    param_type = "ECG_QRS_INFO"
-    
-    raw_analysis = values["analysis_data"]
-    if isinstance(raw_analysis, dict):
-        analysis = raw_analysis
-    elif isinstance(raw_analysis, bytes):
-        analysis = json.loads(raw_analysis.decode('utf-8'))
-    elif isinstance(raw_analysis, str):
-        analysis = json.loads(raw_analysis)
-    else:
-        raise ValueError("Unsupported type for analysis_data")
-    
-    raw_vitals = values["vitals_data"]
-    if isinstance(raw_vitals, dict):
-        vitals = raw_vitals
-    elif isinstance(raw_vitals, bytes):
-        vitals = json.loads(raw_vitals.decode('utf-8'))
-    elif isinstance(raw_vitals, str):
-        vitals = json.loads(raw_vitals)
-    else:
-        raise ValueError("Unsupported type for vitals_data")
-    
-    data = {
-        "analysis": analysis,
-        "vitals": vitals
-    }
-    
-    return param_type, data
 
-def process_photodiode(values):
-    param_type = "photodiode"
-    raw_params = values["parameters"]
+def commit_decoded(rows, batcher=None, fanout=True):
+    """
+    Commit decoded rows, either one by one or through the batcher.
 
-    
-    if isinstance(raw_params, dict):
-        params = raw_params
-    elif isinstance(raw_params, bytes):
-        params = json.loads(raw_params.decode('utf-8'))
-    elif isinstance(raw_params, str):
-        params = json.loads(raw_params)
-    else:
-        raise ValueError("Unsupported type for parameters in photodiode_params")
-    
-    return param_type, params
+    Parameters:
+        rows: List of (patient_id, param_type, data, timestamp) tuples in arrival order.
+        batcher (IngestBatcher, optional): If given, rows are buffered in the batcher
+                                           instead of being committed one by one.
+        fanout (bool): If False (stale rows during catch-up), rows only refresh the cache
+                       and the active parameter table and bypass the batcher; rows the
+                       warm-start already loaded are skipped.
 
-def process_binlog_event(event):
-    if not isinstance(event, WriteRowsEvent):
-        return
-        
-    for row in event.rows:
+    Returns:
+        int: Number of rows committed (rows handed to the batcher count as committed; they
+             are counted in the metrics when their batch is flushed).
+    """
+    if batcher is not None and fanout:
+        for patient_id, param_type, data, timestamp in rows:
+            batcher.add(patient_id, param_type, data, timestamp)
+        # Batched rows are counted when their batch is flushed.
+        return len(rows)
+
+    if not fanout and warm_start_marks:
+        rows = [
+            row for row in rows
+            if row[3] > warm_start_marks.get((row[0], row[1]), float("-inf"))
+        ]
+
+    committed = 0
+    for patient_id, param_type, data, timestamp in rows:
+        # One bad row (e.g. channels of unequal lengths) is logged and skipped; it must not
+        # stop the listener thread.
         try:
-            values = row["values"]
-            patient_id = values["patient_id"]
-            collection_time = values["collection_time"]
-            timestamp = collection_time.timestamp()
-            
-            handlers = {
-                "pressure_flow_params": process_pressure_flow,
-                "ecg_params": process_ecg,
-                "ella_sensor_params": process_ella_sensor,
-                "mepap_sensor_params": process_mepap_sensor,
-                "ecg_model_output": process_ecg_model,
-                "photodiode_params": process_photodiode
-            }
-            
-            if event.table in handlers:
-                param_type, data = handlers[event.table](values)
-                
-                data_cache.update_data(
-                    patient_id=patient_id,
-                    param_type=param_type,
-                    data=data,
-                    timestamp=timestamp
-                )
-                
-                send_data_manager.add_event(
-                    patient_id=patient_id,
-                    param_type=param_type,
-                    event_time=timestamp
-                )
-                
-                with active_params_lock:
-                    active_params[(patient_id, param_type)] = {
-                        "active": True,
-                        "last_update": timestamp
-                    }
-                    
-        except KeyError as e:
-            logger.error(f"Missing required field {str(e)} in {event.table} data")
-        except UnicodeDecodeError as e:
-            logger.error(f"Encoding error in {event.table}: {str(e)}")
-        except ValueError as e:
-            logger.error(f"Data conversion failed in {event.table}: {str(e)}")
+            commit_row(patient_id, param_type, data, timestamp, fanout)
         except Exception as e:
-            logger.error(f"Unexpected error processing {event.table}: {str(e)}")
+            logger.error(f"Failed to commit {param_type} row of patient {patient_id}: {str(e)}")
+            continue
+        committed += 1
+    ingest_metrics.record_rows(committed)
+    return committed
+
 
-def binlog_listener():
+def process_binlog_event(event, batcher=None, fanout=True):
     """
-    Listen to the MySQL binary log events and process WriteRowsEvent events.
+    Decode the rows of a WriteRowsEvent and commit them.
+
+    Parameters:
+        event: A binlog event from BinLogStreamReader or a RecordedRowsEvent from a replay.
+        batcher (IngestBatcher, optional): See commit_decoded.
+        fanout (bool): See commit_decoded.
     """
-    stream = BinLogStreamReader(
-        connection_settings={
-            "host": settings.DB_HOST,
-            "port": settings.DB_PORT,
-            "user": settings.BINLOG_USER,
-            "passwd": settings.BINLOG_PASSWORD
-        },
-        server_id=100,
-        only_events=[WriteRowsEvent],
-        blocking=True,
-        resume_stream=True,
-        only_tables=["pressure_flow_params", "ecg_params", "ella_sensor_params", 
-                     "mepap_sensor_params", "ecg_model_output", "photodiode_params"] 
-    )
-    
-    for event in stream:
-        process_binlog_event(event)
+    if not isinstance(event, (WriteRowsEvent, RecordedRowsEvent)):
+        return
+
+    commit_decoded(decode_rows(event.table, event.rows), batcher, fanout)
+
+def binlog_listener(source=None):
+    """
+    Listen to the MySQL binlog events and process WriteRowsEvent events.
+    If INGEST_BATCH_ENABLED is set, rows are committed in batches (see IngestBatcher).
+    If INGEST_SHARDS > 0, rows are decoded by worker processes (see ShardedIngest).
+    If BINLOG_CAPTURE_PATH is set, every row event is also recorded to that capture file.
+    Transactions written by the direct-ingest write-behind writer are skipped.
+
+    The position is checkpointed at transaction boundaries (XidEvent) every
+    BINLOG_CHECKPOINT_INTERVAL seconds, once the rows before it are committed to the cache,
+    and the stream resumes from it on restart. While the
+    resumed stream is older than BINLOG_CATCHUP_HORIZON, rows only refresh the cache and the
+    active parameter table (see CatchUpGate).
+
+    Parameters:
+        source (optional): Event source to consume instead of the live binlog
+                           (e.g. ReplayEventSource). Checkpointing only applies to the binlog.
+    """
+    checkpoint = None
+    log_file, log_pos = None, None
+    if source is None:
+        if settings.BINLOG_CHECKPOINT_INTERVAL > 0:
+            checkpoint = BinlogCheckpoint(settings.BINLOG_CHECKPOINT_PATH, settings.BINLOG_CHECKPOINT_INTERVAL)
+            log_file, log_pos = checkpoint.load()
+            if log_file:
+                logger.info(f"Resuming binlog stream from checkpoint {log_file}:{log_pos}")
+        source = BinlogEventSource(log_file=log_file, log_pos=log_pos)
+    catchup = CatchUpGate(settings.BINLOG_CATCHUP_HORIZON, active=log_file is not None)
+
+    capture = None
+    if settings.BINLOG_CAPTURE_PATH:
+        capture = CaptureWriter(settings.BINLOG_CAPTURE_PATH)
+        logger.info(f"Recording row events to {capture.path}")
+
+    batcher = None
+    if settings.INGEST_BATCH_ENABLED:
+        batcher = IngestBatcher(
+            commit=commit_groups,
+            max_rows=settings.INGEST_BATCH_MAX_ROWS,
+            max_delay=settings.INGEST_BATCH_MAX_DELAY
+        )
+        logger.info(f"Batched ingestion enabled: max_rows={batcher.max_rows}, max_delay={batcher.max_delay}s")
+
+    sharded = None
+    if settings.INGEST_SHARDS > 0:
+        sharded = ShardedIngest(
+            sink=lambda rows, fanout: commit_decoded(rows, batcher, fanout),
+            shards=settings.INGEST_SHARDS,
+            queue_size=settings.INGEST_SHARD_QUEUE_SIZE
+        )
+        logger.info(f"Sharded ingestion enabled: {sharded.shards} decode workers")
+
+    # True while inside a transaction written by the direct-ingest write-behind writer:
+    # its rows were already served from the cache when they were pushed to /ingest.
+    skip_transaction = False
+    # (log_file, log_pos) of the last XidEvent: the only positions worth checkpointing, a
+    # position inside a transaction would resume with its first rows missing.
+    committed_position = None
+
+    try:
+        for event in source:
+            if isinstance(event, QueryEvent):
+                if event.query == "BEGIN":
+                    skip_transaction = write_behind.owns_connection(event.slave_proxy_id)
+                continue
+
+            if isinstance(event, XidEvent):
+                skip_transaction = False
+                committed_position = (source.log_file, source.log_pos)
+                if checkpoint is not None and checkpoint.due():
+                    # Commit the rows still in the shard queues and the batcher first, so the
+                    # checkpoint never runs ahead of the cache.
+                    if sharded is not None:
+                        sharded.drain()
+                    if batcher is not None:
+                        batcher.flush()
+                    checkpoint.save(*committed_position)
+                continue
+
+            if skip_transaction:
+                continue
+
+            if capture is not None:
+                capture.write(event)
+
+            fanout = not catchup.is_stale(event.timestamp)
+            if sharded is not None:
+                # The listener thread only reads; decoding happens in the shard workers.
+                sharded.submit(event.table, event.rows, fanout)
+            else:
+                process_binlog_event(event, batcher, fanout)
+    finally:
+        if sharded is not None:
+            sharded.stop()
+        if batcher is not None:
+            batcher.stop()
+        if checkpoint is not None and committed_position is not None:
+            checkpoint.save(*committed_position)
+        if capture is not None:
+            capture.close()
+        source.close()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: This module implements the sharded ingest pipeline.
+             The binlog reader thread only forwards raw rows; N worker processes, sharded by
+             patient_id, decode them (see app/binlog/decoders.py) and send the decoded frames
+             back to the server process, where a single collector thread commits them.
+             All rows of one patient go through the same worker and the same result queue,
+             so per-patient ordering is preserved.
+             drain() is a barrier: it returns once every row submitted before it is committed,
+             so the listener can checkpoint a binlog position the cache already holds.
+"""
+
+import multiprocessing
+import queue
+import zlib
+from threading import Condition, Thread
+
+from app.binlog.decoders import decode_rows
+from config.logger import logger
+
+
+def shard_of(patient_id, shards):
+    """
+    Return the shard index for a patient.
+    crc32 is used instead of hash() so the mapping does not depend on hash randomization.
+    """
+    return zlib.crc32(str(patient_id).encode('utf-8')) % shards
+
+
+def _shard_worker(shard, inbox, outbox):
+    """
+    Worker process loop: decode (table, rows, fanout) chunks until a None sentinel is received.
+
+    Parameters:
+        shard (int): Index of this worker, used in log messages.
+        inbox: multiprocessing queue of (table, rows, fanout) chunks and barrier ids (int).
+        outbox: multiprocessing queue receiving (decoded, fanout) pairs, where decoded is a list
+                of (patient_id, param_type, data, timestamp) tuples, and the barrier ids.
+    """
+    logger.info(f"Ingest shard {shard} started")
+    while True:
+        chunk = inbox.get()
+        if chunk is None:
+            break
+        if isinstance(chunk, int):
+            # Barrier: passed on behind the rows decoded before it.
+            outbox.put(chunk)
+            continue
+        table, rows, fanout = chunk
+        decoded = decode_rows(table, rows)
+        if decoded:
+            outbox.put((decoded, fanout))
+    logger.info(f"Ingest shard {shard} stopped")
+
+
+class ShardedIngest:
+    def __init__(self, sink, shards, queue_size=1000):
+        """
+        Start the worker processes and the collector thread.
+
+        Parameters:
+            sink: Callable receiving (decoded, fanout), where decoded is a list of
+                  (patient_id, param_type, data, timestamp) tuples; called from the collector
+                  thread only.
+            shards (int): Number of worker processes.
+            queue_size (int): Capacity (in chunks) of each worker inbox and of the result queue.
+                              A full inbox blocks the reader, which applies back-pressure to
+                              the binlog stream instead of buffering without limit.
+        """
+        self._sink = sink
+        self.shards = shards
+        # Current barrier (see drain) and the number of workers that acknowledged it.
+        self._barrier = Condition()
+        self._barrier_id = 0
+        self._acknowledged = 0
+        # spawn: the server process runs several threads, which fork() would not duplicate safely.
+        context = multiprocessing.get_context("spawn")
+        self._inboxes = [context.Queue(maxsize=queue_size) for _ in range(shards)]
+        self._outbox = context.Queue(maxsize=queue_size)
+        self._workers = [
+            context.Process(
+                target=_shard_worker,
+                args=(shard, self._inboxes[shard], self._outbox),
+                name=f"IngestShard-{shard}",
+                daemon=True
+            )
+            for shard in range(shards)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+        self._collector = Thread(target=self._collect, name="IngestCollector", daemon=True)
+        self._collector.start()
+
+    def submit(self, table, rows, fanout=True):
+        """
+        Forward the rows of one binlog event to the workers, one chunk per shard.
+
+        Parameters:
+            table (str): The binlog table name.
+            rows: List of binlog rows ({"values": {...}}).
+            fanout (bool): Passed back with the decoded rows (False during binlog catch-up).
+        """
+        chunks = {}
+        for row in rows:
+            try:
+                shard = shard_of(row["values"]["patient_id"], self.shards)
+            except KeyError as e:
+                logger.error(f"Missing required field {str(e)} in {table} data")
+                continue
+            chunks.setdefault(shard, []).append(row)
+
+        for shard, chunk in chunks.items():
+            self._inboxes[shard].put((table, chunk, fanout))
+
+    def drain(self):
+        """
+        Wait until every chunk submitted so far has been decoded and committed by the collector.
+        Called from the reader thread only.
+        """
+        with self._barrier:
+            self._barrier_id += 1
+            self._acknowledged = 0
+            barrier_id = self._barrier_id
+        for inbox in self._inboxes:
+            inbox.put(barrier_id)
+        with self._barrier:
+            self._barrier.wait_for(lambda: self._acknowledged >= self.shards)
+
+    def stop(self):
+        """
+        Stop the workers after they drained their inboxes, then stop the collector.
+        """
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._outbox.put(None)
+        self._collector.join()
+
+    def _collect(self):
+        """
+        Collector thread: commit decoded frames in the order each worker produced them.
+        """
+        while True:
+            try:
+                item = self._outbox.get(timeout=1)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            if isinstance(item, int):
+                # A worker's barrier id: its earlier rows are committed.
+                with self._barrier:
+                    if item == self._barrier_id:
+                        self._acknowledged += 1
+                        self._barrier.notify_all()
+                continue
+            try:
+                self._sink(*item)
+            except Exception as e:
+                logger.error(f"Failed to commit decoded rows: {str(e)}")
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: This module provides the event sources the binlog listener can consume.
+             BinlogEventSource reads the live MySQL binlog. ReplayEventSource replays a capture
+             file written by CaptureWriter at 1x, Nx or maximum speed, optionally multiplying
+             patients, so the ingest path can be load tested without MySQL.
+
+             Capture file format: a gzip stream of pickled records. The first record is a header
+             dict {"format": "dticu-binlog-capture", "version": 1, "created_at": epoch}; every
+             following record is a tuple (timestamp, table, rows) where timestamp is the binlog
+             event time (epoch seconds), table the source table name and rows the list of row
+             "values" dicts exactly as pymysqlreplication produced them.
+             Only replay captures from trusted sources: unpickling can execute code.
+"""
+
+import copy
+import datetime
+import gzip
+import pickle
+import time
+
+from pymysqlreplication import BinLogStreamReader
+from pymysqlreplication.row_event import WriteRowsEvent
+from pymysqlreplication.event import XidEvent, QueryEvent
+
+from app.binlog.decoders import TABLE_HANDLERS
+from config.logger import logger
+from config.settings import settings
+
+CAPTURE_FORMAT = "dticu-binlog-capture"
+CAPTURE_VERSION = 1
+
+# Offset added to integer patient ids for each synthetic copy of a patient.
+PATIENT_ID_STRIDE = 100000
+
+
+class RecordedRowsEvent:
+    """
+    A row event read back from a capture file.
+    Exposes the WriteRowsEvent attributes used by the listener (table, rows, timestamp).
+    """
+    __slots__ = ("table", "rows", "timestamp")
+
+    def __init__(self, table, rows, timestamp):
+        self.table = table
+        self.rows = rows
+        self.timestamp = timestamp
+
+
+class BinlogEventSource:
+    def __init__(self, log_file=None, log_pos=None):
+        """
+        Open the live binlog stream.
+
+        Parameters:
+            log_file (str, optional): Binlog file to resume from.
+            log_pos (int, optional): Position in log_file to resume from.
+        """
+        self._stream = BinLogStreamReader(
+            connection_settings={
+                "host": settings.DB_HOST,
+                "port": settings.DB_PORT,
+                "user": settings.BINLOG_USER,
+                "passwd": settings.BINLOG_PASSWORD
+            },
+            server_id=100,
+            # XidEvent marks transaction commits, the only safe positions to resume from.
+            # QueryEvent ("BEGIN") carries the connection id of the transaction's writer.
+            only_events=[WriteRowsEvent, XidEvent, QueryEvent],
+            blocking=True,
+            resume_stream=True,
+            log_file=log_file,
+            log_pos=log_pos,
+            only_tables=list(TABLE_HANDLERS.keys())
+        )
+
+    @property
+    def log_file(self):
+        return self._stream.log_file
+
+    @property
+    def log_pos(self):
+        return self._stream.log_pos
+
+    def __iter__(self):
+        return iter(self._stream)
+
+    def close(self):
+        self._stream.close()
+
+
+class CaptureWriter:
+    def __init__(self, path):
+        """
+        Open a capture file for writing.
+
+        Parameters:
+            path (str): Output file (gzip-compressed pickle stream, see module description).
+        """
+        self.path = path
+        self.events = 0
+        self.rows = 0
+        self._file = gzip.open(path, "wb", compresslevel=6)
+        pickle.dump({
+            "format": CAPTURE_FORMAT,
+            "version": CAPTURE_VERSION,
+            "created_at": time.time()
+        }, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def write(self, event):
+        """
+        Append one row event (WriteRowsEvent or RecordedRowsEvent).
+        """
+        rows = [row["values"] for row in event.rows]
+        pickle.dump((event.timestamp, event.table, rows), self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.events += 1
+        self.rows += len(rows)
+
+    def close(self):
+        self._file.close()
+
+
+def read_capture(path):
+    """
+    Iterate over the (timestamp, table, rows) records of a capture file.
+
+    Raises:
+        ValueError: If the file is not a capture file of a supported version.
+    """
+    with gzip.open(path, "rb") as f:
+        header = pickle.load(f)
+        if not isinstance(header, dict) or header.get("format") != CAPTURE_FORMAT:
+            raise ValueError(f"{path} is not a binlog capture file")
+        if header.get("version") != CAPTURE_VERSION:
+            raise ValueError(f"Unsupported capture version {header.get('version')} in {path}")
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def synthetic_patient_id(patient_id, copy_index):
+    """
+    Return the patient id of the given synthetic copy (copy 0 keeps the original id).
+    """
+    if copy_index == 0:
+        return patient_id
+    if isinstance(patient_id, int):
+        return patient_id + copy_index * PATIENT_ID_STRIDE
+    return f"{patient_id}-{copy_index}"
+
+
+class ReplayEventSource:
+    # Replays carry no binlog position, so the listener never checkpoints them.
+    log_file = None
+    log_pos = None
+
+    def __init__(self, path, speed=1.0, multiply=1, retime=True):
+        """
+        Parameters:
+            path (str): Capture file written by CaptureWriter.
+            speed (float): Replay speed factor; 1 is real time, N is N times faster and
+                           0 replays as fast as the pipeline accepts events.
+            multiply (int): Number of copies of every patient (synthetic patients get new ids).
+            retime (bool): Shift collection_time so that rows look as if they were collected
+                           when they are replayed; required for meaningful latency figures.
+        """
+        self.path = path
+        self.speed = speed
+        self.multiply = max(1, int(multiply))
+        self.retime = retime
+        self.events = 0
+        self.rows = 0
+        self._closed = False
+
+    def __iter__(self):
+        first_timestamp = None
+        started = time.time()
+        for timestamp, table, rows in read_capture(self.path):
+            if self._closed:
+                return
+            if first_timestamp is None:
+                first_timestamp = timestamp
+
+            if self.speed > 0:
+                # Wait until this event is due at the requested speed.
+                due = started + (timestamp - first_timestamp) / self.speed
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+            now = time.time()
+            shift = datetime.timedelta(seconds=now - timestamp) if self.retime else None
+            out_rows = []
+            for copy_index in range(self.multiply):
+                for values in rows:
+                    values = copy.copy(values)
+                    values["patient_id"] = synthetic_patient_id(values.get("patient_id"), copy_index)
+                    if shift is not None and "collection_time" in values:
+                        values["collection_time"] = values["collection_time"] + shift
+                    out_rows.append({"values": values})
+
+            self.events += 1
+            self.rows += len(out_rows)
+            yield RecordedRowsEvent(table, out_rows, now if self.retime else timestamp)
+
+        logger.info(f"Replay of {self.path} finished: {self.events} events, {self.rows} rows")
+
+    def close(self):
+        self._closed = True
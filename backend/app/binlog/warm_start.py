@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: This module warm-starts the cache after a restart.
+             The last WARM_START_SECONDS of every *_params table are loaded with one windowed
+             query per table, read through a server-side (unbuffered) cursor so a table's rows are
+             decoded and committed as they stream in rather than held in memory. Tables are loaded
+             in parallel, one connection each. Rows are committed like binlog catch-up rows: they
+             refresh the cache and the active parameter table but are not sent to clients.
+
+             Warm-start runs before the binlog listener starts, so the loaded history is always
+             older than the live rows. When the listener resumes from a checkpoint, the window
+             ends at the checkpoint time because later rows are replayed from the binlog. The
+             checkpoint is written after the rows it covers, so the window and the replay may
+             still overlap: the collection time of the newest row loaded per stream is kept in
+             listener.warm_start_marks, and catch-up rows up to it are skipped.
+"""
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Thread
+
+from pymysql.cursors import SSCursor
+
+from app.binlog.checkpoint import BinlogCheckpoint
+from app.binlog.decoders import decode_rows
+from app.binlog.listener import commit_row, warm_start_marks
+from app.database.connection import get_db_connection
+from app.database.writer import TABLE_COLUMNS
+from config.logger import logger
+from config.settings import settings
+
+
+def load_table(table, window_start, window_end, fetch_size=500, marks=None):
+    """
+    Load the rows of one table collected in [window_start, window_end) into the cache.
+
+    Parameters:
+        table (str): Table name (a key of TABLE_COLUMNS).
+        window_start (datetime): Oldest collection time loaded.
+        window_end (datetime): Collection time at which the window ends (exclusive).
+        fetch_size (int): Rows fetched from the server-side cursor at a time.
+        marks (dict, optional): Receives {(patient_id, param_type): timestamp of the newest row}.
+
+    Returns:
+        int: Number of rows committed.
+    """
+    columns = ("patient_id", "collection_time") + TABLE_COLUMNS[table]
+    query = (
+        f"SELECT {', '.join(columns)} FROM {table} "
+        f"WHERE collection_time >= %s AND collection_time < %s "
+        f"ORDER BY collection_time"
+    )
+    committed = 0
+    conn = get_db_connection()
+    try:
+        with conn.cursor(SSCursor) as cursor:
+            cursor.execute(query, (window_start, window_end))
+            while True:
+                fetched = cursor.fetchmany(fetch_size)
+                if not fetched:
+                    break
+                rows = []
+                for row in fetched:
+                    values = dict(zip(columns, row))
+                    for column in TABLE_COLUMNS[table]:
+                        if isinstance(values[column], (str, bytes)):
+                            values[column] = json.loads(values[column])
+                    rows.append({"values": values})
+                for patient_id, param_type, data, timestamp in decode_rows(table, rows):
+                    commit_row(patient_id, param_type, data, timestamp, fanout=False)
+                    committed += 1
+                    # Rows come in collection_time order: the last one of a stream is its newest.
+                    if marks is not None:
+                        marks[(patient_id, param_type)] = timestamp
+    finally:
+        conn.close()
+    return committed
+
+
+def warm_start(seconds=None):
+    """
+    Load the recent history of every table into the cache and the active parameter table.
+
+    Parameters:
+        seconds (float, optional): Length of the window; defaults to WARM_START_SECONDS.
+
+    Returns:
+        dict: {table: rows committed} (-1 for a table that failed to load).
+    """
+    seconds = settings.WARM_START_SECONDS if seconds is None else seconds
+    # collection_time is a naive local DATETIME.
+    window_end = datetime.now()
+    if settings.BINLOG_CHECKPOINT_INTERVAL > 0:
+        checkpoint = BinlogCheckpoint(settings.BINLOG_CHECKPOINT_PATH, settings.BINLOG_CHECKPOINT_INTERVAL)
+        log_file, _ = checkpoint.load()
+        if log_file and checkpoint.saved_at:
+            window_end = min(window_end, datetime.fromtimestamp(checkpoint.saved_at))
+    window_start = datetime.fromtimestamp(time.time() - seconds)
+    if window_start >= window_end:
+        logger.info("Warm-start skipped: the binlog checkpoint covers the whole window")
+        return {}
+
+    started = time.monotonic()
+    loaded = {}
+    with ThreadPoolExecutor(max_workers=len(TABLE_COLUMNS), thread_name_prefix="WarmStart") as executor:
+        futures = {
+            # Every table has its own param types, so the loads never write the same key.
+            table: executor.submit(load_table, table, window_start, window_end, marks=warm_start_marks)
+            for table in TABLE_COLUMNS
+        }
+        for table, future in futures.items():
+            try:
+                loaded[table] = future.result()
+            except Exception as e:
+                loaded[table] = -1
+                logger.error(f"Warm-start of {table} failed: {str(e)}")
+    logger.info(
+        f"Warm-start loaded {sum(n for n in loaded.values() if n > 0)} rows from the last {seconds:.0f}s "
+        f"in {time.monotonic() - started:.1f}s: {loaded}"
+    )
+    return loaded
+
+
+def start_warm_start():
+    """
+    Start the warm-start in a background thread (join it before starting the binlog listener).
+
+    Returns:
+        Thread: The warm-start thread, or None if WARM_START_SECONDS is 0.
+    """
+    if settings.WARM_START_SECONDS <= 0:
+        return None
+    thread = Thread(target=warm_start, name="WarmStart", daemon=True)
+    thread.start()
+    return thread
@@ -4,24 +4,244 @@ Author: yadian zhao
 Institution: Canterbury University
 Description: This module implements a caching system for patient data.
              It provides thread-safe operations to update and retrieve data for different parameters
-             of a patient. The cache stores a fixed number of the latest records for each parameter.
+             of a patient. The cache stores a fixed number of the latest records for each parameter,
+             numbered with per-stream sequence numbers and indexed by timestamp
+             (see app/core/stream_history.py).
+             Reads never create entries. sweep() evicts parameters without writes for a TTL and,
+             over the memory budget, whole patients in least recently used order. An evicted
+             parameter is marked under its lock, so a write racing with the sweep moves to a
+             new entry instead of being lost, and its sequence numbers continue where the
+             evicted ones stopped (subscribers track "seq" across the eviction) if it is
+             written again within the TTL.
+             Reads do not take the per-parameter lock: every parameter carries a version counter
+             (a seqlock) that writes make odd while they modify the stream; a read that overlaps a
+             write is retried, and falls back to the lock only if writes keep overlapping.
+             A read that passes the version check returns a consistent snapshot, and readers
+             never block the ingest thread. In deque mode records are never modified once
+             appended. In ring mode the sample arrays of a record are zero-copy views of the
+             ring buffer (unless the window wraps around the end of the ring): the writer
+             overwrites them once the ring wraps, i.e. after ring_seconds of newer samples, so
+             they are valid only until then and callers that keep samples longer must copy them.
+             The encoded form of a record (e.g. its JSON text) is computed on its first send and
+             kept next to the parameter's records for its later sends and backfills.
+             In "ring" mode, waveform parameters are instead stored in preallocated NumPy ring
+             buffers holding a fixed number of seconds of samples (see app/core/ring_buffer.py).
+             With SHARED_CACHE_ROLE "writer" every record is also published to shared memory, and
+             with "reader" the global cache is a read-only view of it (see app/core/shared_cache.py).
 """
 
-from collections import defaultdict, deque
+import sys
+import time
 from threading import Lock
 
+import numpy as np
+
+from app.core.ring_buffer import WaveformRing
+from app.core.shared_cache import SharedCacheReader, SharedCacheWriter
+from app.core.stream_history import StreamHistory
+from config.settings import settings
+from config.logger import logger
+
+# Optimistic attempts of a read before it waits for the parameter's lock.
+READ_RETRIES = 8
+# Encoded records kept per parameter (the newest ones).
+ENCODED_RECORDS = 32
+
+
+def payload_nbytes(value):
+    """
+    Estimate the memory held by a cached payload (NumPy buffers, containers and scalars).
+    Shared objects such as interned keys are counted every time, so this is an upper bound.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes + 112
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(payload_nbytes(k) + payload_nbytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(payload_nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class CacheStream:
+    """
+    One cached patient parameter: its record stream and bookkeeping.
+    """
+    __slots__ = ("lock", "version", "stream", "first_seq", "evicted", "encoded", "last_updated", "written_at",
+                 "touched_at")
+
+    def __init__(self, first_seq=0):
+        """
+        Parameters:
+            first_seq (int): Sequence number of the first record (that of an evicted entry
+                             of the same parameter continues).
+        """
+        # Serializes writers. Readers check `version` instead: odd while a write is in progress.
+        self.lock = Lock()
+        self.version = 0
+        # StreamHistory or WaveformRing, created by the first write.
+        self.stream = None
+        self.first_seq = first_seq
+        # Set (under the lock) when sweep() removes the entry from the cache: writers holding
+        # it must write to a new entry instead.
+        self.evicted = False
+        # {(seq, format): encoded record} in insertion order, see PatientDataCache.encode_record.
+        self.encoded = {}
+        # Timestamp of the newest record.
+        self.last_updated = 0
+        # Monotonic times of the last write and of the last read or write (TTL and LRU eviction).
+        self.written_at = time.monotonic()
+        self.touched_at = self.written_at
+
+    @property
+    def nbytes(self):
+        encoded = sum(item.nbytes for item in list(self.encoded.values()))
+        return (self.stream.nbytes if self.stream is not None else 0) + encoded
+
+
 class PatientDataCache:
-    def __init__(self):
+    def __init__(self, mode="deque", depth=10, ring_seconds=60.0, ring_rates=None, ring_dtype="float32",
+                 ring_max_frames=1024, memory_budget=0, stream_ttl=0, mirror=None):
+        """
+        Parameters:
+            mode (str): "deque" or "ring".
+            depth (int): Records kept per parameter outside ring buffers.
+            ring_seconds (float): Seconds of samples kept per waveform parameter in ring mode.
+            ring_rates (dict): {param_type: sampling rate in Hz} of the waveform parameters
+                               stored in ring buffers.
+            ring_dtype (str): NumPy dtype of the ring buffers.
+            ring_max_frames (int): Frame records kept per ring.
+            memory_budget (int): Bytes the cached records may use; beyond it, sweep() evicts
+                                 whole patients, least recently used first (0 disables).
+            stream_ttl (float): Seconds without writes after which sweep() evicts a parameter
+                                (0 disables).
+            mirror (SharedCacheWriter, optional): Receives every new record, in sequence order
+                                                  for each parameter.
+        """
         # Initialize a nested dictionary cache:
         # Outer dict key: patient_id
-        # Inner dict key: param_type, value: a deque with a maximum length of 10
-        self._cache = defaultdict(lambda: defaultdict(lambda: deque(maxlen=10)))
+        # Inner dict key: param_type, value: a CacheStream whose stream is a StreamHistory of the
+        # last `depth` records or, for waveform parameters in ring mode, a WaveformRing.
+        # Every record carries a per-stream sequence number ("seq").
+        # Plain dicts: reads never create entries. Entries are added and removed under
+        # self._lock; lookups rely on dict.get being atomic.
+        self._cache = {}
+        self._lock = Lock()
+        self.depth = depth
+        self.ring_rates = dict(ring_rates or {}) if mode == "ring" else {}
+        self.ring_seconds = ring_seconds
+        self.ring_dtype = np.dtype(ring_dtype)
+        self.ring_max_frames = ring_max_frames
+        self.memory_budget = memory_budget
+        self.stream_ttl = stream_ttl
+        self.mirror = mirror
+        self.evicted_patients = 0
+        self.evicted_streams = 0
+        # {(patient_id, param_type): (next sequence number, monotonic eviction time)} of evicted
+        # parameters, so that a parameter recreated after an eviction keeps numbering its records
+        # upwards. Consumed when the parameter is written again, or dropped by sweep() once
+        # older than stream_ttl: a subscriber still resuming from an old seq after that long
+        # is treated like a new one (numbering restarts at 0, as for a new parameter). With
+        # stream_ttl 0 the bases are kept, one per parameter evicted for the memory budget.
+        self._seq_bases = {}
+        # Reads retried because a write overlapped them, and reads that fell back to the lock
+        # (approximate: updated without a lock).
+        self.read_retries = 0
+        self.locked_reads = 0
 
-        # Lock pool for thread-safe operations on each patient's parameter data.
-        # Structure: {patient_id: {param_type: Lock}}
-        self._lock_pool = defaultdict(lambda: defaultdict(Lock))
-        # Dictionary to store the last updated timestamp for each patient parameter.
-        self._last_updated = defaultdict(lambda: defaultdict(float))
+    def _entry(self, patient_id, param_type):
+        """
+        Return the CacheStream of a parameter, or None. Never creates entries.
+        """
+        streams = self._cache.get(patient_id)
+        return streams.get(param_type) if streams is not None else None
+
+    def _entry_for_write(self, patient_id, param_type):
+        """
+        Return the CacheStream of a parameter, creating it if needed.
+        """
+        entry = self._entry(patient_id, param_type)
+        if entry is None:
+            with self._lock:
+                streams = self._cache.setdefault(patient_id, {})
+                entry = streams.get(param_type)
+                if entry is None:
+                    first_seq, _ = self._seq_bases.pop((patient_id, param_type), (0, None))
+                    entry = streams[param_type] = CacheStream(first_seq)
+        return entry
+
+    def _evict(self, patient_id, param_type, entry):
+        """
+        Mark an entry removed from the cache and keep its next sequence number (called with
+        self._lock and the entry lock held).
+        """
+        entry.evicted = True
+        next_seq = entry.stream.last_seq + 1 if entry.stream is not None else entry.first_seq
+        if next_seq:
+            self._seq_bases[(patient_id, param_type)] = (next_seq, time.monotonic())
+
+    def _append(self, entry, patient_id, param_type, data, timestamp):
+        """
+        Append a record to the parameter's stream and return its sequence number
+        (called with the entry lock held).
+        A waveform ring is (re)created when the frame's channels differ from the ring's;
+        the new ring continues the sequence numbers.
+        """
+        stream = entry.stream
+        if param_type in self.ring_rates:
+            if stream is None or not stream.accepts(data):
+                if stream is not None:
+                    logger.info(f"Channels of {patient_id}/{param_type} changed, resetting its ring buffer")
+                stream = WaveformRing.for_frame(
+                    data,
+                    seconds=self.ring_seconds,
+                    rate=self.ring_rates[param_type],
+                    max_frames=self.ring_max_frames,
+                    dtype=self.ring_dtype,
+                    first_seq=stream.last_seq + 1 if stream is not None else entry.first_seq
+                )
+                entry.stream = stream
+        elif stream is None:
+            stream = StreamHistory(self.depth, sizeof=payload_nbytes, first_seq=entry.first_seq)
+            entry.stream = stream
+        seq = stream.append(data, timestamp)
+        if self.mirror is not None:
+            try:
+                self.mirror.write(patient_id, param_type, seq, data, timestamp)
+            except Exception as e:
+                logger.error(f"Error publishing {patient_id}/{param_type} to the shared cache: {str(e)}")
+        return seq
+
+    def _read(self, patient_id, param_type, read, default=None):
+        """
+        Call read(stream) without taking the parameter's lock, or return default if nothing
+        is cached. The read is retried if a write overlapped it (the version changed or was
+        odd); after READ_RETRIES attempts it is done under the lock.
+        """
+        entry = self._entry(patient_id, param_type)
+        if entry is None:
+            return default
+        entry.touched_at = time.monotonic()
+        for _ in range(READ_RETRIES):
+            version = entry.version
+            if not version % 2:
+                stream = entry.stream
+                try:
+                    result = default if stream is None else read(stream)
+                except Exception:
+                    # A read of a half-updated stream may fail; only a stable one is an error.
+                    if entry.version == version:
+                        raise
+                    result = None
+                if entry.version == version:
+                    return result
+            self.read_retries += 1
+            # Let the writer finish.
+            time.sleep(0)
+        self.locked_reads += 1
+        with entry.lock:
+            if entry.stream is None:
+                return default
+            return read(entry.stream)
 
     def update_data(self, patient_id, param_type, data, timestamp):
         """
@@ -32,15 +252,54 @@ class PatientDataCache:
             param_type: The type of parameter (e.g., ECG, pressure_flow).
             data: The data to store.
             timestamp: The time the data was recorded.
+
+        Returns:
+            int: The sequence number of the new record.
         """
-        with self._lock_pool[patient_id][param_type]:
-            # Append new data record with its timestamp to the deque.
-            self._cache[patient_id][param_type].append({
-                "data": data,
-                "timestamp": timestamp
-            })
-            # Update the last updated timestamp for this parameter.
-            self._last_updated[patient_id][param_type] = timestamp
+        while True:
+            entry = self._entry_for_write(patient_id, param_type)
+            with entry.lock:
+                # Evicted by sweep() since the lookup: write to the entry replacing it.
+                if entry.evicted:
+                    continue
+                entry.version += 1
+                try:
+                    seq = self._append(entry, patient_id, param_type, data, timestamp)
+                finally:
+                    entry.version += 1
+                # Update the last updated timestamp for this parameter.
+                entry.last_updated = timestamp
+                entry.written_at = entry.touched_at = time.monotonic()
+            return seq
+
+    def update_batch(self, patient_id, param_type, records):
+        """
+        Append several records for one patient parameter under a single lock acquisition.
+
+        Parameters:
+            patient_id: Unique identifier for the patient.
+            param_type: The type of parameter (e.g., ECG, pressure_flow).
+            records: List of (data, timestamp) tuples in arrival order.
+
+        Returns:
+            list: The sequence numbers of the new records.
+        """
+        if not records:
+            return []
+        while True:
+            entry = self._entry_for_write(patient_id, param_type)
+            with entry.lock:
+                # Evicted by sweep() since the lookup: write to the entry replacing it.
+                if entry.evicted:
+                    continue
+                entry.version += 1
+                try:
+                    seqs = [self._append(entry, patient_id, param_type, data, timestamp) for data, timestamp in records]
+                finally:
+                    entry.version += 1
+                entry.last_updated = records[-1][1]
+                entry.written_at = entry.touched_at = time.monotonic()
+            return seqs
 
     def get_data(self, patient_id, param_type, target_timestamp=None):
         """
@@ -49,27 +308,158 @@ class PatientDataCache:
         Parameters:
             patient_id: Unique identifier for the patient.
             param_type: The type of parameter.
-            target_timestamp: Optional; if provided, returns the data with exactly this timestamp.
-                              Otherwise, returns the latest data.
+            target_timestamp: Optional; if provided, returns the data with exactly this timestamp
+                              (the latest such record). Otherwise, returns the latest data.
                               
         Returns:
-            The data record matching the target timestamp, or the most recent record if no match is found.
-            Returns None if no data exists.
-        """
-        with self._lock_pool[patient_id][param_type]:
-            if not self._cache[patient_id][param_type]:
-                return None
-                
-            # If no specific timestamp is provided, return the latest data record.
-            if target_timestamp is None:
-                return self._cache[patient_id][param_type][-1]
-                
-            # Iterate in reverse to find the record with the target timestamp.
-            for item in reversed(self._cache[patient_id][param_type]):
-                if item["timestamp"] == target_timestamp:
-                    return item
-            # If not found, return the most recent record.
-            return self._cache[patient_id][param_type][-1]
+            The data record ({"data", "timestamp", "seq"}) matching the request.
+            Returns None if no data exists or no record has the target timestamp.
+            In ring mode its sample arrays are views valid only until the ring wraps.
+        """
+        # If no specific timestamp is provided, return the latest data record.
+        if target_timestamp is None:
+            return self._read(patient_id, param_type, lambda stream: stream.latest())
+        return self._read(patient_id, param_type, lambda stream: stream.find(target_timestamp))
+
+    def get_by_seq(self, patient_id, param_type, seq):
+        """
+        Retrieve the record with the given sequence number, or None if it is no longer cached.
+        """
+        return self._read(patient_id, param_type, lambda stream: stream.get(seq))
+
+    def get_nearest(self, patient_id, param_type, timestamp):
+        """
+        Retrieve the record whose timestamp is closest to `timestamp`, or None if no data exists.
+        """
+        return self._read(patient_id, param_type, lambda stream: stream.nearest(timestamp))
+
+    def get_range(self, patient_id, param_type, t_start, t_end):
+        """
+        Retrieve the records with t_start <= timestamp <= t_end.
+
+        Returns:
+            list: Records sorted by timestamp (empty if there are none).
+        """
+        return self._read(patient_id, param_type, lambda stream: stream.range(t_start, t_end), [])
+
+    def get_since(self, patient_id, param_type, seq):
+        """
+        Retrieve the records appended after the record with sequence number `seq`
+        (pass -1 for every cached record).
+
+        Returns:
+            list: Records in arrival order (empty if there are none). In ring mode their
+                  sample arrays are views valid only until the ring wraps.
+        """
+        return self._read(patient_id, param_type, lambda stream: stream.since(seq), [])
+
+    def get_last_seq(self, patient_id, param_type):
+        """
+        Return the sequence number of the newest record, or -1 if no data exists.
+        """
+        return self._read(patient_id, param_type, lambda stream: stream.last_seq, -1)
+
+    def encode_record(self, patient_id, param_type, record, encode, fmt="json"):
+        """
+        Return the encoded form of a cached record, encoding it only the first time.
+        The result is kept next to the parameter's records (the newest ENCODED_RECORDS per
+        parameter), so every subscriber and backfill reuses it. Two threads encoding the same
+        record at once may both compute it; the results are identical.
+
+        Parameters:
+            patient_id: Unique identifier for the patient.
+            param_type: The type of parameter.
+            record (dict): A record returned by this cache ({"data", "timestamp", "seq"}).
+            encode: Callable building the encoded form from the record's data
+                    (e.g. serialization.EncodedPayload).
+            fmt (str): Name of the encoding, part of the key.
+
+        Returns:
+            The encoded record.
+        """
+        entry = self._entry(patient_id, param_type)
+        if entry is None:
+            return encode(record["data"])
+        key = (record["seq"], fmt)
+        encoded = entry.encoded.get(key)
+        if encoded is None:
+            encoded = encode(record["data"])
+            entry.encoded[key] = encoded
+            while len(entry.encoded) > ENCODED_RECORDS:
+                entry.encoded.pop(next(iter(entry.encoded)), None)
+        return encoded
+
+    def get_encoded(self, patient_id, param_type, seq, encode, fmt="json"):
+        """
+        Retrieve the record with the given sequence number and its encoded form.
+
+        Returns:
+            tuple: (record, encoded), or (None, None) if the record is no longer cached.
+        """
+        record = self.get_by_seq(patient_id, param_type, seq)
+        if record is None:
+            return None, None
+        return record, self.encode_record(patient_id, param_type, record, encode, fmt)
+
+    def get_last_seconds(self, patient_id, param_type, seconds, rate=None):
+        """
+        Retrieve the last `seconds` of samples of a waveform parameter, all frames joined.
+        In ring mode the sample arrays are zero-copy views unless the window wraps around,
+        valid only until the ring wraps.
+
+        Parameters:
+            patient_id: Unique identifier for the patient.
+            param_type: The type of parameter.
+            seconds (float): Length of the window.
+            rate (float, optional): Sampling rate in Hz; defaults to the configured ring rate.
+
+        Returns:
+            dict: {"data": {channel: {"unit", "values"}}, "timestamp": latest frame timestamp},
+                  or None if no data exists.
+        """
+        rate = rate or self.ring_rates.get(param_type) or settings.CACHE_RING_RATES.get(param_type)
+        if not rate:
+            raise ValueError(f"No sampling rate configured for {param_type}")
+        count = int(seconds * rate)
+        if param_type in self.ring_rates:
+            return self._read(patient_id, param_type, lambda stream: stream.last_samples(count))
+        return self._read(patient_id, param_type, lambda stream: self._join_frames(list(stream), last=count))
+
+    def get_samples_since(self, patient_id, param_type, timestamp):
+        """
+        Retrieve the samples of every frame of a waveform parameter newer than `timestamp`,
+        all frames joined. In ring mode the sample arrays are zero-copy views unless the
+        window wraps around, valid only until the ring wraps.
+
+        Returns:
+            dict: {"data": {channel: {"unit", "values"}}, "timestamp": latest frame timestamp},
+                  or None if there is no newer frame.
+        """
+        if param_type in self.ring_rates:
+            return self._read(patient_id, param_type, lambda stream: stream.samples_since(timestamp))
+        return self._read(
+            patient_id,
+            param_type,
+            lambda stream: self._join_frames([item for item in stream if item["timestamp"] > timestamp])
+        )
+
+    @staticmethod
+    def _join_frames(frames, last=None):
+        """
+        Concatenate the channels of several waveform records (deque mode).
+        """
+        if not frames:
+            return None
+        channels = frames[-1]["data"].keys()
+        data = {}
+        for channel in channels:
+            values = np.concatenate([
+                np.asarray(item["data"][channel]["values"]) for item in frames if channel in item["data"]
+            ])
+            if last is not None:
+                values = values[len(values) - min(last, len(values)):]
+            data[channel] = {"unit": frames[-1]["data"][channel]["unit"], "values": values}
+        return {"data": data, "timestamp": frames[-1]["timestamp"]}
 
     def get_last_timestamp(self, patient_id, param_type):
         """
@@ -82,7 +472,115 @@ class PatientDataCache:
         Returns:
             The last updated timestamp, or 0 if no record is found.
         """
-        return self._last_updated[patient_id].get(param_type, 0)
+        entry = self._entry(patient_id, param_type)
+        return entry.last_updated if entry is not None else 0
+
+    def sweep(self):
+        """
+        Evict parameters without writes for stream_ttl seconds and drop the sequence bases of
+        parameters evicted more than stream_ttl seconds ago, then, while the cached records
+        exceed memory_budget, evict whole patients in least recently used order.
+
+        Returns:
+            tuple: (evicted parameters, evicted patients).
+        """
+        now = time.monotonic()
+        streams_evicted = 0
+        patients_evicted = 0
+        with self._lock:
+            if self.stream_ttl > 0:
+                for patient_id, streams in list(self._cache.items()):
+                    for param_type, entry in list(streams.items()):
+                        # Checked under the entry lock: a write in progress keeps the entry.
+                        with entry.lock:
+                            if now - entry.written_at <= self.stream_ttl:
+                                continue
+                            self._evict(patient_id, param_type, entry)
+                        del streams[param_type]
+                        streams_evicted += 1
+                    if not streams:
+                        del self._cache[patient_id]
+                        patients_evicted += 1
+                for key, (_, evicted_at) in list(self._seq_bases.items()):
+                    if now - evicted_at > self.stream_ttl:
+                        del self._seq_bases[key]
+
+            if self.memory_budget > 0:
+                sizes = {
+                    patient_id: (max(entry.touched_at for entry in streams.values()),
+                                 sum(entry.nbytes for entry in streams.values()))
+                    for patient_id, streams in self._cache.items()
+                }
+                total = sum(size for _, size in sizes.values())
+                if total > self.memory_budget:
+                    for patient_id in sorted(sizes, key=lambda pid: sizes[pid][0]):
+                        streams = self._cache.pop(patient_id)
+                        for param_type, entry in streams.items():
+                            with entry.lock:
+                                self._evict(patient_id, param_type, entry)
+                        streams_evicted += len(streams)
+                        patients_evicted += 1
+                        total -= sizes[patient_id][1]
+                        if total <= self.memory_budget:
+                            break
+
+        self.evicted_streams += streams_evicted
+        self.evicted_patients += patients_evicted
+        if streams_evicted:
+            logger.info(f"Cache sweep evicted {streams_evicted} parameters ({patients_evicted} patients)")
+        return streams_evicted, patients_evicted
+
+    def stats(self):
+        """
+        Report the estimated bytes held by the cache, per patient and per param_type.
+        """
+        with self._lock:
+            snapshot = [
+                (patient_id, param_type, entry.nbytes)
+                for patient_id, streams in self._cache.items()
+                for param_type, entry in streams.items()
+            ]
+        per_patient = {}
+        per_param_type = {}
+        for patient_id, param_type, nbytes in snapshot:
+            per_patient[str(patient_id)] = per_patient.get(str(patient_id), 0) + nbytes
+            per_param_type[param_type] = per_param_type.get(param_type, 0) + nbytes
+        stats = {
+            "total_bytes": sum(per_patient.values()),
+            "memory_budget": self.memory_budget,
+            "stream_ttl": self.stream_ttl,
+            "patients": len(per_patient),
+            "streams": len(snapshot),
+            "evicted_patients": self.evicted_patients,
+            "evicted_streams": self.evicted_streams,
+            "seq_bases": len(self._seq_bases),
+            "read_retries": self.read_retries,
+            "locked_reads": self.locked_reads,
+            "per_patient": per_patient,
+            "per_param_type": per_param_type
+        }
+        if self.mirror is not None:
+            stats["shared"] = self.mirror.stats()
+        return stats
 
 # Global instance of the PatientDataCache for use across the application.
-data_cache = PatientDataCache()
+# Reader processes serve the writer's shared memory instead of a local cache.
+if settings.SHARED_CACHE_ROLE == "reader":
+    data_cache = SharedCacheReader(settings.SHARED_CACHE_NAME)
+else:
+    data_cache = PatientDataCache(
+        mode=settings.CACHE_MODE,
+        depth=settings.CACHE_DEPTH,
+        ring_seconds=settings.CACHE_RING_SECONDS,
+        ring_rates=settings.CACHE_RING_RATES,
+        ring_dtype=settings.CACHE_RING_DTYPE,
+        ring_max_frames=settings.CACHE_RING_MAX_FRAMES,
+        memory_budget=int(settings.CACHE_MEMORY_BUDGET_MB * 1024 * 1024),
+        stream_ttl=settings.CACHE_STREAM_TTL,
+        mirror=SharedCacheWriter(
+            settings.SHARED_CACHE_NAME,
+            slots=settings.SHARED_CACHE_SLOTS,
+            depth=settings.CACHE_DEPTH,
+            record_bytes=settings.SHARED_CACHE_RECORD_BYTES
+        ) if settings.SHARED_CACHE_ROLE == "writer" else None
+    )
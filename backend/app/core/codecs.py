@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: This module implements the sample codecs of binary waveform messages.
+             A binary subscription chooses its codec ("codec" of get_parameters):
+               - "raw": little-endian float32 samples (4 bytes per sample).
+               - "delta16": each channel is quantized to a fixed step and sent as the first
+                 quantized value plus int16 differences of consecutive samples.
+               - "delta16+deflate": delta16, then the whole sample section is zlib-compressed.
+
+             Quantization error bound: a channel sent as "delta16" is decoded to within step / 2 of
+             the sent values (the step is set per channel in WAVEFORM_CODEC_STEPS and given in the
+             header). A channel whose differences do not fit in int16, or that has non-finite
+             samples, is sent as float32 instead ("encoding" of the channel in the header), so the
+             bound always holds and no sample is clipped.
+
+             Decoding (see decode_binary, the reference decoder):
+               1. Read the prefix (serialization.BINARY_PREFIX): magic, version, codec id, header
+                  length n; the JSON header follows, then the sample section.
+               2. codec "delta16+deflate": inflate the sample section (zlib format, e.g.
+                  DecompressionStream("deflate") in browsers).
+               3. For each channel of header["channels"], in order, with count = sum(counts):
+                    "float32": count little-endian float32 values;
+                    "delta16": count - 1 little-endian int16 differences d, then
+                               values = (first + [0, cumsum(d)]) * step;
+                  each channel's bytes are zero-padded to a multiple of 4 (aligned typed arrays).
+               4. "counts" splits the channel's values into the frames of header["frames"].
+"""
+
+import json
+import zlib
+
+import numpy as np
+
+# Codec names and their ids in the binary message prefix.
+CODECS = {"raw": 0, "delta16": 1, "delta16+deflate": 2}
+CODEC_NAMES = {codec_id: name for name, codec_id in CODECS.items()}
+INT16_MIN, INT16_MAX = np.iinfo(np.int16).min, np.iinfo(np.int16).max
+
+
+def _pad(data):
+    return data + b"\0" * (-len(data) % 4)
+
+
+def encode_channel(values, codec, step):
+    """
+    Encode the samples of one channel.
+
+    Parameters:
+        values (ndarray): The samples.
+        codec (str): One of CODECS.
+        step (float): Quantization step of the delta16 codecs.
+
+    Returns:
+        tuple: (header fields of the channel, sample bytes padded to a multiple of 4).
+    """
+    values = np.asarray(values)
+    if codec != "raw" and len(values) and step > 0 and np.isfinite(values).all():
+        quantized = np.rint(values / step).astype(np.int64)
+        deltas = np.diff(quantized)
+        if not len(deltas) or (deltas.min() >= INT16_MIN and deltas.max() <= INT16_MAX):
+            return (
+                {"encoding": "delta16", "step": step, "first": int(quantized[0])},
+                _pad(deltas.astype("<i2").tobytes())
+            )
+    return {"encoding": "float32"}, _pad(np.asarray(values, dtype="<f4").tobytes())
+
+
+def encode_samples(channels, codec, steps, default_step, deflate_level=1):
+    """
+    Encode the sample section of a binary message.
+
+    Parameters:
+        channels (list): (name, unit, counts, values) of every channel, values being the samples
+                         of all frames joined.
+        codec (str): One of CODECS.
+        steps (dict): {channel: quantization step} of the delta16 codecs.
+        default_step (float): Quantization step of the channels missing from steps.
+        deflate_level (int): zlib level of the "delta16+deflate" codec.
+
+    Returns:
+        tuple: (header "channels" list, sample section bytes).
+    """
+    header = []
+    parts = []
+    for name, unit, counts, values in channels:
+        fields, data = encode_channel(values, codec, steps.get(name, default_step))
+        header.append(dict({"name": name, "unit": unit, "counts": counts}, **fields))
+        parts.append(data)
+    body = b"".join(parts)
+    if codec == "delta16+deflate":
+        body = zlib.compress(body, deflate_level)
+    return header, body
+
+
+def decode_binary(message):
+    """
+    Reference decoder of binary waveform messages.
+
+    Parameters:
+        message (bytes): A message built by serialization.dumps_binary.
+
+    Returns:
+        tuple: (header dict, {channel: float64 ndarray of the samples of all frames}).
+    """
+    # Imported here: serialization imports this module.
+    from app.core.serialization import BINARY_MAGIC, BINARY_PREFIX
+
+    magic, _, codec_id, header_len = BINARY_PREFIX.unpack_from(message)
+    if magic != BINARY_MAGIC:
+        raise ValueError("Not a binary waveform message")
+    start = BINARY_PREFIX.size + header_len
+    header = json.loads(message[BINARY_PREFIX.size:start])
+    body = message[start:]
+    if CODEC_NAMES[codec_id] == "delta16+deflate":
+        body = zlib.decompress(body)
+
+    channels = {}
+    offset = 0
+    for channel in header["channels"]:
+        count = sum(channel["counts"])
+        if channel["encoding"] == "delta16":
+            deltas = np.frombuffer(body, dtype="<i2", count=max(count - 1, 0), offset=offset)
+            quantized = channel["first"] + np.concatenate(([0], np.cumsum(deltas, dtype=np.int64)))
+            channels[channel["name"]] = quantized[:count] * channel["step"]
+            size = 2 * max(count - 1, 0)
+        else:
+            channels[channel["name"]] = np.frombuffer(body, dtype="<f4", count=count, offset=offset).astype(np.float64)
+            size = 4 * count
+        offset += size + (-size % 4)
+    return header, channels
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: This module decimates waveform frames for subscribers that display fewer points
+             than the signal has samples (e.g. the tiles of a ward overview). A subscription asks
+             for a number of points per second and a method:
+               - "minmax": the frame is split into points / 2 equal buckets and the minimum and
+                 maximum of each bucket are kept, in time order (keeps spikes such as QRS
+                 complexes). Every bucket gives exactly two values, so their positions are
+                 implied: values 2i and 2i + 1 belong to bucket i.
+               - "lttb": Largest-Triangle-Three-Buckets, keeping the samples that best preserve the
+                 visual shape of the line. The kept samples are irregularly spaced, so these
+                 channels carry "positions", the index in the frame of every kept sample.
+             A frame is decimated once per distinct (method, points per second) and the result is
+             memoized in the cache next to the encoded records, so all subscribers at the same
+             rate share it.
+"""
+
+import numpy as np
+
+from app.core.serialization import is_waveform
+
+DECIMATION_METHODS = ("minmax", "lttb")
+
+
+def minmax(values, points):
+    """
+    Keep the minimum and maximum of each of points // 2 equal buckets.
+
+    Parameters:
+        values (ndarray): The samples.
+        points (int): Number of points kept (at least 2, at most len(values)).
+
+    Returns:
+        ndarray: Indices of the kept samples, two per bucket in time order.
+    """
+    buckets = max(1, min(points // 2, len(values)))
+    edges = np.linspace(0, len(values), buckets + 1).astype(np.int64)
+    positions = np.empty(2 * buckets, dtype=np.int64)
+    for i, (start, end) in enumerate(zip(edges[:-1], edges[1:])):
+        bucket = values[start:end]
+        low, high = start + int(np.argmin(bucket)), start + int(np.argmax(bucket))
+        positions[2 * i:2 * i + 2] = (low, high) if low <= high else (high, low)
+    return positions
+
+
+def lttb(values, points):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Parameters:
+        values (ndarray): The samples.
+        points (int): Number of points kept (at least 3; the first and last samples are kept).
+
+    Returns:
+        ndarray: Indices of the kept samples, increasing.
+    """
+    n = len(values)
+    if points >= n:
+        return np.arange(n, dtype=np.int64)
+    if points < 3:
+        return np.array([0, n - 1], dtype=np.int64)
+    # The samples between the first and the last are split into points - 2 buckets.
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    positions = np.empty(points, dtype=np.int64)
+    positions[0], positions[-1] = 0, n - 1
+    selected = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket (the last sample after the last bucket).
+        next_start, next_end = (end, edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x = (next_start + next_end - 1) / 2.0
+        avg_y = values[next_start:next_end].mean()
+        x = np.arange(start, end)
+        ax, ay = selected, values[selected]
+        areas = np.abs((ax - avg_x) * (values[start:end] - ay) - (ax - x) * (avg_y - ay))
+        selected = start + int(np.argmax(areas))
+        positions[i + 1] = selected
+    return positions
+
+
+DECIMATORS = {"minmax": minmax, "lttb": lttb}
+
+
+class DecimatedPayload:
+    """
+    Decimated view of one cached payload, computed once per (method, points per second).
+    """
+    __slots__ = ("data", "nbytes")
+
+    def __init__(self, data, method, points_per_second, rate):
+        """
+        Parameters:
+            data: The cached payload ("data" of a cache record).
+            method (str): One of DECIMATION_METHODS.
+            points_per_second (int): Target rate of the view.
+            rate (float): Sampling rate of the parameter (Hz).
+        """
+        self.data = data
+        self.nbytes = 0
+        if not is_waveform(data):
+            return
+        decimate = DECIMATORS[method]
+        view = {}
+        for channel, value in data.items():
+            values = value["values"]
+            # Rounded down: below the sampling rate, every channel is decimated.
+            points = max(2, int(points_per_second * len(values) / rate))
+            if points >= len(values):
+                view[channel] = value
+                continue
+            positions = decimate(values, points)
+            view[channel] = {"unit": value["unit"], "values": values[positions]}
+            if method == "lttb":
+                view[channel]["positions"] = positions
+            self.nbytes += view[channel]["values"].nbytes + positions.nbytes
+        self.data = view
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: This module implements the bounded event queue between ingestion and the send workers.
+             Pending events (cache sequence numbers) are keyed by (patient_id, param_type): all
+             pending events of one stream share a single entry, and a worker takes the whole
+             entry at once. The total number of pending events is bounded; what happens when producers outrun the
+             workers is selected by the overflow policy:
+
+             - "coalesce": every event is kept until the bound is reached. Beyond it, the pending
+               streams are coalesced, oldest first: a stream keeps only its latest event, a
+               waveform stream its latest max_merge_frames frames. If that is not enough, the
+               oldest pending events are dropped.
+             - "drop_oldest": every event is kept until the bound is reached, then the
+               oldest pending events are dropped.
+             - "block": producers (the ingest thread) wait until the workers free space.
+
+             ShardedEventQueue splits the queue into one CoalescingEventQueue per send worker and
+             routes every stream to a shard by a hash of its key. A stream is then only ever taken
+             by one worker, so its events are sent in order whatever the number of workers.
+"""
+
+from collections import OrderedDict
+from threading import Condition
+
+OVERFLOW_POLICIES = ("coalesce", "drop_oldest", "block")
+
+
+class CoalescingEventQueue:
+    def __init__(self, maxsize=10000, policy="coalesce", merge_types=(), max_merge_frames=10):
+        """
+        Parameters:
+            maxsize (int): Maximum number of pending events over all streams.
+            policy (str): Overflow policy, one of OVERFLOW_POLICIES.
+            merge_types (iterable): Waveform param types whose pending frames are merged into one
+                                    message under the "coalesce" policy.
+            max_merge_frames (int): Maximum number of frames merged for one stream; older frames
+                                    are dropped (the cache does not keep more frames anyway).
+        """
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown event queue policy {policy!r}, expected one of {OVERFLOW_POLICIES}")
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.merge_types = frozenset(merge_types)
+        self.max_merge_frames = max(1, max_merge_frames)
+        # {(patient_id, param_type): [seq, ...]} in the order the streams became pending.
+        self._entries = OrderedDict()
+        self._depth = 0
+        self._unfinished = 0
+        self._cond = Condition()
+        self.enqueued = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.max_depth = 0
+
+    def put(self, key, events):
+        """
+        Add the events of one stream.
+
+        Parameters:
+            key (tuple): (patient_id, param_type).
+            events (list): Cache sequence numbers, oldest first.
+        """
+        if not events:
+            return
+        with self._cond:
+            if self.policy == "block" and self._depth + len(events) > self.maxsize:
+                self.blocked += 1
+                # A single oversized put is accepted once the queue is empty.
+                while self._depth and self._depth + len(events) > self.maxsize:
+                    self._cond.wait()
+
+            self.enqueued += len(events)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = list(events)
+                self._depth += len(events)
+                self._unfinished += 1
+            else:
+                entry.extend(events)
+                self._depth += len(events)
+
+            if self._depth > self.maxsize and self.policy == "coalesce":
+                self._coalesce()
+            if self._depth > self.maxsize and self.policy != "block":
+                self._drop_oldest(self._depth - self.maxsize)
+            if self._depth > self.max_depth:
+                self.max_depth = self._depth
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """
+        Take the oldest pending stream entry.
+
+        Returns:
+            tuple: ((patient_id, param_type), [seq, ...]), or None on timeout.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._entries, timeout):
+                return None
+            key, events = self._entries.popitem(last=False)
+            self._depth -= len(events)
+            self._cond.notify_all()
+            return key, events
+
+    def merges(self, param_type):
+        """
+        Return True if pending frames of this param type are sent as one multi-frame message.
+        """
+        return self.policy == "coalesce" and param_type in self.merge_types
+
+    def task_done(self):
+        with self._cond:
+            self._unfinished -= 1
+            if self._unfinished <= 0:
+                self._unfinished = 0
+                self._cond.notify_all()
+
+    def join(self):
+        """
+        Block until every entry taken by get() has been marked done.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._unfinished == 0)
+
+    def qsize(self):
+        return self._depth
+
+    def stats(self):
+        with self._cond:
+            return {
+                "policy": self.policy,
+                "depth": self._depth,
+                "max_depth": self.max_depth,
+                "pending_streams": len(self._entries),
+                "enqueued": self.enqueued,
+                "coalesced": self.coalesced,
+                "dropped": self.dropped,
+                "blocked": self.blocked
+            }
+
+    def _coalesce(self):
+        """
+        Shrink the pending streams, oldest first, until the queue is back within its bound
+        (called with the condition held): a stream keeps its latest event, a waveform stream
+        its latest max_merge_frames frames.
+        """
+        for key, entry in self._entries.items():
+            if self._depth <= self.maxsize:
+                return
+            keep = self.max_merge_frames if key[1] in self.merge_types else 1
+            excess = len(entry) - keep
+            if excess <= 0:
+                continue
+            del entry[:excess]
+            self._depth -= excess
+            if keep == 1:
+                self.coalesced += excess
+            else:
+                self.dropped += excess
+
+    def _drop_oldest(self, count):
+        """
+        Drop the oldest pending events (called with the condition held).
+        """
+        dropped = 0
+        while count > 0 and self._entries:
+            key, entry = next(iter(self._entries.items()))
+            n = min(count, len(entry))
+            del entry[:n]
+            count -= n
+            dropped += n
+            if not entry:
+                del self._entries[key]
+                self._unfinished -= 1
+        self._depth -= dropped
+        self.dropped += dropped
+
+
+class ShardedEventQueue:
+    def __init__(self, shards=1, maxsize=10000, **options):
+        """
+        Parameters:
+            shards (int): Number of shards (one per consumer thread).
+            maxsize (int): Maximum number of pending events over all shards, split evenly.
+            options: Other CoalescingEventQueue parameters (policy, merge_types, max_merge_frames).
+        """
+        self.shards = [
+            CoalescingEventQueue(maxsize=max(1, maxsize // max(1, shards)), **options)
+            for _ in range(max(1, shards))
+        ]
+
+    def shard(self, key):
+        """
+        Return the shard holding the events of a stream.
+
+        Parameters:
+            key (tuple): (patient_id, param_type).
+        """
+        return self.shards[hash(key) % len(self.shards)]
+
+    def put(self, key, events):
+        self.shard(key).put(key, events)
+
+    def merges(self, param_type):
+        return self.shards[0].merges(param_type)
+
+    def join(self):
+        """
+        Block until every entry of every shard has been marked done.
+        """
+        for shard in self.shards:
+            shard.join()
+
+    def qsize(self):
+        return sum(shard.qsize() for shard in self.shards)
+
+    def stats(self):
+        shard_stats = [shard.stats() for shard in self.shards]
+        stats = {"policy": shard_stats[0]["policy"], "shards": len(shard_stats)}
+        for name in ("depth", "max_depth", "pending_streams", "enqueued", "coalesced", "dropped", "blocked"):
+            stats[name] = sum(shard[name] for shard in shard_stats)
+        stats["shard_depths"] = [shard["depth"] for shard in shard_stats]
+        return stats
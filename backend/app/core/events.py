@@ -6,23 +6,120 @@ Description: This module implements a notifier system for data updates.
              It manages subscriptions to patient data parameters over websockets,
              allowing clients to subscribe or unsubscribe to specific parameter updates.
              The notifier also logs subscription activities.
+             A subscription that starts with a backfill carries a watermark per parameter: the
+             last sequence number the backfill covers. Live records up to the watermark are not
+             sent to that websocket, so the backfill and the live stream neither overlap nor
+             leave a gap.
+             A subscription also has a message format, "json" or "binary" (waveforms as packed
+             float32 arrays, see app/core/serialization.py) with a sample codec (app/core/codecs.py);
+             only binary subscriptions are tracked. A waveform subscription may also ask for a
+             decimated view, (method, points per second) (app/core/decimation.py), and may opt
+             into multi-frame messages (get_parameters_frames, several pending waveform frames in
+             one message); the others get one get_parameters message per frame.
+
+             The registry is copy-on-write: every (patient_id, param_type) maps to an immutable
+             StreamSubscription snapshot, replaced as a whole when its subscribers change. The
+             send path (has_subscribers, get_subscribers, ...) reads the current snapshot with
+             one dict lookup, without taking the lock or copying a set; the lock only serializes
+             the writers, which rebuild the snapshots of the keys they change and nothing else.
+
+             Pattern subscriptions (subscribe_pattern) name a set of patients or every patient
+             (None), and a set of parameter types or all of them. A pattern is resolved into plain
+             per-stream subscriptions: against the streams already seen when it is made, and
+             against every new stream when attach() first sees it (SendDataManager.add_event, on
+             every ingest path). Patterns are indexed by patient (patterns naming patients), by
+             parameter type (patterns for every patient) or kept as full wildcards, so resolving
+             a stream only visits the patterns that can match it; the send path is unchanged and
+             costs O(matching subscribers). The seen streams are released by forget_streams()
+             when the activity tracker evicts a long-inactive stream, so they stay bounded by
+             the live streams; a forgotten stream is attached again on its next live row.
 """
 
-from collections import defaultdict
 import threading
 
 from config.logger import logger
 
 
+class StreamSubscription:
+    """
+    Immutable snapshot of the subscribers of one (patient_id, param_type).
+    Never modified once published: writers publish a new snapshot instead.
+    """
+    __slots__ = ("websockets", "binary", "views", "frames")
+
+    def __init__(self, websockets=frozenset(), binary=None, views=None, frames=frozenset()):
+        """
+        Parameters:
+            websockets (frozenset): The subscribed websockets.
+            binary (dict): {websocket: codec} of the binary format subscribers.
+            views (dict): {websocket: (method, points_per_second)} of the decimated subscribers.
+            frames (frozenset): The subscribers accepting multi-frame messages.
+        """
+        self.websockets = websockets
+        self.binary = binary or {}
+        self.views = views or {}
+        self.frames = frames
+
+
+EMPTY_SUBSCRIPTION = StreamSubscription()
+
+
+class SubscriptionPattern:
+    """
+    A pattern subscription of one websocket.
+    """
+    __slots__ = ("patient_ids", "param_types", "fmt", "codec", "view", "multi_frame")
+
+    def __init__(self, patient_ids=None, param_types=None, fmt="json", codec="raw", view=None, multi_frame=False):
+        """
+        Parameters:
+            patient_ids (frozenset, optional): Patients matched, None for every patient.
+            param_types (frozenset, optional): Parameter types matched, None for all of them.
+            fmt, codec, view, multi_frame: As in DataUpdateNotifier.subscribe.
+        """
+        self.patient_ids = patient_ids
+        self.param_types = param_types
+        self.fmt = fmt
+        self.codec = codec
+        self.view = view
+        self.multi_frame = multi_frame
+
+    def matches(self, patient_id, param_type):
+        return ((self.patient_ids is None or patient_id in self.patient_ids) and
+                (self.param_types is None or param_type in self.param_types))
+
+
 class DataUpdateNotifier:
     def __init__(self):
-        # Three-level subscription structure:
-        # patient_id -> param_type -> set of websockets subscribed to that parameter.
-        self.subscriptions = defaultdict(lambda: defaultdict(set))
-        # Lock to ensure thread-safe operations on the subscriptions dictionary.
+        # (patient_id, param_type) -> StreamSubscription, only for keys with subscribers.
+        # Readers look keys up without the lock: a dict lookup, and the replacement of one
+        # value, are atomic, and snapshots are never modified.
+        self.streams = {}
+        # websocket -> set of its (patient_id, param_type) keys, so that removing a websocket
+        # touches only its own keys (writers only).
+        self._keys = {}
+        # Backfill watermarks: (patient_id, param_type) -> {websocket: last backfilled seq}.
+        # Modified under the lock; readers only take it when the key has watermarks.
+        self.watermarks = {}
+        # Pattern subscriptions: websocket -> [SubscriptionPattern], and their index:
+        # patient_id -> {websocket: [pattern]} for patterns naming patients, param_type ->
+        # {websocket: [pattern]} for patterns over every patient, and the full wildcards.
+        self.patterns = {}
+        self._patterns_by_patient = {}
+        self._patterns_by_param = {}
+        self._wildcard_patterns = {}
+        # Streams seen by attach(), indexed both ways: patient_id -> {param_type} and
+        # param_type -> {patient_id}. Readers only test membership of a key in _seen. Pruned
+        # by forget_streams().
+        self._seen = set()
+        self._seen_by_patient = {}
+        self._seen_by_param = {}
+        # Lock serializing the writers (subscription changes and watermark updates).
         self.lock = threading.Lock()
+        self.changes = 0
 
-    def subscribe(self, patient_id, param_types, websocket):
+    def subscribe(self, patient_id, param_types, websocket, watermark=None, fmt="json", codec="raw", view=None,
+                  multi_frame=False):
         """
         Subscribe a websocket to updates for specified parameter types of a patient.
 
@@ -30,13 +127,184 @@ class DataUpdateNotifier:
             patient_id: The unique identifier for the patient.
             param_types: A list of parameter types to subscribe to.
             websocket: The websocket connection to be subscribed.
+            watermark: Optional callable param_type -> last cached sequence number, called under
+                       the lock right after subscribing. Records up to that sequence number are
+                       left to a backfill and not sent live to this websocket.
+            fmt (str): Message format of the subscription, "json" or "binary".
+            codec (str): Sample codec of a binary subscription, one of codecs.CODECS.
+            view (tuple, optional): (method, points_per_second) of a decimated subscription.
+            multi_frame (bool): Whether the websocket accepts get_parameters_frames messages.
+
+        Returns:
+            dict: {param_type: watermark} (empty without a watermark callable).
         """
+        marks = {}
         with self.lock:
             for param in param_types:
-                self.subscriptions[patient_id][param].add(websocket)
-            logger.info(f"Subscribed: {patient_id}/{param_types}")
-            # Log the current subscription list.
-            self._log_subscriptions()
+                key = (patient_id, param)
+                if watermark is not None:
+                    # Placeholder covering every record, registered before the snapshot is
+                    # published: a reader seeing the new subscriber also sees the key in
+                    # watermarks and waits on the lock for the real watermark.
+                    self.watermarks.setdefault(key, {})[websocket] = float("inf")
+                self._add_subscription(key, websocket, fmt, codec, view, multi_frame)
+                if watermark is not None:
+                    marks[param] = watermark(param)
+                    self.watermarks[key][websocket] = marks[param]
+        logger.info(f"Subscribed {id(websocket)}: {patient_id}/{param_types}")
+        return marks
+
+    def subscribe_pattern(self, websocket, patient_ids=None, param_types=None, fmt="json", codec="raw", view=None,
+                          multi_frame=False):
+        """
+        Subscribe a websocket to every stream matching a pattern, now and as streams appear.
+
+        Parameters:
+            websocket: The websocket connection to be subscribed.
+            patient_ids: Iterable of patient ids, or None for every patient.
+            param_types: Iterable of parameter types, or None for all of them.
+            fmt, codec, view, multi_frame: As in subscribe.
+
+        Returns:
+            list: The (patient_id, param_type) streams subscribed to right away.
+        """
+        pattern = SubscriptionPattern(
+            None if patient_ids is None else frozenset(patient_ids),
+            None if param_types is None else frozenset(param_types),
+            fmt, codec, view, multi_frame
+        )
+        with self.lock:
+            self.patterns.setdefault(websocket, []).append(pattern)
+            for index in self._pattern_indexes(pattern):
+                index.setdefault(websocket, []).append(pattern)
+            # Streams already seen, found through the index of the pattern's finite side.
+            if pattern.patient_ids is not None:
+                keys = [(patient_id, param) for patient_id in pattern.patient_ids
+                        for param in self._seen_by_patient.get(patient_id, ())]
+            elif pattern.param_types is not None:
+                keys = [(patient_id, param) for param in pattern.param_types
+                        for patient_id in self._seen_by_param.get(param, ())]
+            else:
+                keys = list(self._seen)
+            keys = [key for key in keys if pattern.matches(*key)]
+            for key in keys:
+                self._add_subscription(key, websocket, fmt, codec, view, multi_frame)
+        logger.info(
+            f"Pattern subscription {id(websocket)}: patients "
+            f"{'*' if patient_ids is None else sorted(pattern.patient_ids, key=str)}, params "
+            f"{'*' if param_types is None else sorted(pattern.param_types)}: {len(keys)} streams"
+        )
+        return keys
+
+    def _pattern_indexes(self, pattern):
+        """
+        Return the index dicts ({websocket: [pattern]}) a pattern is filed in (writers only).
+        """
+        if pattern.patient_ids is not None:
+            return [self._patterns_by_patient.setdefault(patient_id, {}) for patient_id in pattern.patient_ids]
+        if pattern.param_types is not None:
+            return [self._patterns_by_param.setdefault(param, {}) for param in pattern.param_types]
+        return [self._wildcard_patterns]
+
+    def remove_patterns(self, websocket):
+        """
+        Remove the pattern subscriptions of a websocket. The streams they attached stay
+        subscribed until unsubscribed (e.g. with remove_websocket).
+        """
+        with self.lock:
+            self._remove_patterns(websocket)
+
+    def _remove_patterns(self, websocket):
+        for pattern in self.patterns.pop(websocket, ()):
+            if pattern.patient_ids is not None:
+                index, values = self._patterns_by_patient, pattern.patient_ids
+            elif pattern.param_types is not None:
+                index, values = self._patterns_by_param, pattern.param_types
+            else:
+                self._wildcard_patterns.pop(websocket, None)
+                continue
+            for value in values:
+                entries = index.get(value)
+                if entries is not None:
+                    entries.pop(websocket, None)
+                    if not entries:
+                        del index[value]
+
+    def attach(self, patient_id, param_type):
+        """
+        Record a stream, subscribing the matching pattern subscriptions the first time it is
+        seen. Lock-free once the stream is known.
+        """
+        key = (patient_id, param_type)
+        if key in self._seen:
+            return
+        with self.lock:
+            if key in self._seen:
+                return
+            self._seen_by_patient.setdefault(patient_id, set()).add(param_type)
+            self._seen_by_param.setdefault(param_type, set()).add(patient_id)
+            # {websocket: first matching pattern}: a websocket may have patterns in several indexes.
+            matched = {}
+            for index in (self._patterns_by_patient.get(patient_id), self._patterns_by_param.get(param_type),
+                          self._wildcard_patterns):
+                for websocket, patterns in (index or {}).items():
+                    if websocket in matched:
+                        continue
+                    for pattern in patterns:
+                        if pattern.matches(patient_id, param_type):
+                            matched[websocket] = pattern
+                            break
+            for websocket, pattern in matched.items():
+                self._add_subscription(key, websocket, pattern.fmt, pattern.codec, pattern.view, pattern.multi_frame)
+            # Added last: a reader skipping attach() sees the subscriptions already published.
+            self._seen.add(key)
+        if matched:
+            logger.info(f"New stream {patient_id}/{param_type}: attached {len(matched)} pattern subscriptions")
+
+    def forget_streams(self, keys):
+        """
+        Forget streams evicted for inactivity (ActivityTracker on_evict). Their subscriptions
+        are kept; the matching patterns are resolved again when attach() next sees them.
+
+        Parameters:
+            keys: Iterable of (patient_id, param_type).
+        """
+        forgotten = 0
+        with self.lock:
+            for key in keys:
+                if key not in self._seen:
+                    continue
+                self._seen.discard(key)
+                patient_id, param_type = key
+                for index, value, member in ((self._seen_by_patient, patient_id, param_type),
+                                             (self._seen_by_param, param_type, patient_id)):
+                    members = index.get(value)
+                    if members is not None:
+                        members.discard(member)
+                        if not members:
+                            del index[value]
+                forgotten += 1
+        if forgotten:
+            logger.info(f"Forgot {forgotten} evicted streams")
+
+    def _add_subscription(self, key, websocket, fmt, codec, view, multi_frame=False):
+        """
+        Publish a snapshot of a key with a websocket added (writers only, under the lock).
+        """
+        current = self.streams.get(key, EMPTY_SUBSCRIPTION)
+        binary = dict(current.binary)
+        views = dict(current.views)
+        if fmt == "binary":
+            binary[websocket] = codec
+        else:
+            binary.pop(websocket, None)
+        if view is not None:
+            views[websocket] = view
+        else:
+            views.pop(websocket, None)
+        frames = current.frames | {websocket} if multi_frame else current.frames - {websocket}
+        self._publish(key, StreamSubscription(current.websockets | {websocket}, binary, views, frames))
+        self._keys.setdefault(websocket, set()).add(key)
 
     def unsubscribe(self, patient_id, param_types, websocket):
         """
@@ -51,61 +319,151 @@ class DataUpdateNotifier:
         with self.lock:
             # Handle unsubscribing from all parameters.
             if not param_types:
-                for param in list(self.subscriptions[patient_id].keys()):
-                    self._remove_subscription(patient_id, param, websocket)
-                logger.info(f"{websocket} unsubscribed from all parameters")
-                # Log the current subscription list.
-                self._log_subscriptions()
+                for key in [key for key in self._keys.get(websocket, ()) if key[0] == patient_id]:
+                    self._remove_subscription(key, websocket)
+                logger.info(f"{id(websocket)} unsubscribed from all parameters of {patient_id}")
                 return
 
             # Handle unsubscribing from specified parameter types.
             for param in param_types:
-                self._remove_subscription(patient_id, param, websocket)
-                logger.info(f"{websocket} unsubscribed from {patient_id}/{param}")
-            # Log the current subscription list.
-            self._log_subscriptions()
+                self._remove_subscription((patient_id, param), websocket)
+            logger.info(f"{id(websocket)} unsubscribed from {patient_id}/{param_types}")
 
-    def _remove_subscription(self, patient_id, param_type, websocket):
+    def remove_websocket(self, websocket):
+        """
+        Unsubscribe a websocket from every parameter of every patient and remove its pattern
+        subscriptions (e.g. after a failed send or on disconnect).
+        """
+        with self.lock:
+            self._remove_patterns(websocket)
+            for key in list(self._keys.get(websocket, ())):
+                self._remove_subscription(key, websocket)
+
+    def _publish(self, key, subscription):
+        """
+        Replace the snapshot of a key (writers only, under the lock).
+        """
+        if subscription.websockets:
+            self.streams[key] = subscription
+        else:
+            self.streams.pop(key, None)
+        self.changes += 1
+
+    def _remove_watermark(self, key, websocket):
+        marks = self.watermarks.get(key)
+        if marks is not None:
+            marks.pop(websocket, None)
+            if not marks:
+                del self.watermarks[key]
+
+    def _remove_subscription(self, key, websocket):
         """
         Helper method to remove a websocket subscription for a given patient and parameter type.
 
         Parameters:
-            patient_id: The unique identifier for the patient.
-            param_type: The parameter type.
+            key (tuple): (patient_id, param_type).
             websocket: The websocket connection to be removed.
         """
-        if websocket in self.subscriptions[patient_id][param_type]:
-            self.subscriptions[patient_id][param_type].remove(websocket)
-            # Clean up empty sets.
-            if not self.subscriptions[patient_id][param_type]:
-                del self.subscriptions[patient_id][param_type]
-            # Clean up patient record if no parameters remain.
-            if not self.subscriptions[patient_id]:
-                del self.subscriptions[patient_id]
+        self._remove_watermark(key, websocket)
+        keys = self._keys.get(websocket)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys[websocket]
+        current = self.streams.get(key)
+        if current is None or websocket not in current.websockets:
+            return
+        binary = current.binary
+        if websocket in binary:
+            binary = {ws: codec for ws, codec in binary.items() if ws is not websocket}
+        views = current.views
+        if websocket in views:
+            views = {ws: view for ws, view in views.items() if ws is not websocket}
+        self._publish(key, StreamSubscription(current.websockets - {websocket}, binary, views, current.frames - {websocket}))
 
-    def get_subscribers(self, patient_id, param_type):
+    def has_subscribers(self, patient_id, param_type):
         """
-        Retrieve a copy of the set of websockets subscribed to a specific patient's parameter.
+        Return whether any websocket is subscribed to a patient's parameter (lock-free).
+        """
+        return (patient_id, param_type) in self.streams
+
+    def get_subscribers(self, patient_id, param_type, seq=None):
+        """
+        Retrieve the websockets subscribed to a specific patient's parameter.
 
         Parameters:
             patient_id: The unique identifier for the patient.
             param_type: The parameter type.
+            seq: Optional sequence number of the record being sent; websockets whose backfill
+                 already covered it are left out. A watermark is dropped once a later record
+                 is sent.
 
         Returns:
-            A copy of the set containing the subscribed websockets.
+            frozenset: The subscribed websockets (the registry's snapshot, not a copy).
         """
+        key = (patient_id, param_type)
+        subscribers = self.streams.get(key, EMPTY_SUBSCRIPTION).websockets
+        if seq is None or key not in self.watermarks:
+            return subscribers
         with self.lock:
-            return self.subscriptions[patient_id][param_type].copy()
+            marks = self.watermarks.get(key)
+            if not marks:
+                return subscribers
+            covered = set()
+            for websocket, mark in list(marks.items()):
+                if seq <= mark:
+                    covered.add(websocket)
+                else:
+                    del marks[websocket]
+            if not marks:
+                del self.watermarks[key]
+        return subscribers - covered if covered else subscribers
+
+    def get_binary_subscribers(self, patient_id, param_type):
+        """
+        Retrieve the websockets receiving a parameter in the binary format.
+
+        Returns:
+            dict: {websocket: codec} (the registry's snapshot: read-only).
+        """
+        return self.streams.get((patient_id, param_type), EMPTY_SUBSCRIPTION).binary
+
+    def get_views(self, patient_id, param_type):
+        """
+        Retrieve the decimated views of a parameter's subscribers.
+
+        Returns:
+            dict: {websocket: (method, points_per_second)} (the registry's snapshot: read-only).
+        """
+        return self.streams.get((patient_id, param_type), EMPTY_SUBSCRIPTION).views
+
+    def get_frame_subscribers(self, patient_id, param_type):
+        """
+        Retrieve the websockets accepting multi-frame messages for a parameter.
+
+        Returns:
+            frozenset: The opted-in websockets (the registry's snapshot).
+        """
+        return self.streams.get((patient_id, param_type), EMPTY_SUBSCRIPTION).frames
 
     def _log_subscriptions(self):
         """
-        Log the current subscriptions.
+        Log the current subscriptions (periodically, see binlog.listener.monitor_active_params).
         Each line is formatted as: patient_id/param: websocket_id1, websocket_id2, ...
         """
-        for patient_id, params in self.subscriptions.items():
-            for param, websockets in params.items():
-                ws_ids = [str(id(ws)) for ws in websockets]
-                logger.info(f"{patient_id}/{param}: {', '.join(ws_ids)}")
+        for (patient_id, param), subscription in list(self.streams.items()):
+            ws_ids = [str(id(ws)) for ws in subscription.websockets]
+            logger.info(f"{patient_id}/{param}: {', '.join(ws_ids)}")
+
+    def stats(self):
+        return {
+            "streams": len(self.streams),
+            "websockets": len(self._keys),
+            "watermarks": len(self.watermarks),
+            "patterns": sum(len(patterns) for patterns in self.patterns.values()),
+            "seen_streams": len(self._seen),
+            "changes": self.changes
+        }
 
 
 # Global instance of the notifier for use across the application.
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: This module implements the asyncio fan-out engine (FANOUT_ENGINE = "asyncio").
+             Ingest threads put events in the send queue and signal the engine with at most one
+             call_soon_threadsafe per put; the engine drains the queue inside the event loop,
+             builds each message once and hands it to the sender task of every subscribed
+             connection. Each connection has one long-lived sender task that writes its
+             messages in order, so there is no cross-thread future and no loop wakeup per socket
+             and per frame. Failed sends are counted, logged and reported to on_error.
+
+             Each connection's queue is bounded (CONNECTION_QUEUE_MAX_MESSAGES) with a slow-consumer
+             policy (CONNECTION_QUEUE_POLICY), so one slow client cannot pile up an unbounded
+             backlog on the event loop; see Connection. The "threads" engine uses the same
+             connections: its workers hand their messages over with send_threadsafe.
+"""
+
+import asyncio
+import time
+import weakref
+from collections import deque
+
+from app.core.metrics import delivery_latency
+from config.logger import logger
+
+# Slow-consumer policies of the per-connection queues (CONNECTION_QUEUE_POLICY).
+CONNECTION_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+
+class Connection:
+    """
+    Outbound side of one websocket: a bounded queue of messages and the task sending them.
+
+    A queue entry is [key, waveform, message, event_time, queued_at], key being the
+    (patient_id, param_type) of a data message (None for other messages). When more than
+    max_pending messages are pending, or the oldest one has waited more than max_lag seconds
+    ("disconnect" policy), the engine's policy applies:
+      - "drop_oldest": the oldest pending waveform message is dropped (the oldest message if
+        none is a waveform).
+      - "coalesce": once the connection is behind (max_pending messages pending, or the oldest
+        one waiting more than max_lag seconds), a new data message replaces the pending one of
+        the same stream, keeping its place in the queue; until then every message is kept.
+        Beyond the bound messages are dropped as with "drop_oldest".
+      - "disconnect": the websocket is closed.
+    """
+    def __init__(self, websocket, engine):
+        self.websocket = websocket
+        self.engine = engine
+        self.pending = deque()
+        # {key: pending entry} of the data messages, for the coalesce policy.
+        self._latest = {}
+        self._wakeup = asyncio.Event()
+        # queued_at of the message being sent, None when idle.
+        self._sending_since = None
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_pending = 0
+        self.max_lag = 0.0
+        self.task = engine.loop.create_task(self._run())
+
+    def put(self, message, event_time, key=None, waveform=False):
+        if self.closed:
+            return
+        now = time.monotonic()
+        if self.engine.policy == "coalesce" and key is not None and (
+                len(self.pending) >= self.engine.max_pending or self.lag(now) > self.engine.max_lag):
+            entry = self._latest.get(key)
+            if entry is not None:
+                # The replaced message keeps its queue position and queued_at (the lag).
+                entry[1:4] = [waveform, message, event_time]
+                self.coalesced += 1
+                return
+        entry = [key, waveform, message, event_time, now]
+        self.pending.append(entry)
+        if key is not None:
+            self._latest[key] = entry
+
+        if len(self.pending) > self.engine.max_pending:
+            if self.engine.policy == "disconnect":
+                self.engine._disconnect(self, f"{len(self.pending)} messages pending")
+                return
+            self._drop_oldest()
+        elif self.engine.policy == "disconnect" and self.lag(now) > self.engine.max_lag:
+            self.engine._disconnect(self, f"lagging {self.lag(now):.1f}s behind")
+            return
+        self.max_pending = max(self.max_pending, len(self.pending))
+        self._wakeup.set()
+
+    def _drop_oldest(self):
+        index = next((i for i, entry in enumerate(self.pending) if entry[1]), 0)
+        entry = self.pending[index]
+        del self.pending[index]
+        self._forget(entry)
+        self.dropped += 1
+
+    def _forget(self, entry):
+        if entry[0] is not None and self._latest.get(entry[0]) is entry:
+            del self._latest[entry[0]]
+
+    def lag(self, now=None):
+        """
+        Seconds the oldest undelivered message has been waiting (0 when idle).
+        """
+        oldest = self._sending_since if self._sending_since is not None else (
+            self.pending[0][4] if self.pending else None
+        )
+        if oldest is None:
+            return 0.0
+        return (time.monotonic() if now is None else now) - oldest
+
+    async def _run(self):
+        while True:
+            if not self.pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            entry = self.pending.popleft()
+            self._forget(entry)
+            _, _, message, event_time, queued_at = entry
+            self._sending_since = queued_at
+            try:
+                if isinstance(message, bytes):
+                    await self.websocket.send_bytes(message)
+                else:
+                    await self.websocket.send_text(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.engine._failed(self, e)
+                return
+            finally:
+                self._sending_since = None
+            self.sent += 1
+            self.max_lag = max(self.max_lag, time.monotonic() - queued_at)
+            if event_time is not None:
+                delivery_latency.record(time.time() - event_time)
+
+    def stats(self):
+        return {
+            "websocket": id(self.websocket),
+            "pending": len(self.pending),
+            "max_pending": self.max_pending,
+            "lag": round(self.lag(), 3),
+            "max_lag": round(self.max_lag, 3),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced
+        }
+
+    def close(self):
+        self.closed = True
+        self.pending.clear()
+        self._latest.clear()
+        self.task.cancel()
+
+
+class FanoutEngine:
+    def __init__(self, queue, dispatch, loop, batch=64, on_error=None,
+                 policy="drop_oldest", max_pending=256, max_lag=5.0):
+        """
+        Parameters:
+            queue (CoalescingEventQueue): The send queue filled by the ingest threads.
+            dispatch: Callable (patient_id, param_type, seqs) building the messages of one queue
+                      entry and passing them to send(); called in the event loop.
+            loop: The event loop serving the websockets.
+            batch (int): Queue entries handled per loop callback before yielding to other tasks.
+            on_error: Optional callable (websocket, exception) called when a send fails or a
+                      slow websocket is disconnected.
+            policy (str): Slow-consumer policy of the connection queues, one of CONNECTION_POLICIES.
+            max_pending (int): Maximum number of pending messages per connection.
+            max_lag (float): Seconds the oldest pending message may wait before a websocket is
+                             disconnected ("disconnect" policy) or its messages are coalesced
+                             ("coalesce" policy).
+        """
+        if policy not in CONNECTION_POLICIES:
+            raise ValueError(f"Unknown connection queue policy {policy!r}, expected one of {CONNECTION_POLICIES}")
+        self.queue = queue
+        self.dispatch = dispatch
+        self.loop = loop
+        self.batch = max(1, batch)
+        self.on_error = on_error
+        self.policy = policy
+        self.max_pending = max(1, max_pending)
+        self.max_lag = max_lag
+        # {websocket: Connection}; only touched in the event loop.
+        self._connections = {}
+        # Released or disconnected websockets: messages still in flight for them are ignored.
+        self._closed = weakref.WeakSet()
+        # True while a drain callback is scheduled; lets signal() skip redundant wakeups.
+        self._scheduled = False
+        self.signals = 0
+        self.wakeups = 0
+        self.send_errors = 0
+        self.disconnects = 0
+        # Counters of the released connections, so the totals survive reconnects.
+        self._released = {"sent": 0, "dropped": 0, "coalesced": 0}
+
+    def signal(self):
+        """
+        Wake the engine after a queue put (any thread).
+        """
+        self.signals += 1
+        if not self._scheduled:
+            self._scheduled = True
+            self.wakeups += 1
+            self.loop.call_soon_threadsafe(self._drain)
+
+    def _drain(self):
+        # Cleared before draining: a put racing with the drain schedules another one.
+        self._scheduled = False
+        for _ in range(self.batch):
+            item = self.queue.get(timeout=0)
+            if item is None:
+                return
+            (patient_id, param_type), seqs = item
+            try:
+                self.dispatch(patient_id, param_type, seqs)
+            except Exception as e:
+                logger.error(f"Error in fan-out dispatch: {str(e)}")
+            finally:
+                self.queue.task_done()
+        # More entries may be pending: continue after the callbacks already scheduled.
+        if not self._scheduled:
+            self._scheduled = True
+            self.loop.call_soon(self._drain)
+
+    def send(self, websocket, message, event_time=None, key=None, waveform=False):
+        """
+        Queue a message for a websocket (event loop only).
+
+        Parameters:
+            websocket: The destination websocket.
+            message (str or bytes): The encoded message (bytes are sent as a binary frame).
+            event_time (float, optional): Collection time of the data, for the delivery latency.
+            key (tuple, optional): (patient_id, param_type) of a data message, for coalescing.
+            waveform (bool): Whether the message carries waveform frames (dropped first).
+        """
+        connection = self._connections.get(websocket)
+        if connection is None:
+            if websocket in self._closed:
+                return
+            connection = Connection(websocket, self)
+            self._connections[websocket] = connection
+        connection.put(message, event_time, key, waveform)
+
+    def send_threadsafe(self, websocket, message, event_time=None, key=None, waveform=False):
+        """
+        Queue a message for a websocket from another thread.
+        """
+        self.loop.call_soon_threadsafe(self.send, websocket, message, event_time, key, waveform)
+
+    def release(self, websocket):
+        """
+        Stop sending to a websocket and drop its pending messages (event loop only).
+        """
+        self._closed.add(websocket)
+        connection = self._connections.pop(websocket, None)
+        if connection is not None:
+            self._close(connection)
+
+    def _close(self, connection):
+        self._closed.add(connection.websocket)
+        for name in self._released:
+            self._released[name] += getattr(connection, name)
+        connection.close()
+
+    def _failed(self, connection, error):
+        self.send_errors += 1
+        if self._connections.get(connection.websocket) is connection:
+            del self._connections[connection.websocket]
+            self._close(connection)
+        logger.error(f"Send to websocket {id(connection.websocket)} failed, dropping it: {str(error)}")
+        if self.on_error is not None:
+            self.on_error(connection.websocket, error)
+
+    def _disconnect(self, connection, reason):
+        """
+        Close a websocket that cannot keep up ("disconnect" policy).
+        """
+        self.disconnects += 1
+        if self._connections.get(connection.websocket) is connection:
+            del self._connections[connection.websocket]
+        self._close(connection)
+        logger.warning(f"Disconnecting slow websocket {id(connection.websocket)}: {reason}")
+        if self.on_error is not None:
+            self.on_error(connection.websocket, RuntimeError(reason))
+        self.loop.create_task(self._close_websocket(connection.websocket, reason))
+
+    @staticmethod
+    async def _close_websocket(websocket, reason):
+        try:
+            # 1013: try again later.
+            await websocket.close(code=1013, reason=f"Slow consumer: {reason}")
+        except Exception as e:
+            logger.error(f"Error closing slow websocket {id(websocket)}: {str(e)}")
+
+    def connection_stats(self, limit=None):
+        """
+        Per-connection queue metrics, most lagging first.
+
+        Parameters:
+            limit (int, optional): Maximum number of connections returned.
+
+        Returns:
+            list: Connection.stats() dicts.
+        """
+        connections = sorted(
+            (connection.stats() for connection in list(self._connections.values())),
+            key=lambda stats: (stats["lag"], stats["pending"]),
+            reverse=True
+        )
+        return connections if limit is None else connections[:limit]
+
+    def stats(self):
+        connections = list(self._connections.values())
+        return {
+            "engine": "asyncio",
+            "policy": self.policy,
+            "max_pending": self.max_pending,
+            "connections": len(connections),
+            "pending_messages": sum(len(connection.pending) for connection in connections),
+            "max_lag": round(max((connection.lag() for connection in connections), default=0.0), 3),
+            "sent": self._released["sent"] + sum(connection.sent for connection in connections),
+            "dropped": self._released["dropped"] + sum(connection.dropped for connection in connections),
+            "coalesced": self._released["coalesced"] + sum(connection.coalesced for connection in connections),
+            "signals": self.signals,
+            "wakeups": self.wakeups,
+            "send_errors": self.send_errors,
+            "disconnects": self.disconnects
+        }
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: This module collects runtime counters for the data pipeline.
+             It keeps thread-safe ingest counters (rows, batches, batch sizes), computes
+             a sliding-window ingest rate and tracks end-to-end delivery latency so they can be
+             exposed over the API.
+"""
+
+import time
+from collections import deque
+from threading import Lock
+
+
+class RateMeter:
+    def __init__(self, window=10):
+        """
+        Count events in one-second buckets to compute a sliding-window rate.
+
+        Parameters:
+            window (int): Length of the sliding window in seconds.
+        """
+        self.window = window
+        # Deque of [second, count] buckets, oldest first.
+        self._buckets = deque()
+
+    def add(self, count, now=None):
+        """
+        Add a number of events at the given time (defaults to now).
+        """
+        second = int(now if now is not None else time.time())
+        if self._buckets and self._buckets[-1][0] == second:
+            self._buckets[-1][1] += count
+        else:
+            self._buckets.append([second, count])
+        self._expire(second)
+
+    def rate(self, now=None):
+        """
+        Return the average number of events per second over the window.
+        """
+        second = int(now if now is not None else time.time())
+        self._expire(second)
+        return sum(count for _, count in self._buckets) / float(self.window)
+
+    def _expire(self, second):
+        while self._buckets and self._buckets[0][0] <= second - self.window:
+            self._buckets.popleft()
+
+
+class IngestMetrics:
+    def __init__(self, window=10):
+        """
+        Initialize the ingest counters.
+
+        Parameters:
+            window (int): Length of the sliding window (seconds) used for the rows/sec rate.
+        """
+        self._lock = Lock()
+        self._rate = RateMeter(window)
+        self.rows_total = 0
+        self.batched_rows_total = 0
+        self.batches_total = 0
+        self.groups_total = 0
+        self.last_batch_rows = 0
+        self.max_batch_rows = 0
+
+    def record_rows(self, rows):
+        """
+        Record rows committed without batching (one commit per row).
+        """
+        if not rows:
+            return
+        with self._lock:
+            self.rows_total += rows
+            self._rate.add(rows)
+
+    def record_batch(self, rows, groups):
+        """
+        Record a flushed batch.
+
+        Parameters:
+            rows (int): Number of rows in the batch.
+            groups (int): Number of (patient_id, param_type) groups in the batch.
+        """
+        with self._lock:
+            self.rows_total += rows
+            self.batched_rows_total += rows
+            self.batches_total += 1
+            self.groups_total += groups
+            self.last_batch_rows = rows
+            self.max_batch_rows = max(self.max_batch_rows, rows)
+            self._rate.add(rows)
+
+    def snapshot(self):
+        """
+        Return a JSON-serializable view of the ingest counters.
+        """
+        with self._lock:
+            batches = self.batches_total
+            batched_rows = self.batched_rows_total
+            return {
+                "rows_total": self.rows_total,
+                "rows_per_sec": round(self._rate.rate(), 2),
+                "batches_total": batches,
+                "last_batch_rows": self.last_batch_rows,
+                "max_batch_rows": self.max_batch_rows,
+                "avg_batch_rows": round(batched_rows / batches, 2) if batches else 0,
+                "avg_group_rows": round(batched_rows / self.groups_total, 2) if self.groups_total else 0,
+            }
+
+
+class LatencyMeter:
+    def __init__(self, samples=10000):
+        """
+        Track a latency distribution over the most recent samples.
+
+        Parameters:
+            samples (int): Number of most recent samples used for the percentiles.
+        """
+        self._lock = Lock()
+        self._samples = deque(maxlen=samples)
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+            if seconds > self.max:
+                self.max = seconds
+
+    def snapshot(self):
+        """
+        Return count, max and p50/p95/p99 (milliseconds) over the recent samples.
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+            count, max_seconds = self.count, self.max
+        if not samples:
+            return {"count": count, "p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+
+        def percentile(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 2)
+
+        return {
+            "count": count,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(max_seconds * 1000, 2)
+        }
+
+
+# Global ingest counters shared by the binlog listener and the API.
+ingest_metrics = IngestMetrics()
+# End-to-end latency from collection_time to the completed websocket send.
+delivery_latency = LatencyMeter()
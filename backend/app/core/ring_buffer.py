@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: This module implements the time-windowed waveform ring buffer used by the cache.
+             Each waveform stream (one patient parameter) owns one preallocated 2-D NumPy array
+             (channels x samples) holding the last `seconds` of samples at the stream's sampling
+             rate, plus a small ring of frame records (timestamp, first sample, sample count).
+             Memory per stream is fixed when the stream is created and does not depend on the
+             size of the device frames. Frames are numbered from 0 in arrival order; the frame
+             number is the record's sequence number. Timestamp lookups bisect the frame records
+             and assume frame timestamps are non-decreasing.
+
+             Windows that do not wrap around the end of the ring are returned as zero-copy
+             views. A view stays valid until `capacity` further samples have been written
+             (i.e. for the configured history length); callers that keep samples longer must
+             copy them.
+"""
+
+import numpy as np
+
+
+class WaveformRing:
+    def __init__(self, channels, units, capacity, max_frames, dtype=np.float32, first_seq=0):
+        """
+        Parameters:
+            channels (tuple): Channel names, in storage order.
+            units (dict): {channel: unit}.
+            capacity (int): Samples kept per channel.
+            max_frames (int): Frame records kept (frames beyond this are forgotten even if
+                              their samples are still in the ring).
+            dtype: NumPy dtype of the stored samples.
+            first_seq (int): Sequence number of the first frame (a ring replacing another one
+                             continues its numbering).
+        """
+        self.channels = tuple(channels)
+        self.units = dict(units)
+        self.capacity = max(1, int(capacity))
+        self.max_frames = max(1, int(max_frames))
+        self._samples = np.zeros((len(self.channels), self.capacity), dtype=dtype)
+        # Frame records, indexed by absolute frame number modulo max_frames.
+        self._frame_ts = np.zeros(self.max_frames, dtype=np.float64)
+        self._frame_start = np.zeros(self.max_frames, dtype=np.int64)
+        self._frame_len = np.zeros(self.max_frames, dtype=np.int64)
+        # Total samples (per channel) written, and number of the next frame.
+        self._written = 0
+        self._base = first_seq
+        self._frames = first_seq
+
+    @classmethod
+    def for_frame(cls, data, seconds, rate, max_frames, dtype=np.float32, first_seq=0):
+        """
+        Create a ring shaped after a decoded waveform frame ({channel: {"unit", "values"}}).
+        """
+        channels = tuple(data.keys())
+        units = {channel: data[channel]["unit"] for channel in channels}
+        return cls(channels, units, int(seconds * rate), max_frames, dtype, first_seq)
+
+    def accepts(self, data):
+        """
+        Return True if the frame has exactly this ring's channels.
+        """
+        return len(data) == len(self.channels) and all(channel in data for channel in self.channels)
+
+    def append(self, data, timestamp):
+        """
+        Append one decoded frame.
+
+        Parameters:
+            data (dict): {channel: {"unit": str, "values": array-like}} with this ring's channels.
+            timestamp (float): Frame timestamp (collection time, epoch seconds).
+
+        Returns:
+            int: The frame's sequence number.
+
+        Raises:
+            ValueError: If the channels do not have the same number of samples.
+        """
+        arrays = [np.asarray(data[channel]["values"]) for channel in self.channels]
+        n = len(arrays[0])
+        if any(len(array) != n for array in arrays):
+            raise ValueError("Waveform channels have different sample counts")
+        for channel in self.channels:
+            self.units[channel] = data[channel]["unit"]
+
+        start = self._written
+        kept = min(n, self.capacity)
+        pos = (start + n - kept) % self.capacity
+        first = min(kept, self.capacity - pos)
+        for row, array in zip(self._samples, arrays):
+            array = array[n - kept:]
+            row[pos:pos + first] = array[:first]
+            row[:kept - first] = array[first:]
+
+        # A frame longer than the ring only keeps its last `capacity` samples.
+        slot = self._frames % self.max_frames
+        self._frame_ts[slot] = timestamp
+        self._frame_start[slot] = start + n - kept
+        self._frame_len[slot] = kept
+        self._written += n
+        self._frames += 1
+        return self._frames - 1
+
+    def _first_valid_frame(self):
+        """
+        Return the absolute number of the oldest frame whose samples are all still in the ring.
+        """
+        oldest_sample = self._written - self.capacity
+        lo, hi = max(self._base, self._frames - self.max_frames), self._frames
+        # Frame start indices increase with the frame number: binary search.
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._frame_start[mid % self.max_frames] < oldest_sample:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _window(self, start, stop):
+        """
+        Return {channel: samples} for absolute sample indices [start, stop).
+        A view if the window does not wrap, otherwise a copy.
+        """
+        a = start % self.capacity
+        b = a + (stop - start)
+        if b <= self.capacity:
+            block = self._samples[:, a:b]
+        else:
+            block = np.concatenate((self._samples[:, a:], self._samples[:, :b - self.capacity]), axis=1)
+        return {channel: block[i] for i, channel in enumerate(self.channels)}
+
+    def _payload(self, window):
+        return {channel: {"unit": self.units[channel], "values": window[channel]} for channel in self.channels}
+
+    def _frame_record(self, frame):
+        slot = frame % self.max_frames
+        start = int(self._frame_start[slot])
+        return {
+            "data": self._payload(self._window(start, start + int(self._frame_len[slot]))),
+            "timestamp": float(self._frame_ts[slot]),
+            "seq": frame
+        }
+
+    def _bisect(self, timestamp, right):
+        """
+        Return the first valid frame number whose timestamp is > timestamp (right=True)
+        or >= timestamp (right=False). Frame timestamps are assumed to be non-decreasing.
+        """
+        lo, hi = self._first_valid_frame(), self._frames
+        while lo < hi:
+            mid = (lo + hi) // 2
+            ts = self._frame_ts[mid % self.max_frames]
+            if ts < timestamp or (right and ts == timestamp):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    @property
+    def last_seq(self):
+        """
+        Sequence (frame) number of the newest frame (-1 if none was ever appended).
+        """
+        return self._frames - 1
+
+    def get(self, seq):
+        """
+        Return the record {"data", "timestamp", "seq"} of frame `seq`, or None if it is no
+        longer (or not yet) in the ring.
+        """
+        if self._first_valid_frame() <= seq < self._frames:
+            return self._frame_record(seq)
+        return None
+
+    def latest(self):
+        return self._frame_record(self._frames - 1) if self._frames > self._base else None
+
+    def find(self, timestamp):
+        """
+        Return the latest frame with exactly this timestamp, or None.
+        """
+        frame = self._bisect(timestamp, right=True) - 1
+        if frame >= self._first_valid_frame() and self._frame_ts[frame % self.max_frames] == timestamp:
+            return self._frame_record(frame)
+        return None
+
+    def nearest(self, timestamp):
+        """
+        Return the frame whose timestamp is closest to `timestamp` (the later one on a tie), or None.
+        """
+        first = self._first_valid_frame()
+        if first == self._frames:
+            return None
+        frame = self._bisect(timestamp, right=False)
+        if frame == self._frames:
+            frame -= 1
+        elif frame > first and (timestamp - self._frame_ts[(frame - 1) % self.max_frames]
+                                < self._frame_ts[frame % self.max_frames] - timestamp):
+            frame -= 1
+        return self._frame_record(frame)
+
+    def range(self, t_start, t_end):
+        """
+        Return the frame records with t_start <= timestamp <= t_end, oldest first.
+        """
+        lo = self._bisect(t_start, right=False)
+        hi = self._bisect(t_end, right=True)
+        return [self._frame_record(frame) for frame in range(lo, hi)]
+
+    def since(self, seq):
+        """
+        Return the frame records with a sequence number greater than `seq`, oldest first.
+        """
+        return [self._frame_record(frame) for frame in range(max(seq + 1, self._first_valid_frame()), self._frames)]
+
+    def last_samples(self, count):
+        """
+        Return {"data", "timestamp"} for the last `count` samples of every channel
+        (fewer if the ring holds fewer), or None if the ring is empty.
+        """
+        if self._frames == self._base:
+            return None
+        count = max(0, min(int(count), self._written, self.capacity))
+        return {
+            "data": self._payload(self._window(self._written - count, self._written)),
+            "timestamp": float(self._frame_ts[(self._frames - 1) % self.max_frames])
+        }
+
+    def samples_since(self, timestamp):
+        """
+        Return {"data", "timestamp"} with the samples of every frame newer than `timestamp`
+        that is still in the ring, or None if there is none.
+        """
+        if self._frames == self._base:
+            return None
+        frame = self._bisect(timestamp, right=True)
+        if frame == self._frames:
+            return None
+        start = int(self._frame_start[frame % self.max_frames])
+        return {
+            "data": self._payload(self._window(start, self._written)),
+            "timestamp": float(self._frame_ts[(self._frames - 1) % self.max_frames])
+        }
+
+    def __len__(self):
+        return self._frames - self._first_valid_frame()
+
+    @property
+    def nbytes(self):
+        return self._samples.nbytes + self._frame_ts.nbytes + self._frame_start.nbytes + self._frame_len.nbytes
@@ -3,37 +3,92 @@
 Author: yadian zhao
 Institution: Canterbury University
 Description: This module manages sending data events to subscribed websockets.
-             It uses a thread pool to process events from a queue and sends cached patient data
-             to the appropriate websocket subscribers asynchronously.
+             Events are processed from a queue and the cached patient data is sent to the
+             appropriate websocket subscribers asynchronously, by one of two engines
+             (FANOUT_ENGINE): "threads", a thread pool building the messages in worker threads, or
+             "asyncio", building them inside the event loop. Either way the messages go through the
+             bounded per-websocket queues of app/core/fanout.py, sent by one task per websocket.
+             Failed sends are logged and the websocket is unsubscribed.
+             A new subscription can ask for a backfill: one message with the cached history of
+             its parameters, built by backfill_message.
+             Every message is assembled from the records' encoded JSON text, computed once per
+             record and kept in the cache, whatever the number of subscribers and messages.
+             Waveform subscriptions made with the "binary" format get the same frames as binary
+             messages (serialization.dumps_binary) built from BinaryPayload records, cached alike,
+             with the sample codec of the subscription (app/core/codecs.py).
+             Subscriptions may ask for a decimated view of waveforms (app/core/decimation.py); each
+             view is computed once per record and shared by the subscribers at the same rate.
+             With the "threads" engine the send queue is sharded by (patient_id, param_type), one
+             shard per worker (event_queue.ShardedEventQueue), so the frames of a stream are always
+             sent in order and the number of workers (SEND_WORKERS) can follow the number of cores.
+             Every data message carries "seq", the per-stream sequence number of its record (of its
+             last frame for multi-frame messages), so clients can check the ordering.
 """
 
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 import json
-import queue
-import base64
+from datetime import datetime
 
 from app.core.events import notifier
 from app.core.cache import data_cache
 from config.logger import logger
 from app.core.event_loop import main_event_loop
+from app.core.serialization import dumps_message, dumps_envelope, dumps_binary, join_values, EncodedPayload, BinaryPayload
+from app.core.event_queue import ShardedEventQueue
+from app.core.fanout import FanoutEngine
+from app.core.decimation import DecimatedPayload
+from config.settings import settings
+
+# Waveform param types: under the coalesce policy their pending frames are merged, not replaced
+# (sent in one multi-frame message to the subscriptions opting into it, one by one to the others).
+WAVEFORM_TYPES = ("pressure_flow", "ECG")
+FANOUT_ENGINES = ("threads", "asyncio")
 
 class SendDataManager:
-    def __init__(self, max_workers=5):
+    def __init__(self, max_workers=5, engine="threads", loop=main_event_loop, ordered=True):
         """
-        Initialize the SendDataManager with a thread pool executor and an event queue.
+        Initialize the SendDataManager with an event queue and its fan-out engine.
         
         Parameters:
-            max_workers (int): Maximum number of worker threads to process events.
+            max_workers (int): Maximum number of worker threads to process events ("threads" engine).
+            engine (str): Fan-out engine, one of FANOUT_ENGINES.
+            loop: The event loop serving the websockets.
+            ordered (bool): Shard the queue by stream, one shard per worker, so that the events of
+                            a stream are sent in order ("threads" engine). With False all workers
+                            share one queue and consecutive frames of a stream may be reordered.
         """
-        self.queue = queue.Queue()
-        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        if engine not in FANOUT_ENGINES:
+            raise ValueError(f"Unknown fan-out engine {engine!r}, expected one of {FANOUT_ENGINES}")
+        # Bounded queue keyed by (patient_id, param_type), see app/core/event_queue.py. The
+        # asyncio engine drains it from the event loop alone, so it needs a single shard.
+        shards = max_workers if engine == "threads" and ordered else 1
+        self.queue = ShardedEventQueue(
+            shards=shards,
+            maxsize=settings.SEND_QUEUE_MAX_EVENTS,
+            policy=settings.SEND_QUEUE_POLICY,
+            merge_types=WAVEFORM_TYPES,
+            max_merge_frames=settings.SEND_QUEUE_MAX_MERGE_FRAMES
+        )
+        self.engine = engine
+        self.loop = loop
         self.running = True
-        # Start worker threads.
-        for _ in range(max_workers):
-            self.executor.submit(self.worker)
+        self.executor = None
+        # Per-websocket bounded queues and sender tasks, used by both engines.
+        self.fanout = FanoutEngine(
+            self.queue.shards[0], self.dispatch, loop,
+            on_error=self._send_failed,
+            policy=settings.CONNECTION_QUEUE_POLICY,
+            max_pending=settings.CONNECTION_QUEUE_MAX_MESSAGES,
+            max_lag=settings.CONNECTION_MAX_LAG_SECONDS
+        )
+        if engine == "threads":
+            self.executor = ThreadPoolExecutor(max_workers=max_workers)
+            # Start worker threads.
+            for index in range(max_workers):
+                self.executor.submit(self.worker, self.queue.shards[index % shards])
 
-    def add_event(self, patient_id, param_type, event_time):
+    def add_event(self, patient_id, param_type, seq):
         """
         Add a data event to the queue if there are active websocket subscriptions
         for the given patient and parameter type.
@@ -41,98 +96,428 @@ class SendDataManager:
         Parameters:
             patient_id: Unique identifier for the patient.
             param_type: The type of parameter (e.g., ECG, pressure_flow).
-            event_time: Timestamp associated with the event.
+            seq: Cache sequence number of the new record.
         """
+        # New streams get the matching pattern subscriptions first.
+        notifier.attach(patient_id, param_type)
         # Only add the event if there are active subscriptions for the specified patient and parameter type.
-        with notifier.lock:
-            if (patient_id not in notifier.subscriptions or
-                param_type not in notifier.subscriptions[patient_id] or
-                not notifier.subscriptions[patient_id][param_type]):
-                return
+        if not notifier.has_subscribers(patient_id, param_type):
+            return
                 
-        event = {
-            "patient_id": patient_id,
-            "param_type": param_type,
-            "event_time": event_time
-        }
-        self.queue.put(event)
+        self.queue.put((patient_id, param_type), [seq])
+        if self.executor is None:
+            self.fanout.signal()
+
+    def add_events(self, patient_id, param_type, seqs):
+        """
+        Add several data events for one patient parameter as a single queue item.
+        Used by batched ingestion so that the subscription check and the queue put
+        happen once per group instead of once per row.
+
+        Parameters:
+            patient_id: Unique identifier for the patient.
+            param_type: The type of parameter (e.g., ECG, pressure_flow).
+            seqs: Cache sequence numbers of the new records, oldest first.
+        """
+        if not seqs:
+            return
+        notifier.attach(patient_id, param_type)
+        if not notifier.has_subscribers(patient_id, param_type):
+            return
+
+        self.queue.put((patient_id, param_type), seqs)
+        if self.executor is None:
+            self.fanout.signal()
 
-    def worker(self):
+    def worker(self, queue):
         """
         Worker thread function to continuously process events from the queue.
         For each event, retrieve the corresponding cached data, build a message,
         and send it to all subscribed websockets asynchronously.
+
+        Parameters:
+            queue (CoalescingEventQueue): The shard of the send queue served by this worker.
         """
         while self.running:
+            item = queue.get(timeout=1)
+            if item is None:
+                continue
+
+            # An entry carries every pending sequence number of one stream.
+            (patient_id, param_type), seqs = item
             try:
-                event = self.queue.get(timeout=1)
-                patient_id = event["patient_id"]
-                param_type = event["param_type"]
-                event_time = event["event_time"]
-                
-                # Retrieve the corresponding cached data using patient_id, param_type, and timestamp.
-                cached_item = data_cache.get_data(
-                    patient_id=patient_id,
-                    param_type=param_type,
-                    target_timestamp=event_time
-                )
-                
-                if not cached_item:
-                    continue
+                self.dispatch(patient_id, param_type, seqs)
+            except Exception as e:
+                logger.error(f"Error in send_data worker: {str(e)}")
+            finally:
+                queue.task_done()
+
+    def dispatch(self, patient_id, param_type, seqs):
+        """
+        Send the pending events of one stream: one message per event, and one multi-frame
+        message for merged waveform frames to the subscribers that opted into it.
+        """
+        multi_frame = frozenset()
+        if len(seqs) > 1 and self.queue.merges(param_type):
+            multi_frame = notifier.get_frame_subscribers(patient_id, param_type)
+            if multi_frame:
+                try:
+                    self._send_frames(patient_id, param_type, seqs, multi_frame)
+                except Exception as e:
+                    logger.error(f"Error in send_data worker: {str(e)}")
+        for seq in seqs:
+            try:
+                self._send_event(patient_id, param_type, seq, multi_frame)
+            except Exception as e:
+                logger.error(f"Error in send_data worker: {str(e)}")
 
+    def _deliver(self, ws, message, event_time=None, key=None):
+        """
+        Queue a message on the websocket's connection (called by a worker thread or, with the
+        asyncio engine, in the event loop).
 
+        Parameters:
+            ws: The destination websocket.
+            message (str or bytes): The encoded message.
+            event_time (float, optional): Collection time of the data, for the delivery latency.
+            key (tuple, optional): (patient_id, param_type) of a data message.
+        """
+        waveform = key is not None and key[1] in WAVEFORM_TYPES
+        if self._in_loop():
+            self.fanout.send(ws, message, event_time, key, waveform)
+        else:
+            self.fanout.send_threadsafe(ws, message, event_time, key, waveform)
 
-                def convert_bytes_keys(data):
-                    if isinstance(data, dict):
-                        return {str(k, 'utf-8') if isinstance(k, bytes) else k: convert_bytes_keys(v) for k, v in data.items()}
-                    elif isinstance(data, list):
-                        return [convert_bytes_keys(i) for i in data]
-                    elif isinstance(data, bytes):
-                        try:
-                            return data.decode('utf-8')  
-                        except UnicodeDecodeError:
-                            return base64.b64encode(data).decode()  
-                    else:
-                        return data
+    def send_message(self, ws, message, key=None):
+        """
+        Queue a message built outside the send queue (e.g. ward updates) on a websocket's
+        connection, from any thread.
 
-                sanitized_data = convert_bytes_keys(cached_item["data"])
+        Parameters:
+            ws: The destination websocket.
+            message (str): The encoded message.
+            key (tuple, optional): Coalescing key of the message (see fanout.Connection).
+        """
+        self._deliver(ws, message, key=key)
 
+    def _in_loop(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
 
-                sanitized_timestamp = (
-                    cached_item["timestamp"].decode() 
-                    if isinstance(cached_item["timestamp"], bytes) 
-                    else cached_item["timestamp"]
-                )
+    def _send_failed(self, ws, error):
+        """
+        Unsubscribe a websocket whose send failed, or that was disconnected as a slow consumer,
+        from everything.
+        """
+        notifier.remove_websocket(ws)
 
-                subscribers = notifier.get_subscribers(patient_id, param_type)
-                
-                message = json.dumps({
-                    "type": "get_parameters",
+    def release(self, ws):
+        """
+        Forget a closed websocket (event loop only).
+        """
+        self.fanout.release(ws)
+
+    def stats(self):
+        stats = self.fanout.stats()
+        if self.executor is not None:
+            stats.update(engine="threads", workers=self.executor._max_workers, shards=len(self.queue.shards))
+        return stats
+
+    def connection_stats(self, limit=None):
+        """
+        Per-websocket queue metrics (pending messages, lag, drops), most lagging first.
+        """
+        return self.fanout.connection_stats(limit)
+
+    def _send_event(self, patient_id, param_type, seq, exclude=frozenset()):
+        """
+        Build the message for one cached record and send it to all subscribed websockets
+        except those in exclude (sent the record in a multi-frame message).
+        The record's data is encoded once (see PatientDataCache.encode_record) and the same
+        message text is sent to every subscriber.
+        """
+        subscribers = notifier.get_subscribers(patient_id, param_type, seq)
+        if exclude:
+            subscribers = subscribers - exclude
+        if not subscribers:
+            return
+
+        # Retrieve the corresponding cached data using patient_id, param_type, and sequence
+        # number; it is encoded below, in the formats its subscribers need.
+        cached_item = data_cache.get_by_seq(patient_id, param_type, seq)
+
+        if not cached_item:
+            return
+
+        fields = {
+            "type": "get_parameters",
+            "param_type": param_type,
+            "status": "success",
+            "code": 200,
+            "message": "Data fetched successfully",
+            "timestamp": cached_item["timestamp"],
+            "seq": cached_item["seq"]
+        }
+        # One message per (format, view) in use: the format is "json" or the codec of binary
+        # subscriptions, the view None (full rate) or a decimated view.
+        binary = self._binary_subscribers(patient_id, param_type)
+        views = self._views(patient_id, param_type)
+        messages = {}
+        for ws in subscribers:
+            key = (binary.get(ws, "json"), views.get(ws))
+            if key not in messages:
+                fmt, view = key
+                view_fields = self._view_fields(fields, view)
+                message = None
+                if fmt != "json":
+                    message = self._binary_message(patient_id, param_type, view_fields, [cached_item], fmt, view)
+                if message is None:
+                    encoded = self._encode(patient_id, param_type, cached_item, EncodedPayload, "json", view)
+                    message = dumps_envelope(view_fields, encoded.text)
+                messages[key] = message
+            self._deliver(ws, messages[key], cached_item["timestamp"], (patient_id, param_type))
+
+    @staticmethod
+    def _binary_subscribers(patient_id, param_type):
+        """
+        Return {websocket: codec} of the subscribers of a waveform parameter asking for binary
+        messages.
+        """
+        if param_type not in WAVEFORM_TYPES:
+            return {}
+        return notifier.get_binary_subscribers(patient_id, param_type)
+
+    @staticmethod
+    def _views(patient_id, param_type):
+        """
+        Return {websocket: (method, points_per_second)} of the subscribers of a waveform
+        parameter asking for a decimated view below its sampling rate (the others get full-rate
+        frames).
+        """
+        rate = settings.CACHE_RING_RATES.get(param_type)
+        if param_type not in WAVEFORM_TYPES or not rate:
+            return {}
+        return {ws: view for ws, view in notifier.get_views(patient_id, param_type).items() if view[1] < rate}
+
+    @staticmethod
+    def _view_fields(fields, view):
+        if view is None:
+            return fields
+        return dict(fields, decimation={"method": view[0], "points_per_second": view[1]})
+
+    @staticmethod
+    def _encode(patient_id, param_type, record, encode, fmt, view=None):
+        """
+        Return the encoded form of a record, or of its decimated view, memoized in the cache.
+        A view is computed once per record and (method, points per second), whatever the
+        number of subscribers and formats using it.
+
+        Parameters:
+            patient_id: Unique identifier for the patient.
+            param_type: The type of parameter.
+            record (dict): The cached record.
+            encode: Callable building the encoded form from the (decimated) data.
+            fmt (str): Name of the encoding.
+            view (tuple, optional): (method, points_per_second) of a decimated view.
+        """
+        if view is not None:
+            method, points_per_second = view
+            rate = settings.CACHE_RING_RATES[param_type]
+            decimated = data_cache.encode_record(
+                patient_id, param_type, record,
+                lambda data: DecimatedPayload(data, method, points_per_second, rate),
+                fmt=("view",) + view
+            )
+            record = dict(record, data=decimated.data)
+            fmt = (fmt,) + view
+        return data_cache.encode_record(patient_id, param_type, record, encode, fmt)
+
+    def _binary_message(self, patient_id, param_type, fields, records, codec, view=None):
+        """
+        Build the binary message carrying waveform records (see serialization.dumps_binary).
+
+        Returns:
+            bytes: The message, or None if the records hold no waveform frame.
+        """
+        return dumps_binary(fields, [
+            (record, self._encode(patient_id, param_type, record, BinaryPayload, "binary", view))
+            for record in records
+        ], codec, settings.WAVEFORM_CODEC_STEPS, settings.WAVEFORM_CODEC_DEFAULT_STEP,
+            settings.WAVEFORM_CODEC_DEFLATE_LEVEL)
+
+    def _send_frames(self, patient_id, param_type, seqs, websockets):
+        """
+        Send several pending waveform frames of one stream as a single multi-frame message
+        (coalesce policy) to the subscribers in websockets, those accepting it.
+        Frames no longer in the cache are skipped, and so are frames a subscriber already
+        received in its backfill.
+        """
+        # Frames to send per subscriber: all of them unless a backfill covered the first ones.
+        recipients = {}
+        for index, seq in enumerate(seqs):
+            for ws in notifier.get_subscribers(patient_id, param_type, seq):
+                if ws in websockets:
+                    recipients.setdefault(ws, index)
+        if not recipients:
+            return
+
+        frames = []
+        first_sent = min(recipients.values())
+        for index, seq in enumerate(seqs):
+            if index < first_sent:
+                continue
+            cached_item, encoded = data_cache.get_encoded(
+                patient_id=patient_id,
+                param_type=param_type,
+                seq=seq,
+                encode=EncodedPayload
+            )
+            if cached_item:
+                frames.append((index, cached_item, encoded))
+        if not frames:
+            return
+
+        binary = self._binary_subscribers(patient_id, param_type)
+        views = self._views(patient_id, param_type)
+        messages = {}
+        for ws, first in recipients.items():
+            sent = [frame for frame in frames if frame[0] >= first]
+            if not sent:
+                continue
+            key = (first, binary.get(ws, "json"), views.get(ws))
+            if key not in messages:
+                _, fmt, view = key
+                fields = self._view_fields({
+                    "type": "get_parameters_frames",
                     "param_type": param_type,
                     "status": "success",
                     "code": 200,
                     "message": "Data fetched successfully",
-                    "data": sanitized_data,
-                    "timestamp": sanitized_timestamp
-                })
-
-                for ws in subscribers:
-                    asyncio.run_coroutine_threadsafe(
-                        ws.send_text(message),
-                        main_event_loop
+                    "timestamp": sent[-1][1]["timestamp"],
+                    "seq": sent[-1][1]["seq"]
+                }, view)
+                message = None
+                if fmt != "json":
+                    message = self._binary_message(
+                        patient_id, param_type, fields, [cached_item for _, cached_item, _ in sent], fmt, view
                     )
-                self.queue.task_done()
+                if message is None:
+                    if view is not None:
+                        sent = [
+                            (index, cached_item, self._encode(patient_id, param_type, cached_item, EncodedPayload, "json", view))
+                            for index, cached_item, _ in sent
+                        ]
+                    message = dumps_envelope(fields, "[" + ", ".join(
+                        f'{{"data": {encoded.text}, "timestamp": {json.dumps(cached_item["timestamp"])}, "seq": {cached_item["seq"]}}}'
+                        for _, cached_item, encoded in sent
+                    ) + "]")
+                messages[key] = message
+            self._deliver(ws, messages[key], sent[0][1]["timestamp"], (patient_id, param_type))
 
+    def backfill_message(self, patient_id, param_types, seconds, watermarks):
+        """
+        Build the message carrying the cached history of several parameters, sent once when a
+        subscription asks for a backfill. It is assembled from the records' encoded forms, so
+        records already sent live (or backfilled) are not encoded again.
 
-            except queue.Empty:
-                continue
-            except Exception as e:
-                logger.error(f"Error in send_data worker: {str(e)}")
+        Waveform parameters are packed: each channel's samples of all frames are joined into
+        one array, with the (timestamp, sample count) of every frame. Other parameters are
+        sent as a list of records.
+
+        Parameters:
+            patient_id: Unique identifier for the patient.
+            param_types: Parameter types to backfill.
+            seconds (float): History sent, counted back from each parameter's newest record.
+            watermarks (dict): {param_type: last seq} from notifier.subscribe; only records up
+                               to it are included (later ones are sent live).
+
+        Returns:
+            str: The encoded message.
+        """
+        parts = []
+        for param_type in param_types:
+            last_seq = watermarks.get(param_type, -1)
+            records = [
+                record for record in data_cache.get_since(patient_id, param_type, -1)
+                if record["seq"] <= last_seq
+            ]
+            if records:
+                newest = max(record["timestamp"] for record in records)
+                records = [record for record in records if record["timestamp"] >= newest - seconds]
+            encoded = [
+                (record, data_cache.encode_record(patient_id, param_type, record, EncodedPayload))
+                for record in records
+            ]
+            if param_type in WAVEFORM_TYPES:
+                text = self._pack_frames(encoded, last_seq)
+            else:
+                text = '{"records": [' + ", ".join(
+                    f'{{"data": {item.text}, "timestamp": {json.dumps(record["timestamp"])}}}'
+                    for record, item in encoded
+                ) + f'], "last_seq": {last_seq}}}'
+            parts.append(f"{json.dumps(param_type)}: {text}")
+
+        return dumps_envelope({
+            "type": "get_parameters_backfill",
+            "patient_id": patient_id,
+            "param_type": list(param_types),
+            "status": "success",
+            "code": 200,
+            "message": f"Cached history of the last {seconds:g}s",
+            "timestamp": datetime.now().isoformat()
+        }, "{" + ", ".join(parts) + "}")
+
+    @staticmethod
+    def _pack_frames(encoded, last_seq):
+        """
+        Join the encoded channels of waveform records into the text of
+        {"data": {channel: {"unit", "values"}}, "frames": [[timestamp, sample count], ...], "last_seq"}.
+        Frames missing one of the newest frame's channels are left out.
+        """
+        encoded = [(record, item) for record, item in encoded if item.channels is not None]
+        if not encoded:
+            return f'{{"data": {{}}, "frames": [], "last_seq": {last_seq}}}'
+        channels = list(encoded[-1][1].channels.keys())
+        encoded = [(record, item) for record, item in encoded if all(channel in item.channels for channel in channels)]
+        data = ", ".join(
+            f'{json.dumps(channel)}: {{"unit": {json.dumps(encoded[-1][1].channels[channel][0])}, '
+            f'"values": {join_values([item.channels[channel][1] for _, item in encoded])}}}'
+            for channel in channels
+        )
+        frames = json.dumps([[record["timestamp"], item.channels[channels[0]][2]] for record, item in encoded])
+        return f'{{"data": {{{data}}}, "frames": {frames}, "last_seq": {last_seq}}}'
+
+    def send_status(self, transitions):
+        """
+        Push parameter status changes (active/inactive) to the subscribers of each parameter,
+        so clients do not have to re-issue get_parameters to find out.
+
+        Parameters:
+            transitions: List of (patient_id, param_type, active, last_update) tuples.
+        """
+        for patient_id, param_type, active, last_update in transitions:
+            subscribers = notifier.get_subscribers(patient_id, param_type)
+            if not subscribers:
                 continue
+            message = dumps_message({
+                "type": "param_status",
+                "patient_id": patient_id,
+                "param_type": param_type,
+                "status": "active" if active else "inactive",
+                "code": 200,
+                "message": f"{param_type} for patient {patient_id} is now {'active' if active else 'inactive'}",
+                "data": {"last_update": last_update},
+                "timestamp": datetime.now().isoformat()
+            })
+            for ws in subscribers:
+                self._deliver(ws, message)
 
     def shutdown(self):
         self.running = False
-        self.executor.shutdown(wait=True)
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
 
-SEND_DATA_WORKERS = 5
-send_data_manager = SendDataManager(max_workers=SEND_DATA_WORKERS)
+SEND_DATA_WORKERS = settings.SEND_WORKERS
+send_data_manager = SendDataManager(max_workers=SEND_DATA_WORKERS, engine=settings.FANOUT_ENGINE)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: This module serializes outgoing websocket messages.
+             Cached payloads may hold NumPy sample arrays; they are kept as arrays through the
+             cache and send queue and only converted here, when the message is encoded.
+             A cached payload is encoded once (EncodedPayload) and its JSON text is spliced into
+             every message that carries it: live frames, multi-frame messages and backfills.
+
+             Subscribers may opt into binary waveform messages (format "binary"), built by
+             dumps_binary from BinaryPayload records:
+               bytes 0-3   magic b"DTWF"
+               byte  4     version (1)
+               byte  5     codec id (app/core/codecs.py: 0 raw float32, 1 delta16, 2 delta16+deflate)
+               bytes 6-7   header length n (uint16 little-endian)
+               bytes 8-8+n compact JSON header, space-padded so the samples start at a multiple
+                           of 4: the message's type, param_type, timestamp, seq (and decimation) plus
+                           "channels": [{"name", "unit", "counts": [samples per frame],
+                           "encoding", ...}] and "frames": [[timestamp, seq], ...]; decimated
+                           channels add "positions": [[sample index in the frame, ...] per frame]
+               then        the samples of each channel (all frames, in order), channel after
+                           channel, encoded by the codec (see app/core/codecs.py for the decoder).
+             Other parameters and control messages stay JSON text.
+"""
+
+import base64
+import json
+import struct
+
+import numpy as np
+
+from app.core.codecs import CODECS, encode_samples
+
+# Message formats a subscription can ask for.
+MESSAGE_FORMATS = ("json", "binary")
+BINARY_MAGIC = b"DTWF"
+BINARY_VERSION = 1
+# Message fields kept in the binary header (status fields are implied by the frame itself).
+BINARY_HEADER_FIELDS = ("type", "param_type", "timestamp", "seq", "decimation")
+# magic, version, codec, header length.
+BINARY_PREFIX = struct.Struct("<4sBBH")
+
+
+def _json_default(value):
+    """
+    Fallback for objects the json module cannot encode natively.
+    """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, bytes):
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return base64.b64encode(value).decode()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def normalize_keys(value):
+    """
+    Return a copy of a payload with bytes dict keys (binlog JSON documents) decoded to str,
+    so that it can be encoded as JSON.
+    """
+    if isinstance(value, dict):
+        return {
+            (k.decode('utf-8') if isinstance(k, bytes) else k): normalize_keys(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, list):
+        return [normalize_keys(v) for v in value]
+    return value
+
+
+def dumps_message(message):
+    """
+    Encode a message dict as JSON text, converting NumPy arrays to lists.
+
+    Parameters:
+        message (dict): The message to encode.
+
+    Returns:
+        str: The JSON text.
+    """
+    return json.dumps(message, default=_json_default)
+
+
+def is_waveform(data):
+    """
+    Return True for a decoded waveform frame: {channel: {"unit": str, "values": ndarray}}.
+    """
+    return bool(data) and isinstance(data, dict) and all(
+        isinstance(value, dict) and isinstance(value.get("values"), np.ndarray) for value in data.values()
+    )
+
+
+class EncodedPayload:
+    """
+    JSON text of one cached payload, encoded once and reused by every message carrying it.
+    Waveform frames also keep the text of each channel's samples, so several frames can be
+    joined without encoding them again.
+    """
+    __slots__ = ("text", "channels")
+
+    def __init__(self, data):
+        """
+        Parameters:
+            data: The cached payload ("data" of a cache record).
+        """
+        if is_waveform(data):
+            # {channel: (unit, JSON text of the samples, sample count)}
+            self.channels = {
+                (k.decode('utf-8') if isinstance(k, bytes) else k): (
+                    value["unit"], json.dumps(value["values"].tolist()), len(value["values"])
+                )
+                for k, value in data.items()
+            }
+            # Decimated views (app/core/decimation.py) also carry the positions of their samples.
+            positions = {
+                (k.decode('utf-8') if isinstance(k, bytes) else k): f', "positions": {json.dumps(value["positions"].tolist())}'
+                for k, value in data.items() if "positions" in value
+            }
+            self.text = "{" + ", ".join(
+                f'{json.dumps(channel)}: {{"unit": {json.dumps(unit)}, "values": {values}{positions.get(channel, "")}}}'
+                for channel, (unit, values, _) in self.channels.items()
+            ) + "}"
+        else:
+            self.channels = None
+            self.text = dumps_message(normalize_keys(data))
+
+    @property
+    def nbytes(self):
+        return len(self.text)
+
+
+class BinaryPayload:
+    """
+    Packed float32 samples of one cached waveform frame, encoded once and reused by every
+    binary message carrying it ("raw" codec). The sample arrays are kept for the other codecs,
+    and the sample positions of decimated views (app/core/decimation.py).
+    """
+    __slots__ = ("channels",)
+
+    def __init__(self, data):
+        """
+        Parameters:
+            data: The cached payload ("data" of a cache record).
+        """
+        if is_waveform(data):
+            # {channel: (unit, little-endian float32 bytes, sample count, samples, positions or None)}
+            self.channels = {
+                (k.decode('utf-8') if isinstance(k, bytes) else k): (
+                    value["unit"], np.asarray(value["values"], dtype="<f4").tobytes(),
+                    len(value["values"]), value["values"],
+                    value["positions"].tolist() if "positions" in value else None
+                )
+                for k, value in data.items()
+            }
+        else:
+            self.channels = None
+
+    @property
+    def nbytes(self):
+        # The sample arrays are the cached ones, not copies.
+        return sum(len(packed) for _, packed, _, _, _ in self.channels.values()) if self.channels else 0
+
+
+def dumps_binary(message, frames, codec="raw", steps=None, default_step=0.001, deflate_level=1):
+    """
+    Encode waveform frames as one binary message (see the module description).
+    Frames missing one of the newest frame's channels are left out.
+
+    Parameters:
+        message (dict): The message fields; only BINARY_HEADER_FIELDS are kept.
+        frames (list): (record, BinaryPayload) tuples, oldest first.
+        codec (str): Sample codec, one of codecs.CODECS.
+        steps (dict, optional): {channel: quantization step} of the delta16 codecs.
+        default_step (float): Quantization step of the channels missing from steps.
+        deflate_level (int): zlib level of the "delta16+deflate" codec.
+
+    Returns:
+        bytes: The binary message, or None if no frame is a waveform.
+    """
+    frames = [(record, item) for record, item in frames if item.channels is not None]
+    if not frames:
+        return None
+    channels = list(frames[-1][1].channels.keys())
+    frames = [(record, item) for record, item in frames if all(channel in item.channels for channel in channels)]
+    header = {name: message[name] for name in BINARY_HEADER_FIELDS if name in message}
+    if codec == "raw":
+        # The cached float32 bytes of every frame, already 4-byte aligned.
+        header["channels"] = [
+            {
+                "name": channel,
+                "unit": frames[-1][1].channels[channel][0],
+                "counts": [item.channels[channel][2] for _, item in frames],
+                "encoding": "float32"
+            }
+            for channel in channels
+        ]
+        body = b"".join(item.channels[channel][1] for channel in channels for _, item in frames)
+    else:
+        header["channels"], body = encode_samples([
+            (
+                channel,
+                frames[-1][1].channels[channel][0],
+                [item.channels[channel][2] for _, item in frames],
+                np.concatenate([item.channels[channel][3] for _, item in frames])
+            )
+            for channel in channels
+        ], codec, steps or {}, default_step, deflate_level)
+    for channel in header["channels"]:
+        positions = [item.channels[channel["name"]][4] for _, item in frames]
+        if any(frame_positions is not None for frame_positions in positions):
+            channel["positions"] = positions
+    header["frames"] = [[record["timestamp"], record["seq"]] for record, _ in frames]
+    text = json.dumps(header, separators=(",", ":"), default=_json_default).encode("utf-8")
+    # Pad the header with spaces so that the samples are 4-byte aligned (typed array views).
+    text += b" " * (-(BINARY_PREFIX.size + len(text)) % 4)
+    return b"".join([BINARY_PREFIX.pack(BINARY_MAGIC, BINARY_VERSION, CODECS[codec], len(text)), text, body])
+
+
+def dumps_envelope(message, data_text):
+    """
+    Encode a message dict and add a "data" member whose value is already encoded JSON text.
+
+    Parameters:
+        message (dict): The message without its "data" member.
+        data_text (str): JSON text of the data.
+
+    Returns:
+        str: The JSON text.
+    """
+    head = dumps_message(message)
+    return f'{head[:-1]}, "data": {data_text}}}' if len(head) > 2 else f'{{"data": {data_text}}}'
+
+
+def join_values(texts):
+    """
+    Join the JSON texts of several sample arrays ("[...]") into the text of one array.
+    """
+    return "[" + ", ".join(text[1:-1] for text in texts if len(text) > 2) + "]"
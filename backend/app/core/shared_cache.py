@@ -0,0 +1,538 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: This module implements the shared-memory cache used to serve websockets from several
+             server processes. One process (role "writer") runs the binlog listener and mirrors
+             every cache write into a multiprocessing.shared_memory segment; any number of
+             processes (role "reader") attach to the segment and serve subscriptions from it,
+             adding fan-out capacity without extra database or binlog connections.
+
+             The segment holds a fixed table of slots, one per (patient_id, param_type). Each slot
+             is a ring of the last `depth` records; record seq is stored at index seq % depth.
+             A record is encoded once by the writer: waveform frames as raw sample arrays behind a
+             small JSON header, other payloads as JSON.
+
+             There is a single writer and readers never take a lock. Every record carries a
+             version counter (a seqlock): the writer makes it odd, writes the record and makes it
+             even again; a reader copies the record and retries if the version was odd or changed
+             meanwhile. A slot carries a generation counter, bumped (odd while in progress) when
+             the writer reassigns the slot to another stream, so readers drop stale key mappings.
+             Stores of one Python process are observed in program order by other processes on
+             x86 (TSO); weaker memory models are not supported.
+"""
+
+import json
+import os
+import time
+from multiprocessing import shared_memory
+from threading import Lock, Thread
+
+import numpy as np
+
+from app.core.serialization import dumps_message, normalize_keys
+from config.logger import logger
+
+MAGIC = 0x44544943  # "DTIC"
+LAYOUT_VERSION = 1
+# Global header fields (int64).
+H_MAGIC, H_VERSION, H_SLOTS, H_DEPTH, H_RECORD_BYTES, H_DIR_VERSION, H_WRITER_PID = range(7)
+HEADER_FIELDS = 8
+KEY_BYTES = 120
+
+SLOT_DTYPE = np.dtype([
+    ("generation", np.int64),
+    ("last_seq", np.int64),
+    ("last_ts", np.float64),
+    ("key_len", np.int64),
+    ("key", f"S{KEY_BYTES}")
+])
+RECORD_DTYPE = np.dtype([
+    ("version", np.int64),
+    ("seq", np.int64),
+    ("timestamp", np.float64),
+    ("nbytes", np.int64)
+])
+# Attempts of a reader to copy a record the writer keeps overwriting.
+READ_RETRIES = 100
+# Encoded records kept by a reader process.
+ENCODED_RECORDS = 4096
+
+
+def encode_payload(data):
+    """
+    Encode a cached payload for the shared segment.
+    Waveform frames ({channel: {"unit", "values": ndarray}}) keep their raw samples;
+    anything else is stored as JSON.
+    """
+    if (isinstance(data, dict) and data and all(
+            isinstance(value, dict) and isinstance(value.get("values"), np.ndarray) and len(value) == 2
+            for value in data.values())):
+        arrays = [np.ascontiguousarray(value["values"]) for value in data.values()]
+        header = json.dumps([
+            [channel, value["unit"], array.dtype.str, len(array)]
+            for (channel, value), array in zip(data.items(), arrays)
+        ]).encode()
+        return b"W" + len(header).to_bytes(4, "little") + header + b"".join(array.tobytes() for array in arrays)
+    return b"J" + dumps_message(normalize_keys(data)).encode()
+
+
+def decode_payload(raw):
+    """
+    Decode a payload written by encode_payload.
+    """
+    if raw[:1] == b"J":
+        return json.loads(raw[1:])
+    size = int.from_bytes(raw[1:5], "little")
+    offset = 5 + size
+    data = {}
+    for channel, unit, dtype, count in json.loads(raw[5:offset]):
+        dtype = np.dtype(dtype)
+        data[channel] = {"unit": unit, "values": np.frombuffer(raw, dtype=dtype, count=count, offset=offset)}
+        offset += count * dtype.itemsize
+    return data
+
+
+def _key_bytes(patient_id, param_type):
+    return json.dumps([patient_id, param_type]).encode()
+
+
+class SharedSegment:
+    """
+    Views of the header, slot table, record headers and payloads of a segment.
+    """
+    def __init__(self, shm, slots, depth, record_bytes):
+        self.shm = shm
+        self.slots = slots
+        self.depth = depth
+        self.record_bytes = record_bytes
+        offset = HEADER_FIELDS * 8
+        self.header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        self.table = np.ndarray((slots,), dtype=SLOT_DTYPE, buffer=shm.buf, offset=offset)
+        offset += self.table.nbytes
+        self.records = np.ndarray((slots, depth), dtype=RECORD_DTYPE, buffer=shm.buf, offset=offset)
+        offset += self.records.nbytes
+        self.payloads = np.ndarray((slots, depth, record_bytes), dtype=np.uint8, buffer=shm.buf, offset=offset)
+
+    @staticmethod
+    def size(slots, depth, record_bytes):
+        return HEADER_FIELDS * 8 + slots * SLOT_DTYPE.itemsize + slots * depth * (RECORD_DTYPE.itemsize + record_bytes)
+
+    def close(self):
+        # Views must be released before the buffer can be closed.
+        self.header = self.table = self.records = self.payloads = None
+        self.shm.close()
+
+
+class SharedCacheWriter:
+    def __init__(self, name, slots=256, depth=10, record_bytes=32768):
+        """
+        Create the shared segment (replacing a stale one left by a crashed writer).
+
+        Parameters:
+            name (str): Name of the shared memory segment.
+            slots (int): Streams (patient parameters) the segment can hold; beyond it the
+                         least recently written stream is replaced.
+            depth (int): Records kept per stream.
+            record_bytes (int): Maximum encoded size of one record; larger records are not shared.
+        """
+        size = SharedSegment.size(slots, depth, record_bytes)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = name
+        self.segment = SharedSegment(shm, slots, depth, record_bytes)
+        self.segment.table["last_seq"] = -1
+        self.segment.header[:] = [MAGIC, LAYOUT_VERSION, slots, depth, record_bytes, 0, os.getpid(), 0]
+        # Writer side only: {key bytes: slot} and the monotonic time of each slot's last write.
+        self._slots = {}
+        self._written_at = np.zeros(slots, dtype=np.float64)
+        self._lock = Lock()
+        self.written = 0
+        self.oversized = 0
+        self.reassigned = 0
+
+    def _slot_for(self, key):
+        """
+        Return the slot of a stream, assigning a free or the least recently written slot
+        (called with the lock held).
+        """
+        slot = self._slots.get(key)
+        if slot is not None:
+            return slot
+        segment = self.segment
+        if len(self._slots) < segment.slots:
+            slot = len(self._slots)
+        else:
+            slot = int(np.argmin(self._written_at))
+            old = segment.table["key"][slot][:segment.table["key_len"][slot]]
+            self._slots.pop(old, None)
+            self.reassigned += 1
+        table = segment.table
+        table["generation"][slot] += 1
+        table["last_seq"][slot] = -1
+        segment.records["version"][slot] += 2
+        segment.records["seq"][slot] = -1
+        table["key"][slot] = key
+        table["key_len"][slot] = len(key)
+        table["generation"][slot] += 1
+        segment.header[H_DIR_VERSION] += 1
+        self._slots[key] = slot
+        return slot
+
+    def write(self, patient_id, param_type, seq, data, timestamp):
+        """
+        Publish one cache record (called by the cache, in sequence order for each stream).
+        """
+        key = _key_bytes(patient_id, param_type)
+        payload = encode_payload(data)
+        segment = self.segment
+        if len(key) > KEY_BYTES or len(payload) > segment.record_bytes:
+            if self.oversized == 0:
+                logger.warning(f"Record of {patient_id}/{param_type} ({len(payload)} bytes) exceeds the shared "
+                               f"cache record size ({segment.record_bytes} bytes) and is not shared")
+            self.oversized += 1
+            return
+        with self._lock:
+            slot = self._slot_for(key)
+            i = seq % segment.depth
+            versions = segment.records["version"]
+            versions[slot, i] += 1
+            segment.payloads[slot, i, :len(payload)] = np.frombuffer(payload, dtype=np.uint8)
+            segment.records["seq"][slot, i] = seq
+            segment.records["timestamp"][slot, i] = timestamp
+            segment.records["nbytes"][slot, i] = len(payload)
+            versions[slot, i] += 1
+            segment.table["last_ts"][slot] = timestamp
+            segment.table["last_seq"][slot] = seq
+            self._written_at[slot] = time.monotonic()
+            self.written += 1
+
+    def stats(self):
+        return {
+            "role": "writer",
+            "name": self.name,
+            "slots": self.segment.slots,
+            "slots_used": len(self._slots),
+            "written": self.written,
+            "oversized": self.oversized,
+            "reassigned": self.reassigned
+        }
+
+    def close(self):
+        """
+        Close and remove the segment (readers still attached keep their mapping).
+        """
+        self.segment.close()
+        try:
+            self.segment.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SharedCacheReader:
+    """
+    Read-only cache over the segment of a SharedCacheWriter, with the read interface of
+    PatientDataCache. Records are decoded copies; lookups by timestamp scan the slot's records.
+    """
+    def __init__(self, name, attach_timeout=30.0):
+        """
+        Parameters:
+            name (str): Name of the shared memory segment.
+            attach_timeout (float): Seconds to wait for the writer to create the segment.
+        """
+        deadline = time.monotonic() + attach_timeout
+        while True:
+            try:
+                shm = shared_memory.SharedMemory(name=name)
+                break
+            except FileNotFoundError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.5)
+        self._untrack(shm)
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        if header[H_MAGIC] != MAGIC or header[H_VERSION] != LAYOUT_VERSION:
+            raise RuntimeError(f"Shared memory segment {name} is not a shared cache (layout {header[H_VERSION]})")
+        slots, depth, record_bytes = int(header[H_SLOTS]), int(header[H_DEPTH]), int(header[H_RECORD_BYTES])
+        del header
+        self.name = name
+        self.segment = SharedSegment(shm, slots, depth, record_bytes)
+        self.depth = depth
+        # {(patient_id, param_type): (slot, generation)}, rebuilt when the directory version changes.
+        self._keys = {}
+        self._slot_keys = {}
+        self._dir_version = -1
+        self._lock = Lock()
+        self.retries = 0
+        # {(patient_id, param_type, seq, timestamp, format): encoded record}, the newest ENCODED_RECORDS.
+        self._encoded = {}
+
+    @staticmethod
+    def _untrack(shm):
+        """
+        Stop the resource tracker from unlinking the writer's segment when this process exits.
+        """
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+
+    def _refresh(self):
+        segment = self.segment
+        version = int(segment.header[H_DIR_VERSION])
+        if version == self._dir_version:
+            return
+        with self._lock:
+            keys = {}
+            slot_keys = {}
+            table = segment.table.copy()
+            for slot in range(segment.slots):
+                generation = int(table["generation"][slot])
+                length = int(table["key_len"][slot])
+                if generation % 2 or not length:
+                    continue
+                key = tuple(json.loads(table["key"][slot][:length]))
+                keys[key] = (slot, generation)
+                slot_keys[slot] = (key, generation)
+            self._keys = keys
+            self._slot_keys = slot_keys
+            self._dir_version = version
+
+    def key_of(self, slot, generation):
+        """
+        Return the (patient_id, param_type) held by a slot at this generation, or None.
+        """
+        found = self._slot_keys.get(slot)
+        if found is None or found[1] != generation:
+            self._dir_version = -1
+            self._refresh()
+            found = self._slot_keys.get(slot)
+        return found[0] if found is not None and found[1] == generation else None
+
+    def _slot(self, patient_id, param_type):
+        self._refresh()
+        return self._keys.get((patient_id, param_type))
+
+    def _copy_record(self, slot, generation, i, seq=None):
+        """
+        Copy record i of a slot under the seqlock protocol.
+
+        Returns:
+            dict: {"data", "timestamp", "seq"}, or None if the record is empty, does not
+                  hold `seq`, or the slot was reassigned.
+        """
+        segment = self.segment
+        version = segment.records["version"]
+        for _ in range(READ_RETRIES):
+            before = int(version[slot, i])
+            if before % 2:
+                self.retries += 1
+                continue
+            record_seq = int(segment.records["seq"][slot, i])
+            timestamp = float(segment.records["timestamp"][slot, i])
+            nbytes = int(segment.records["nbytes"][slot, i])
+            raw = segment.payloads[slot, i, :max(0, min(nbytes, segment.record_bytes))].tobytes()
+            if int(version[slot, i]) != before:
+                self.retries += 1
+                continue
+            if int(segment.table["generation"][slot]) != generation:
+                return None
+            if record_seq < 0 or (seq is not None and record_seq != seq):
+                return None
+            return {"data": decode_payload(raw), "timestamp": timestamp, "seq": record_seq}
+        return None
+
+    def _records(self, patient_id, param_type):
+        """
+        Return the kept records of a stream in sequence order.
+        """
+        found = self._slot(patient_id, param_type)
+        if found is None:
+            return []
+        slot, generation = found
+        last = int(self.segment.table["last_seq"][slot])
+        records = []
+        for seq in range(max(0, last - self.depth + 1), last + 1):
+            record = self._copy_record(slot, generation, seq % self.depth, seq)
+            if record is not None:
+                records.append(record)
+        return records
+
+    def update_data(self, patient_id, param_type, data, timestamp):
+        raise RuntimeError("The shared cache is read-only in reader processes")
+
+    def update_batch(self, patient_id, param_type, records):
+        raise RuntimeError("The shared cache is read-only in reader processes")
+
+    def get_data(self, patient_id, param_type, target_timestamp=None):
+        """
+        Return the latest record, or the latest record with exactly target_timestamp, or None.
+        """
+        if target_timestamp is None:
+            found = self._slot(patient_id, param_type)
+            if found is None:
+                return None
+            slot, generation = found
+            last = int(self.segment.table["last_seq"][slot])
+            return self._copy_record(slot, generation, last % self.depth, last) if last >= 0 else None
+        matches = [record for record in self._records(patient_id, param_type)
+                   if record["timestamp"] == target_timestamp]
+        return matches[-1] if matches else None
+
+    def get_by_seq(self, patient_id, param_type, seq):
+        found = self._slot(patient_id, param_type)
+        if found is None or seq < 0:
+            return None
+        slot, generation = found
+        return self._copy_record(slot, generation, seq % self.depth, seq)
+
+    def get_nearest(self, patient_id, param_type, timestamp):
+        records = self._records(patient_id, param_type)
+        if not records:
+            return None
+        # The later record wins a tie, as in StreamHistory.nearest.
+        return min(reversed(records), key=lambda record: abs(record["timestamp"] - timestamp))
+
+    def get_range(self, patient_id, param_type, t_start, t_end):
+        records = [record for record in self._records(patient_id, param_type)
+                   if t_start <= record["timestamp"] <= t_end]
+        return sorted(records, key=lambda record: record["timestamp"])
+
+    def get_since(self, patient_id, param_type, seq):
+        return [record for record in self._records(patient_id, param_type) if record["seq"] > seq]
+
+    def get_last_seq(self, patient_id, param_type):
+        found = self._slot(patient_id, param_type)
+        return int(self.segment.table["last_seq"][found[0]]) if found is not None else -1
+
+    def encode_record(self, patient_id, param_type, record, encode, fmt="json"):
+        """
+        Return the encoded form of a record, encoding it only the first time (see
+        PatientDataCache.encode_record).
+        """
+        # The timestamp tells a record apart from one with the same seq after the writer
+        # restarted the stream.
+        key = (patient_id, param_type, record["seq"], record["timestamp"], fmt)
+        encoded = self._encoded.get(key)
+        if encoded is None:
+            encoded = encode(record["data"])
+            self._encoded[key] = encoded
+            while len(self._encoded) > ENCODED_RECORDS:
+                self._encoded.pop(next(iter(self._encoded)), None)
+        return encoded
+
+    def get_encoded(self, patient_id, param_type, seq, encode, fmt="json"):
+        record = self.get_by_seq(patient_id, param_type, seq)
+        if record is None:
+            return None, None
+        return record, self.encode_record(patient_id, param_type, record, encode, fmt)
+
+    def get_last_seconds(self, patient_id, param_type, seconds, rate=None):
+        from app.core.cache import PatientDataCache
+        from config.settings import settings
+        rate = rate or settings.CACHE_RING_RATES.get(param_type)
+        if not rate:
+            raise ValueError(f"No sampling rate configured for {param_type}")
+        return PatientDataCache._join_frames(self._records(patient_id, param_type), last=int(seconds * rate))
+
+    def get_samples_since(self, patient_id, param_type, timestamp):
+        from app.core.cache import PatientDataCache
+        return PatientDataCache._join_frames(
+            [record for record in self._records(patient_id, param_type) if record["timestamp"] > timestamp]
+        )
+
+    def get_last_timestamp(self, patient_id, param_type):
+        found = self._slot(patient_id, param_type)
+        return float(self.segment.table["last_ts"][found[0]]) if found is not None else 0
+
+    def sweep(self):
+        # Eviction is done by the writer (slot reuse).
+        return 0, 0
+
+    def stats(self):
+        self._refresh()
+        return {
+            "role": "reader",
+            "name": self.name,
+            "slots": self.segment.slots,
+            "streams": len(self._keys),
+            "retries": self.retries
+        }
+
+    def close(self):
+        self.segment.close()
+
+
+class SharedCacheFeed:
+    """
+    Polls the slot table of a SharedCacheReader and reports new records, replacing the binlog
+    listener in reader processes.
+    """
+    def __init__(self, reader, on_records, interval=0.01):
+        """
+        Parameters:
+            reader (SharedCacheReader): The attached cache.
+            on_records: Callable (patient_id, param_type, seqs, last_timestamp) called for every
+                        stream with new records.
+            interval (float): Seconds between two polls.
+        """
+        self.reader = reader
+        self.on_records = on_records
+        self.interval = interval
+        slots = reader.segment.slots
+        self._last_seq = np.full(slots, -1, dtype=np.int64)
+        self._generation = np.zeros(slots, dtype=np.int64)
+        self.polls = 0
+
+    def poll(self):
+        """
+        Report the records written since the previous poll.
+
+        Returns:
+            int: Number of streams with new records.
+        """
+        table = self.reader.segment.table
+        generation = table["generation"].copy()
+        last_seq = table["last_seq"].copy()
+        last_ts = table["last_ts"].copy()
+        changed = np.nonzero((last_seq != self._last_seq) | (generation != self._generation))[0]
+        reported = 0
+        for slot in changed:
+            slot = int(slot)
+            gen, last = int(generation[slot]), int(last_seq[slot])
+            if gen % 2 or last < 0:
+                continue
+            key = self.reader.key_of(slot, gen)
+            if key is None:
+                continue
+            previous = int(self._last_seq[slot])
+            if gen != self._generation[slot] or previous >= last:
+                # New stream in this slot, or its sequence restarted: only the latest record.
+                first = last
+            else:
+                first = max(previous + 1, last - self.reader.depth + 1)
+            self._last_seq[slot] = last
+            self._generation[slot] = gen
+            try:
+                self.on_records(key[0], key[1], list(range(first, last + 1)), float(last_ts[slot]))
+                reported += 1
+            except Exception as e:
+                logger.error(f"Error dispatching shared cache records of {key}: {str(e)}")
+        self.polls += 1
+        return reported
+
+    def run(self):
+        while True:
+            self.poll()
+            time.sleep(self.interval)
+
+    def start(self):
+        thread = Thread(target=self.run, name="SharedCacheFeed", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: This module implements the indexed record history of one cached stream
+             (one patient parameter) used by the cache in deque mode.
+             Records are kept in arrival order and numbered with a per-stream sequence number,
+             so a record is found by its sequence number in O(1). A sorted timestamp index
+             serves exact, nearest and range lookups by bisection in O(log n). Records sharing
+             a timestamp (collection_time has a one second resolution) stay distinct.
+"""
+
+from bisect import bisect_left, bisect_right
+
+
+class StreamHistory:
+    def __init__(self, depth=10, sizeof=None, first_seq=0):
+        """
+        Parameters:
+            depth (int): Number of records kept; the oldest record is dropped beyond it.
+            sizeof: Optional callable estimating the bytes of a record's data, used to keep
+                    the nbytes total.
+            first_seq (int): Sequence number of the first record (a history replacing an
+                             evicted one continues its numbering).
+        """
+        self.depth = max(1, depth)
+        self.sizeof = sizeof
+        # Estimated bytes of the kept records' data, and the estimate of each record.
+        self.nbytes = 0
+        self._sizes = []
+        # Records {"data", "timestamp", "seq"} in arrival order; record i has seq first_seq + i.
+        self._records = []
+        self._first_seq = first_seq
+        # Timestamp index sorted by timestamp (ties in arrival order) and the matching sequence numbers.
+        self._index_ts = []
+        self._index_seq = []
+
+    def append(self, data, timestamp):
+        """
+        Append a record.
+
+        Returns:
+            int: The record's sequence number.
+        """
+        seq = self._first_seq + len(self._records)
+        self._records.append({"data": data, "timestamp": timestamp, "seq": seq})
+        if self.sizeof is not None:
+            size = self.sizeof(data)
+            self._sizes.append(size)
+            self.nbytes += size
+        if not self._index_ts or timestamp >= self._index_ts[-1]:
+            self._index_ts.append(timestamp)
+            self._index_seq.append(seq)
+        else:
+            i = bisect_right(self._index_ts, timestamp)
+            self._index_ts.insert(i, timestamp)
+            self._index_seq.insert(i, seq)
+
+        if len(self._records) > self.depth:
+            oldest = self._records.pop(0)
+            self._first_seq += 1
+            if self._sizes:
+                self.nbytes -= self._sizes.pop(0)
+            i = bisect_left(self._index_ts, oldest["timestamp"])
+            while self._index_seq[i] != oldest["seq"]:
+                i += 1
+            del self._index_ts[i]
+            del self._index_seq[i]
+        return seq
+
+    def get(self, seq):
+        """
+        Return the record with this sequence number, or None if it is not (or no longer) kept.
+        """
+        i = seq - self._first_seq
+        if 0 <= i < len(self._records):
+            return self._records[i]
+        return None
+
+    def latest(self):
+        return self._records[-1] if self._records else None
+
+    @property
+    def last_seq(self):
+        """
+        Sequence number of the newest record (first_seq - 1 if none was ever appended).
+        """
+        return self._first_seq + len(self._records) - 1
+
+    def find(self, timestamp):
+        """
+        Return the latest record with exactly this timestamp, or None.
+        """
+        i = bisect_right(self._index_ts, timestamp) - 1
+        if i >= 0 and self._index_ts[i] == timestamp:
+            return self.get(self._index_seq[i])
+        return None
+
+    def nearest(self, timestamp):
+        """
+        Return the record whose timestamp is closest to `timestamp` (the later one on a tie), or None.
+        """
+        if not self._index_ts:
+            return None
+        i = bisect_left(self._index_ts, timestamp)
+        if i == len(self._index_ts):
+            i -= 1
+        elif i > 0 and timestamp - self._index_ts[i - 1] < self._index_ts[i] - timestamp:
+            i -= 1
+        return self.get(self._index_seq[i])
+
+    def range(self, t_start, t_end):
+        """
+        Return the records with t_start <= timestamp <= t_end, sorted by timestamp.
+        """
+        lo = bisect_left(self._index_ts, t_start)
+        hi = bisect_right(self._index_ts, t_end)
+        return [self.get(seq) for seq in self._index_seq[lo:hi]]
+
+    def since(self, seq):
+        """
+        Return the records with a sequence number greater than `seq`, in arrival order.
+        """
+        return self._records[max(0, seq + 1 - self._first_seq):]
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records)
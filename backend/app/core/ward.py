@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: This module implements the ward (central station) aggregate subscription.
+             A websocket subscribes to a set of patients, or to every patient with an active
+             parameter, and to a set of derived values (WARD_FIELDS): the latest PEEP estimate,
+             vitals of the ECG model (HR, RR, SpO2) and the active state of each device. Every
+             WARD_TICK_SECONDS one "ward_update" message per distinct subscription is pushed with
+             the values of all its patients, instead of one message per frame, bed and parameter.
+             A tick only reads the newest cached records of each patient (the value derived from
+             a record is memoized in the cache next to its encoded forms) and the activity table,
+             so its cost depends on the number of beds, not on the waveform rates.
+"""
+
+import json
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from app.core.cache import data_cache
+from app.core.send_data import send_data_manager
+from app.core.serialization import normalize_keys
+from app.binlog.listener import active_params, active_params_lock
+from config.logger import logger
+from config.settings import settings
+
+
+def end_expiratory_pressure(data):
+    """
+    PEEP estimate of one pressure_flow frame: the 5th percentile of its pressure samples.
+    """
+    values = data["pressure"]["values"]
+    return round(float(np.percentile(values, 5)), 2) if len(values) else None
+
+
+def vital(name):
+    """
+    Return a function reading one vital sign of an ECG_QRS_INFO record.
+    Vitals decoded from a binlog JSON document have bytes keys ({b"HR": ...}).
+    """
+    def derive(data):
+        return normalize_keys(data.get("vitals") or {}).get(name)
+    return derive
+
+
+# Derived values: name -> (param_type, function of a record's data, newest records looked at).
+# A value over several records is the lowest one: a one-second frame may hold only inspiration,
+# so PEEP is taken over enough frames to cover a breath.
+WARD_FIELDS = {
+    "peep": ("pressure_flow", end_expiratory_pressure, settings.WARD_PEEP_FRAMES),
+    "hr": ("ECG_QRS_INFO", vital("HR"), 1),
+    "rr": ("ECG_QRS_INFO", vital("RR"), 1),
+    "spo2": ("ECG_QRS_INFO", vital("SpO2"), 1)
+}
+# "active" ({param_type: active} of the patient) is read from the activity table.
+WARD_STATE_FIELDS = ("active",)
+
+
+class DerivedValue:
+    """
+    A value derived from one cached record, memoized with data_cache.encode_record.
+    """
+    __slots__ = ("value", "nbytes")
+
+    def __init__(self, value):
+        self.value = value
+        self.nbytes = 0
+
+
+class WardAggregator:
+    def __init__(self, tick=1.0, sender=send_data_manager):
+        """
+        Parameters:
+            tick (float): Seconds between two ward updates.
+            sender: The SendDataManager delivering the messages.
+        """
+        self.tick = tick
+        self.sender = sender
+        # {websocket: (frozenset of patient_ids or None for every active patient, fields tuple)}
+        self.subscriptions = {}
+        self.lock = threading.Lock()
+        self.running = True
+        self.ticks = 0
+        self.messages = 0
+        self.last_tick_seconds = 0.0
+
+    def subscribe(self, websocket, patient_ids, fields):
+        """
+        Subscribe a websocket to ward updates (replacing its previous ward subscription).
+
+        Parameters:
+            websocket: The websocket connection.
+            patient_ids: Iterable of patient ids, or None for every patient with an active parameter.
+            fields: Iterable of names of WARD_FIELDS or WARD_STATE_FIELDS.
+
+        Raises:
+            ValueError: If a field is unknown.
+        """
+        fields = tuple(dict.fromkeys(fields))
+        unknown = [field for field in fields if field not in WARD_FIELDS and field not in WARD_STATE_FIELDS]
+        if unknown or not fields:
+            raise ValueError(
+                f"Unknown ward fields {unknown}, expected some of {', '.join(list(WARD_FIELDS) + list(WARD_STATE_FIELDS))}"
+            )
+        with self.lock:
+            self.subscriptions[websocket] = (None if patient_ids is None else frozenset(patient_ids), fields)
+        logger.info(f"Ward subscription {id(websocket)}: {'all' if patient_ids is None else sorted(patient_ids, key=str)} {list(fields)}")
+
+    def unsubscribe(self, websocket):
+        with self.lock:
+            self.subscriptions.pop(websocket, None)
+
+    def run(self):
+        """
+        Push a ward update every tick until stopped.
+        """
+        next_tick = time.monotonic()
+        while self.running:
+            next_tick += self.tick
+            try:
+                self.publish()
+            except Exception as e:
+                logger.error(f"Error publishing ward update: {str(e)}")
+            # Ticks missed by a slow update are skipped, not caught up.
+            next_tick = max(next_tick, time.monotonic())
+            time.sleep(next_tick - time.monotonic())
+
+    def publish(self):
+        """
+        Build and send one ward update to every ward subscription.
+        """
+        with self.lock:
+            subscriptions = list(self.subscriptions.items())
+        if not subscriptions:
+            return
+        started = time.perf_counter()
+        self.ticks += 1
+        now = time.time()
+
+        # {patient_id: {param_type: active}} of every tracked patient.
+        states = {}
+        with active_params_lock:
+            for (patient_id, param_type), info in active_params.items():
+                states.setdefault(patient_id, {})[param_type] = info["active"]
+
+        # Values of each (patient, field) are derived once per tick, whatever the subscriptions.
+        values = {}
+        messages = {}
+        for websocket, (patient_ids, fields) in subscriptions:
+            key = (patient_ids, fields)
+            if key not in messages:
+                if patient_ids is None:
+                    patients = [
+                        patient_id for patient_id, params in states.items() if any(params.values())
+                    ]
+                else:
+                    patients = list(patient_ids)
+                patients.sort(key=str)
+                rows = []
+                for patient_id in patients:
+                    row = {"patient_id": patient_id}
+                    for field in fields:
+                        if field == "active":
+                            row[field] = states.get(patient_id, {})
+                            continue
+                        if (patient_id, field) not in values:
+                            values[(patient_id, field)] = self._derive(patient_id, field)
+                        row[field] = values[(patient_id, field)]
+                    rows.append(row)
+                messages[key] = json.dumps({
+                    "type": "ward_update",
+                    "status": "success",
+                    "code": 200,
+                    "message": "Ward update",
+                    "seq": self.ticks,
+                    "fields": list(fields),
+                    "data": rows,
+                    "timestamp": datetime.fromtimestamp(now).isoformat()
+                })
+            # Keyed so that a slow websocket under the "coalesce" policy keeps only the newest update.
+            self.sender.send_message(websocket, messages[key], key=("ward", "ward_update"))
+        self.messages += len(subscriptions)
+        self.last_tick_seconds = time.perf_counter() - started
+
+    @staticmethod
+    def _derive(patient_id, field):
+        """
+        Return {"value", "timestamp"} of a derived value, or None if no record is cached.
+        """
+        param_type, derive, frames = WARD_FIELDS[field]
+        last_seq = data_cache.get_last_seq(patient_id, param_type)
+        if last_seq < 0:
+            return None
+        records = data_cache.get_since(patient_id, param_type, last_seq - frames)
+        derived = [
+            data_cache.encode_record(
+                patient_id, param_type, record,
+                lambda data: DerivedValue(derive(data)),
+                fmt=("ward", field)
+            ).value
+            for record in records
+        ]
+        derived = [value for value in derived if value is not None]
+        if not derived:
+            return None
+        return {
+            "value": min(derived) if len(derived) > 1 else derived[0],
+            "timestamp": records[-1]["timestamp"]
+        }
+
+    def stats(self):
+        with self.lock:
+            subscriptions = len(self.subscriptions)
+        return {
+            "subscriptions": subscriptions,
+            "tick": self.tick,
+            "ticks": self.ticks,
+            "messages": self.messages,
+            "last_tick_ms": round(self.last_tick_seconds * 1e3, 3)
+        }
+
+    def stop(self):
+        self.running = False
+
+
+def start_ward_aggregator():
+    """
+    Start the thread pushing ward updates.
+
+    Returns:
+        Thread: The ward update thread instance running in daemon mode.
+    """
+    ward_thread = threading.Thread(target=ward_aggregator.run, name="WardAggregator", daemon=True)
+    ward_thread.start()
+    return ward_thread
+
+
+# Global instance of the ward aggregator for use across the application.
+ward_aggregator = WardAggregator(tick=settings.WARD_TICK_SECONDS)
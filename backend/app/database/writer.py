@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: This module implements the write-behind writer used by direct sensor ingest.
+             Frames pushed to the /ingest endpoint are served from the cache immediately and
+             persisted to the existing *_params tables asynchronously, in batches, by a single
+             writer thread with its own MySQL connection. The binlog listener skips the
+             transactions of that connection so the frames are not ingested twice.
+"""
+
+import queue
+import time
+from collections import deque
+from threading import Thread, Lock
+
+import pymysql
+
+from config.settings import settings
+from config.logger import logger
+
+# JSON columns stored for each table besides patient_id and collection_time.
+TABLE_COLUMNS = {
+    "pressure_flow_params": ("parameters",),
+    "ecg_params": ("parameters",),
+    "ella_sensor_params": ("parameters",),
+    "mepap_sensor_params": ("parameters",),
+    "ecg_model_output": ("analysis_data", "vitals_data"),
+    "photodiode_params": ("parameters",)
+}
+
+
+class WriteBehindWriter:
+    def __init__(self, max_rows=500, interval=0.5, queue_size=50000):
+        """
+        Parameters:
+            max_rows (int): Maximum number of rows written per batch.
+            interval (float): Maximum time (seconds) a row waits before its batch is written.
+            queue_size (int): Capacity of the pending row queue. When it is full new rows are
+                              dropped (and counted) rather than blocking the event loop.
+        """
+        self.max_rows = max_rows
+        self.interval = interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._connection = None
+        # MySQL connection ids used by this writer; read by the binlog listener thread.
+        self._connection_ids = frozenset()
+        self._recent_ids = deque(maxlen=4)
+        self._thread = None
+        self._start_lock = Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        """
+        Start the writer thread (idempotent).
+        """
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="WriteBehindWriter", daemon=True)
+                self._thread.start()
+
+    def submit(self, table, patient_id, collection_time, columns):
+        """
+        Queue one row for persistence.
+
+        Parameters:
+            table (str): Target table (a key of TABLE_COLUMNS).
+            patient_id: Unique identifier for the patient.
+            collection_time (datetime): Collection time of the frame.
+            columns (tuple): JSON texts for TABLE_COLUMNS[table], in order.
+
+        Returns:
+            bool: False if the queue was full and the row was dropped.
+        """
+        self.start()
+        try:
+            self._queue.put_nowait((table, (patient_id, collection_time) + tuple(columns)))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.error(f"Write-behind queue full, dropped {table} row for patient {patient_id}")
+            return False
+
+    def owns_connection(self, connection_id):
+        """
+        Return True if the binlog transaction with this connection id was written by this writer.
+        """
+        return connection_id in self._connection_ids
+
+    def stop(self):
+        """
+        Write the remaining rows and stop the writer thread.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self):
+        return {
+            "pending": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed
+        }
+
+    def _connect(self):
+        connection = pymysql.connect(
+            host=settings.DB_HOST,
+            user=settings.DB_USER,
+            password=settings.DB_PASSWORD,
+            database=settings.DB_NAME,
+            port=settings.DB_PORT,
+            charset='utf8mb4'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT CONNECTION_ID()")
+            connection_id = cursor.fetchone()[0]
+        # Keep the ids of a few previous connections: their last transactions may still be
+        # ahead of the binlog listener. The set is replaced, never mutated, so readers need no lock.
+        self._recent_ids.append(connection_id)
+        self._connection_ids = frozenset(self._recent_ids)
+        logger.info(f"Write-behind writer connected (connection id {connection_id})")
+        return connection
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = None
+            while len(batch) < self.max_rows:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.interval
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        """
+        Write a batch with one executemany per table inside a single transaction.
+        The batch is retried once on a fresh connection, then dropped.
+        """
+        rows_by_table = {}
+        for table, row in batch:
+            rows_by_table.setdefault(table, []).append(row)
+
+        for attempt in range(2):
+            try:
+                if self._connection is None:
+                    self._connection = self._connect()
+                with self._connection.cursor() as cursor:
+                    for table, rows in rows_by_table.items():
+                        columns = ("patient_id", "collection_time") + TABLE_COLUMNS[table]
+                        sql = (
+                            f"INSERT INTO {table} ({', '.join(columns)}) "
+                            f"VALUES ({', '.join(['%s'] * len(columns))})"
+                        )
+                        cursor.executemany(sql, rows)
+                self._connection.commit()
+                self.written += len(batch)
+                return
+            except pymysql.Error as e:
+                logger.warning(f"Write-behind batch of {len(batch)} rows failed (attempt {attempt + 1}): {str(e)}")
+                try:
+                    if self._connection is not None:
+                        self._connection.close()
+                except pymysql.Error:
+                    pass
+                self._connection = None
+        self.failed += len(batch)
+        logger.error(f"Dropped write-behind batch of {len(batch)} rows")
+
+
+# Global write-behind writer for directly ingested frames.
+write_behind = WriteBehindWriter(
+    max_rows=settings.WRITE_BEHIND_MAX_ROWS,
+    interval=settings.WRITE_BEHIND_INTERVAL,
+    queue_size=settings.WRITE_BEHIND_QUEUE_SIZE
+)
@@ -15,9 +15,17 @@ from fastapi.middleware.cors import CORSMiddleware
 
 
 from app.websocket.handlers import handle_user
+from app.services.ingest_service import handle_device
 from config.settings import settings
 from config.logger import logger
 from app.database.queries import *
+from app.core.metrics import ingest_metrics, delivery_latency
+from app.core.send_data import send_data_manager
+from app.core.cache import data_cache
+from app.database.writer import write_behind
+from app.binlog.listener import activity_tracker
+from app.core.ward import ward_aggregator
+from app.core.events import notifier
 
 # Lock to protect access to the user ID counter.
 user_id_lock = threading.Lock()
@@ -75,9 +83,24 @@ async def websocket_endpoint(websocket: WebSocket):
         await task
     finally:
         user_threads.pop(user_id, None)
+        # Stop the fan-out sender of this websocket.
+        send_data_manager.release(websocket)
+        ward_aggregator.unsubscribe(websocket)
+        notifier.remove_websocket(websocket)
         logger.info(f"Released resources for user {user_id}")
 
 
+@fastapp.websocket("/ingest")
+async def ingest_endpoint(websocket: WebSocket):
+    """
+    WebSocket endpoint for devices pushing frames directly (see app/services/ingest_service.py).
+
+    Parameters:
+        websocket (WebSocket): The incoming device connection.
+    """
+    await handle_device(websocket)
+
+
 
 @router.get("/patients")
 def get_patients():
@@ -128,4 +151,55 @@ def get_peep_history(patient_id: int):
     return {"patient_id": patient_id, "history_peep": history}
 
 
+@router.get("/metrics/ingest")
+def get_ingest_metrics():
+    return ingest_metrics.snapshot()
+
+
+@router.get("/metrics/delivery")
+def get_delivery_metrics():
+    return delivery_latency.snapshot()
+
+
+@router.get("/metrics/send_queue")
+def get_send_queue_metrics():
+    return send_data_manager.queue.stats()
+
+
+@router.get("/metrics/fanout")
+def get_fanout_metrics():
+    return send_data_manager.stats()
+
+
+@router.get("/metrics/fanout/connections")
+async def get_connection_metrics(limit: int = 50):
+    # Runs in the event loop, which owns the connection queues.
+    return send_data_manager.connection_stats(limit)
+
+
+@router.get("/metrics/subscriptions")
+def get_subscription_metrics():
+    return notifier.stats()
+
+
+@router.get("/metrics/ward")
+def get_ward_metrics():
+    return ward_aggregator.stats()
+
+
+@router.get("/metrics/write_behind")
+def get_write_behind_metrics():
+    return write_behind.stats()
+
+
+@router.get("/metrics/cache")
+def get_cache_metrics():
+    return data_cache.stats()
+
+
+@router.get("/metrics/activity")
+def get_activity_metrics():
+    return activity_tracker.stats()
+
+
 fastapp.include_router(router)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: This module handles direct sensor ingest over websocket.
+             Devices push frames with the same columns as the *_params tables; each frame is
+             decoded by the binlog table handlers, committed to the cache and fanned out to
+             subscribers immediately, then queued for asynchronous persistence by the
+             write-behind writer. Frames that fail to commit are reported to the device and
+             not persisted. Devices that write to MySQL keep using the binlog path.
+             Frames are committed in a thread pool, not in the event loop: the commit may wait
+             on a full send queue ("block" policy) that the loop itself drains.
+"""
+
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from app.binlog.decoders import decode_rows
+from app.binlog.listener import commit_decoded
+from app.database.writer import write_behind, TABLE_COLUMNS
+from config.logger import logger
+from config.settings import settings
+
+INGEST_EXECUTOR = ThreadPoolExecutor(max_workers=settings.INGEST_DEVICE_THREADS)
+
+
+def parse_collection_time(value):
+    """
+    Convert a frame collection_time to a naive local datetime, as MySQL DATETIME columns
+    are returned by the binlog.
+
+    Parameters:
+        value: Epoch seconds (int/float) or an ISO 8601 string.
+
+    Returns:
+        datetime: The collection time.
+
+    Raises:
+        ValueError: If the value cannot be parsed.
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid collection_time {value!r}")
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value)
+    if isinstance(value, str):
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone().replace(tzinfo=None)
+        return parsed
+    raise ValueError(f"Invalid collection_time {value!r}")
+
+
+def ingest_frame(frame):
+    """
+    Commit one device frame and queue it for persistence.
+
+    Parameters:
+        frame (dict): {"table": ..., "patient_id": ..., "collection_time": ..., plus the JSON
+                      columns of the table ("parameters", or "analysis_data" and "vitals_data")}.
+
+    Returns:
+        str: None on success, otherwise the reason the frame was rejected.
+    """
+    if settings.SHARED_CACHE_ROLE == "reader":
+        return "Direct ingest is served by the shared cache writer process"
+    if not isinstance(frame, dict):
+        return "Frame must be a JSON object"
+    table = frame.get("table")
+    columns = TABLE_COLUMNS.get(table)
+    if columns is None:
+        return f"Unknown table {table!r}"
+    if "patient_id" not in frame:
+        return "Missing required field 'patient_id'"
+    try:
+        collection_time = parse_collection_time(frame.get("collection_time"))
+    except (ValueError, OverflowError, OSError) as e:
+        return str(e)
+
+    values = {"patient_id": frame["patient_id"], "collection_time": collection_time}
+    for column in columns:
+        if column not in frame:
+            return f"Missing required field '{column}'"
+        values[column] = frame[column]
+
+    decoded = decode_rows(table, [{"values": values}])
+    if not decoded:
+        return f"Invalid {table} frame"
+
+    # A frame the cache rejected is not persisted either.
+    if commit_decoded(decoded) < len(decoded):
+        return f"Failed to commit {table} frame"
+    write_behind.submit(
+        table,
+        values["patient_id"],
+        collection_time,
+        [
+            values[column] if isinstance(values[column], str) else json.dumps(values[column])
+            for column in columns
+        ]
+    )
+    return None
+
+
+def ingest_frames(frames):
+    """
+    Commit the frames of one device message in order (run in INGEST_EXECUTOR).
+
+    Returns:
+        list: (index, error) of the rejected frames.
+    """
+    errors = []
+    for index, frame in enumerate(frames):
+        error = ingest_frame(frame)
+        if error is not None:
+            errors.append((index, error))
+    return errors
+
+
+async def handle_device(websocket: WebSocket):
+    """
+    Receive frames from a device until it disconnects.
+    Each message is one frame or a JSON array of frames. Nothing is sent back for accepted
+    frames; rejected frames are reported as {"type": "ingest_error", "index", "error"}.
+
+    Parameters:
+        websocket (WebSocket): The device connection.
+    """
+    await websocket.accept()
+    logger.info("Ingest device connected")
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            message = await websocket.receive_text()
+            try:
+                frames = json.loads(message)
+            except json.JSONDecodeError as e:
+                await websocket.send_json({"type": "ingest_error", "index": None, "error": str(e)})
+                continue
+            if not isinstance(frames, list):
+                frames = [frames]
+
+            # Awaited before the next message is read, so a device's frames stay in order.
+            for index, error in await loop.run_in_executor(INGEST_EXECUTOR, ingest_frames, frames):
+                await websocket.send_json({"type": "ingest_error", "index": index, "error": error})
+    except WebSocketDisconnect:
+        logger.info("Ingest device disconnected")
+    except Exception as e:
+        logger.error(f"Ingest connection error: {str(e)}")
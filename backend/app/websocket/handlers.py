@@ -22,11 +22,90 @@ from app.database.queries import fetch_patients, store_peep_snapshot, fetch_peep
 from app.services.deepseek_service import handle_deepseek_request
 from config.logger import logger
 from app.core.events import notifier
+from app.core.cache import data_cache
+from app.core.send_data import send_data_manager
+from app.core.serialization import MESSAGE_FORMATS
+from app.core.codecs import CODECS
+from app.core.decimation import DECIMATION_METHODS
+from app.core.ward import ward_aggregator, WARD_FIELDS, WARD_STATE_FIELDS
+from config.settings import settings
 from app.binlog.listener import active_params, active_params_lock  
 
 
 global_current_tasks = defaultdict(dict)
 
+
+def parse_subscription_format(message):
+    """
+    Read the message format options of a subscription request.
+
+    Parameters:
+        message (dict): The request ("format", "codec", "points_per_second" or "width" and
+                        "window_seconds", "decimation", "multi_frame").
+
+    Returns:
+        tuple: (fmt, codec, view, multi_frame, error), error being None or the reason the
+               options are invalid.
+    """
+    # Message format of the waveform frames: "json" (default) or "binary", and the
+    # sample codec of binary frames (a codec implies the binary format).
+    codec = message.get("codec")
+    fmt = message.get("format", "json" if codec is None else "binary")
+    codec = codec or "raw"
+    error = None
+    if fmt not in MESSAGE_FORMATS:
+        error = f"Unknown format {fmt!r}, expected one of {', '.join(MESSAGE_FORMATS)}"
+    elif codec not in CODECS:
+        error = f"Unknown codec {codec!r}, expected one of {', '.join(CODECS)}"
+    elif fmt == "json" and codec != "raw":
+        error = f"Codec {codec!r} requires the binary format"
+    # Decimated view of the waveforms: target points per second, given directly or as
+    # the pixel width of a display showing window_seconds of signal.
+    view = None
+    points_per_second = message.get("points_per_second")
+    if points_per_second is None and message.get("width") is not None:
+        window = message.get("window_seconds", settings.DECIMATION_DEFAULT_WINDOW_SECONDS)
+        if isinstance(window, (int, float)) and window > 0 and isinstance(message["width"], (int, float)):
+            points_per_second = message["width"] / window
+        else:
+            error = error or "width and window_seconds must be positive numbers"
+    if points_per_second is not None and not error:
+        method = message.get("decimation", "minmax")
+        if not isinstance(points_per_second, (int, float)) or points_per_second <= 0:
+            error = "points_per_second must be a positive number"
+        elif method not in DECIMATION_METHODS:
+            error = f"Unknown decimation {method!r}, expected one of {', '.join(DECIMATION_METHODS)}"
+        else:
+            # Rounded so that close targets share one view.
+            view = (method, max(1, int(round(points_per_second))))
+    # Opt-in to get_parameters_frames messages (several pending waveform frames in one
+    # message when the send queue falls behind); by default every frame is its own message.
+    multi_frame = message.get("multi_frame", False)
+    if not isinstance(multi_frame, bool):
+        error = error or "multi_frame must be true or false"
+    return fmt, codec, view, multi_frame, error
+
+
+def parse_pattern(value, name):
+    """
+    Read one side of a pattern subscription: "*" (wildcard), one value or a list of values.
+
+    Returns:
+        frozenset or None (wildcard).
+
+    Raises:
+        ValueError: If the value is missing or an empty list.
+    """
+    if value == "*":
+        return None
+    if isinstance(value, list):
+        if not value or not all(isinstance(item, (int, str)) for item in value):
+            raise ValueError(f"{name} must be \"*\", a value or a non-empty list of values")
+        return frozenset(value)
+    if isinstance(value, (int, str)):
+        return frozenset([value])
+    raise ValueError(f"{name} must be \"*\", a value or a non-empty list of values")
+
 async def handle_user(websocket: WebSocket, user_id):
     """
     Handle the communication with a connected WebSocket user.
@@ -34,8 +113,22 @@ async def handle_user(websocket: WebSocket, user_id):
     This function continuously listens for messages from the client and performs actions based on the message type:
       - "get_patients": Fetches the list of patients from the database.
       - "get_parameters": Checks the status of requested parameters and subscribes the user if active.
+        With "backfill_seconds", the cached history of the parameters is sent first in one
+        "get_parameters_backfill" message. With "format": "binary", waveform frames are sent as
+        binary messages of packed float32 samples (see app/core/serialization.py) instead of JSON;
+        "codec" ("raw", "delta16" or "delta16+deflate", see app/core/codecs.py) compresses them.
+        With "points_per_second", or "width" (pixels) and optionally "window_seconds", waveforms
+        are decimated to that rate ("decimation": "minmax" (default) or "lttb", see
+        app/core/decimation.py).
+      - "subscribe_pattern": Subscribes to every stream matching "patient_id" and "param_type",
+        each "*" (all), one value or a list, with the format options of get_parameters. Streams
+        appearing later are attached automatically (see DataUpdateNotifier.subscribe_pattern).
+      - "subscribe_ward": Subscribes to one aggregated "ward_update" message per tick (see
+        app/core/ward.py) with derived values ("fields", default all) of the given "patient_ids",
+        or of every patient with an active device when patient_ids is omitted or "all".
+      - "unsubscribe_ward": Stops the ward updates.
       - "analyze_deltaPEEP": Initiates MATLAB analysis for deltaPEEP.
-      - "stop": Unsubscribes the user from all active subscriptions.
+      - "stop": Unsubscribes the user from all active subscriptions (ward updates included).
       
     In the case of disconnection, it ensures that the user's subscriptions are cleaned up.
     
@@ -70,6 +163,18 @@ async def handle_user(websocket: WebSocket, user_id):
                 patient_id = message["patient_id"]
                 # Expected to be a list, e.g., ["pressure_flow", "ECG"]
                 param_types = message["param_type"]
+                fmt, codec, view, multi_frame, error = parse_subscription_format(message)
+                if error:
+                    await websocket.send_text(json.dumps({
+                        "type": "get_parameters",
+                        "param_type": param_types,
+                        "status": "failure",
+                        "code": 400,
+                        "message": error,
+                        "data": None,
+                        "timestamp": datetime.now().isoformat()
+                    }))
+                    continue
                 
                 # Check if each requested parameter is active.
                 inactive = []
@@ -91,7 +196,30 @@ async def handle_user(websocket: WebSocket, user_id):
                     }))
                     logger.info(f"Subscription rejected for patient {patient_id}: inactive parameters: {inactive}")
                 else:
-                    notifier.subscribe(patient_id, param_types, websocket)
+                    backfill_seconds = message.get("backfill_seconds")
+                    # bool is an int subclass: true is not a number of seconds.
+                    if (isinstance(backfill_seconds, (int, float)) and not isinstance(backfill_seconds, bool)
+                            and backfill_seconds > 0):
+                        backfill_seconds = min(float(backfill_seconds), settings.BACKFILL_MAX_SECONDS)
+                        # The watermarks are taken under the subscription lock: live records after
+                        # them are sent live, earlier ones only in the backfill.
+                        watermarks = notifier.subscribe(
+                            patient_id, param_types, websocket,
+                            watermark=lambda param: data_cache.get_last_seq(patient_id, param),
+                            fmt=fmt,
+                            codec=codec,
+                            view=view,
+                            multi_frame=multi_frame
+                        )
+                        # Built and written without yielding to the event loop in between, so
+                        # live frames queued meanwhile follow the backfill.
+                        await websocket.send_text(send_data_manager.backfill_message(
+                            patient_id, param_types, backfill_seconds, watermarks
+                        ))
+                    else:
+                        notifier.subscribe(
+                            patient_id, param_types, websocket, fmt=fmt, codec=codec, view=view, multi_frame=multi_frame
+                        )
                     global_current_tasks[websocket][patient_id] = param_types
                     logger.info(f"Subscribed for patient {patient_id} with parameters {param_types}")
                     await websocket.send_text(json.dumps({
@@ -100,10 +228,80 @@ async def handle_user(websocket: WebSocket, user_id):
                         "status": "success",
                         "code": 200,
                         "message": f"Successfully subscribed to {', '.join(param_types)} for patient {patient_id}",
+                        "format": fmt,
+                        "codec": codec if fmt == "binary" else None,
+                        "decimation": {"method": view[0], "points_per_second": view[1]} if view else None,
+                        "multi_frame": multi_frame,
                         "data": None,
                         "timestamp": datetime.now().isoformat()
                     }))
             
+            elif message["action"] == "subscribe_pattern":
+                fmt, codec, view, multi_frame, error = parse_subscription_format(message)
+                patient_ids = param_types = None
+                if not error:
+                    try:
+                        patient_ids = parse_pattern(message.get("patient_id", "*"), "patient_id")
+                        param_types = parse_pattern(message.get("param_type", "*"), "param_type")
+                    except ValueError as e:
+                        error = str(e)
+                if error:
+                    await websocket.send_text(json.dumps({
+                        "type": "subscribe_pattern",
+                        "status": "failure",
+                        "code": 400,
+                        "message": error,
+                        "data": None,
+                        "timestamp": datetime.now().isoformat()
+                    }))
+                    continue
+                streams = notifier.subscribe_pattern(
+                    websocket, patient_ids, param_types, fmt=fmt, codec=codec, view=view, multi_frame=multi_frame
+                )
+                await websocket.send_text(json.dumps({
+                    "type": "subscribe_pattern",
+                    "status": "success",
+                    "code": 200,
+                    "message": f"Subscribed to {len(streams)} streams, new matching streams attach automatically",
+                    "format": fmt,
+                    "codec": codec if fmt == "binary" else None,
+                    "decimation": {"method": view[0], "points_per_second": view[1]} if view else None,
+                    "multi_frame": multi_frame,
+                    "data": {"streams": [{"patient_id": patient_id, "param_type": param} for patient_id, param in streams]},
+                    "timestamp": datetime.now().isoformat()
+                }))
+
+            elif message["action"] == "subscribe_ward":
+                patient_ids = message.get("patient_ids", "all")
+                fields = message.get("fields") or list(WARD_FIELDS) + list(WARD_STATE_FIELDS)
+                try:
+                    if patient_ids != "all" and not isinstance(patient_ids, list):
+                        raise ValueError("patient_ids must be a list of patient ids or \"all\"")
+                    if not isinstance(fields, list):
+                        raise ValueError("fields must be a list")
+                    ward_aggregator.subscribe(websocket, None if patient_ids == "all" else patient_ids, fields)
+                except (ValueError, TypeError) as e:
+                    await websocket.send_text(json.dumps({
+                        "type": "subscribe_ward",
+                        "status": "failure",
+                        "code": 400,
+                        "message": str(e),
+                        "data": None,
+                        "timestamp": datetime.now().isoformat()
+                    }))
+                    continue
+                await websocket.send_text(json.dumps({
+                    "type": "subscribe_ward",
+                    "status": "success",
+                    "code": 200,
+                    "message": f"Subscribed to ward updates every {ward_aggregator.tick:g}s",
+                    "data": {"patient_ids": patient_ids, "fields": fields},
+                    "timestamp": datetime.now().isoformat()
+                }))
+
+            elif message["action"] == "unsubscribe_ward":
+                ward_aggregator.unsubscribe(websocket)
+
             elif message["action"] == "analyze_deltaPEEP":
                 logger.info(f"Received deltaPEEP analysis request from user {user_id}")
                 if not validate_analysis_params(message):
@@ -130,6 +328,9 @@ async def handle_user(websocket: WebSocket, user_id):
                     notifier.unsubscribe(pid, [], websocket)
                 if websocket in global_current_tasks:
                     del global_current_tasks[websocket]
+                ward_aggregator.unsubscribe(websocket)
+                # Pattern subscriptions and the streams they attached.
+                notifier.remove_websocket(websocket)
             
             elif message["action"] == "deepseek_chat":
                 logger.info(f"Received DeepSeek request from user {user_id}")
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Contention benchmark for the patient data cache.
+             One ingest thread appends waveform frames to a hot stream at a fixed rate while
+             N reader threads (standing for send workers serving N subscribers) read the same
+             stream every --read-interval seconds (readers spinning without pause would mostly
+             measure GIL scheduling). Reports the ingest (update_data) latency percentiles for the
+             optimistic seqlock reads and for reads taking the per-parameter lock (the previous
+             behaviour), as the number of readers grows.
+
+Usage:
+    cd backend && python benchmarks/bench_cache_contention.py [--readers 0 5 20 50] [--seconds 2] [--rate 500] [--read-interval 0.001]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.core.cache import PatientDataCache
+from app.binlog.decoders import ECG_CHANNELS
+
+
+class LockedReadCache(PatientDataCache):
+    """
+    Cache whose reads take the parameter's lock, as before the seqlock reads.
+    """
+    def _read(self, patient_id, param_type, read, default=None):
+        entry = self._entry(patient_id, param_type)
+        if entry is None:
+            return default
+        with entry.lock:
+            if entry.stream is None:
+                return default
+            entry.touched_at = time.monotonic()
+            return read(entry.stream)
+
+
+def make_frame(samples):
+    return {channel: {"unit": "mV", "values": np.random.rand(samples)} for channel in ECG_CHANNELS}
+
+
+def run(cache, readers, seconds, rate, frame, read_interval):
+    """
+    Return (ingest latencies in seconds, reads done).
+    """
+    stop = threading.Event()
+    reads = [0] * readers
+
+    def reader(index):
+        while not stop.is_set():
+            seq = cache.get_last_seq(1, "ECG")
+            cache.get_by_seq(1, "ECG", seq)
+            cache.get_since(1, "ECG", seq - 5)
+            # Joins the cached frames (analysis and backfill windows).
+            cache.get_last_seconds(1, "ECG", 10, rate=360)
+            reads[index] += 1
+            time.sleep(read_interval)
+
+    cache.update_data(1, "ECG", frame, 0.0)
+    threads = [threading.Thread(target=reader, args=(i,), daemon=True) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+
+    latencies = []
+    interval = 1.0 / rate
+    next_write = time.perf_counter()
+    end = next_write + seconds
+    i = 0
+    while next_write < end:
+        now = time.perf_counter()
+        if now < next_write:
+            time.sleep(next_write - now)
+        i += 1
+        started = time.perf_counter()
+        cache.update_data(1, "ECG", frame, float(i))
+        latencies.append(time.perf_counter() - started)
+        next_write += interval
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return np.array(latencies), sum(reads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readers", type=int, nargs="+", default=[0, 5, 20, 50], help="reader thread counts")
+    parser.add_argument("--seconds", type=float, default=2.0, help="duration of each run")
+    parser.add_argument("--rate", type=float, default=500.0, help="frames written per second")
+    parser.add_argument("--samples", type=int, default=360, help="samples per channel and frame")
+    parser.add_argument("--read-interval", type=float, default=0.001, help="pause of a reader between reads")
+    args = parser.parse_args()
+
+    frame = make_frame(args.samples)
+    print(f"ingest of {args.rate:.0f} frames/s into one stream, {args.seconds}s per run")
+    print(f"{'reads':<10}{'readers':>8}{'p50 us':>10}{'p99 us':>10}{'max us':>10}{'reads/s':>12}")
+    for name, make_cache in (("locked", LockedReadCache), ("seqlock", PatientDataCache)):
+        for readers in args.readers:
+            cache = make_cache(depth=10)
+            latencies, reads = run(cache, readers, args.seconds, args.rate, frame, args.read_interval)
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1e6
+            print(f"{name:<10}{readers:>8}{p50:>10.1f}{p99:>10.1f}{latencies.max() * 1e6:>10.1f}"
+                  f"{reads / args.seconds:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Memory benchmark for the patient data cache.
+             Measures the bytes one bed (pressure_flow + ECG) costs for the same seconds of
+             waveform history with the record history (deque) layout (Python float lists as originally
+             decoded, and NumPy frames) and with the ring buffer mode, plus the time to append
+             a frame and read the last N seconds.
+
+Usage:
+    cd backend && python benchmarks/bench_cache_memory.py [--seconds 60] [--frame-seconds 1]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.core.cache import PatientDataCache
+from app.binlog.decoders import PRESSURE_FLOW_CHANNELS, ECG_CHANNELS
+from config.settings import settings
+
+
+def make_frame(channels, samples, as_list, dtype):
+    values = np.linspace(0.0, 1.0, samples)
+    return {
+        channel: {
+            "unit": "mV",
+            "values": [float(v) + k for v in values] if as_list else (values + k).astype(dtype)
+        }
+        for k, channel in enumerate(channels)
+    }
+
+
+def fill(cache, streams, frames, frame_samples, as_list, dtype):
+    for i in range(frames):
+        for param_type, channels in streams.items():
+            cache.update_data(1, param_type, make_frame(channels, frame_samples[param_type], as_list, dtype), float(i))
+
+
+def bed_bytes(make_cache, streams, frames, frame_samples, as_list, dtype):
+    """
+    Return the bytes allocated by one bed's history.
+    """
+    tracemalloc.start()
+    cache = make_cache()
+    fill(cache, streams, frames, frame_samples, as_list, dtype)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del cache
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=60.0, help="history kept per bed")
+    parser.add_argument("--frame-seconds", type=float, default=1.0, help="duration of one device frame")
+    args = parser.parse_args()
+
+    rates = settings.CACHE_RING_RATES
+    streams = {"pressure_flow": PRESSURE_FLOW_CHANNELS, "ECG": ECG_CHANNELS}
+    frame_samples = {param_type: int(rates[param_type] * args.frame_seconds) for param_type in streams}
+    frames = int(args.seconds / args.frame_seconds)
+
+    # The deque layout, deep enough to hold the same history.
+    DeepDequeCache = lambda: PatientDataCache(depth=frames)
+
+    ring = lambda: PatientDataCache(
+        mode="ring",
+        ring_seconds=args.seconds,
+        ring_rates=rates,
+        ring_dtype=settings.CACHE_RING_DTYPE,
+        ring_max_frames=settings.CACHE_RING_MAX_FRAMES
+    )
+    waveform_dtype = np.dtype(settings.WAVEFORM_DTYPE)
+
+    print(f"history: {args.seconds:.0f}s per bed, frames of {args.frame_seconds}s, rates: {rates}")
+    print(f"{'layout':<36}{'bytes/bed':>12}{'vs list':>9}")
+    cases = [
+        ("deque of dicts, float lists", DeepDequeCache, True, waveform_dtype),
+        (f"deque of dicts, {waveform_dtype} arrays", DeepDequeCache, False, waveform_dtype),
+        (f"ring buffers, {settings.CACHE_RING_DTYPE}", ring, False, waveform_dtype),
+    ]
+    baseline = None
+    for name, make_cache, as_list, dtype in cases:
+        size = bed_bytes(make_cache, streams, frames, frame_samples, as_list, dtype)
+        baseline = baseline or size
+        print(f"{name:<36}{size:>12,}{baseline / size:>8.1f}x")
+
+    # Append and window read cost in ring mode.
+    cache = ring()
+    fill(cache, streams, frames, frame_samples, False, waveform_dtype)
+    frame = make_frame(PRESSURE_FLOW_CHANNELS, frame_samples["pressure_flow"], False, waveform_dtype)
+    append_us = min(timeit.repeat(
+        lambda: cache.update_data(1, "pressure_flow", frame, 1e9), number=1000, repeat=5)) * 1e3
+    read_us = min(timeit.repeat(
+        lambda: cache.get_last_seconds(1, "pressure_flow", 10), number=1000, repeat=5)) * 1e3
+    print(f"ring append: {append_us:.1f} us/frame, last 10 s read: {read_us:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Benchmark of the waveform message codecs (app/core/codecs.py).
+             Encodes synthetic one-second frames of each waveform param type (breathing pressure
+             and flow, ECG with PQRST complexes, EMG noise, impedance, EEG rhythms, all with
+             measurement noise) as JSON text and as binary messages with each codec. Reports the
+             message bytes per frame, the compression ratio against JSON and against raw float32,
+             the encode time per frame (payload encoding included, as for a new record) and the
+             largest decoding error in quantization steps (at most 0.5 by construction).
+             Real signals compress differently; replay captured frames for deployment figures.
+
+Usage:
+    cd backend && python benchmarks/bench_codecs.py [--frames 200] [--seed 0]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.core.codecs import CODECS, decode_binary
+from app.core.serialization import EncodedPayload, BinaryPayload, dumps_envelope, dumps_binary
+from config.settings import settings
+
+FIELDS = {"type": "get_parameters", "status": "success", "code": 200, "message": "Data fetched successfully"}
+
+
+def pressure_flow_frames(frames, rng, rate=125):
+    t = np.arange(frames * rate) / rate
+    phase = (t % 4.0) / 4.0
+    pressure = np.where(phase < 0.35, 20 - 12 * np.exp(-phase * 20), 5 + 3 * np.exp(-(phase - 0.35) * 20))
+    flow = np.gradient(pressure, t) * 3.0
+    return rate, {
+        "pressure": ("cmH2O", pressure + rng.normal(0, 0.05, t.size)),
+        "flow": ("L/min", flow + rng.normal(0, 0.2, t.size))
+    }
+
+
+def ecg_frames(frames, rng, rate=360):
+    t = np.arange(frames * rate) / rate
+    beat = t % 0.8
+    ecg = (0.1 * np.exp(-((beat - 0.16) / 0.025) ** 2) - 0.12 * np.exp(-((beat - 0.23) / 0.008) ** 2)
+           + 1.2 * np.exp(-((beat - 0.25) / 0.01) ** 2) - 0.25 * np.exp(-((beat - 0.27) / 0.008) ** 2)
+           + 0.3 * np.exp(-((beat - 0.45) / 0.04) ** 2))
+    return rate, {
+        "ecg": ("mV", ecg + rng.normal(0, 0.01, t.size)),
+        "emg": ("mV", rng.normal(0, 0.05, t.size)),
+        "impedance": ("ohm", 500 + 2 * np.sin(2 * np.pi * 0.25 * t) + rng.normal(0, 0.01, t.size)),
+        "eeg": ("mV", 0.03 * np.sin(2 * np.pi * 10 * t) + 0.02 * np.sin(2 * np.pi * 4 * t) + rng.normal(0, 0.005, t.size))
+    }
+
+
+def split_frames(rate, channels, frames):
+    return [
+        {name: {"unit": unit, "values": values[i * rate:(i + 1) * rate]} for name, (unit, values) in channels.items()}
+        for i in range(frames)
+    ]
+
+
+def measure(encode, data_frames):
+    """
+    Return (mean message bytes, mean encode microseconds, messages) of one encoder.
+    """
+    messages = []
+    started = time.perf_counter()
+    for seq, data in enumerate(data_frames):
+        messages.append(encode(seq, data))
+    elapsed = time.perf_counter() - started
+    return np.mean([len(message) for message in messages]), elapsed / len(data_frames) * 1e6, messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=200, help="one-second frames per param type")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the noise")
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    print(f"{'param_type':<15}{'codec':<17}{'bytes':>9}{'vs json':>9}{'vs raw':>8}{'encode us':>11}{'max err/step':>14}")
+    for param_type, make in (("pressure_flow", pressure_flow_frames), ("ECG", ecg_frames)):
+        rate, channels = make(args.frames, rng)
+        data_frames = split_frames(rate, channels, args.frames)
+
+        json_bytes, json_us, _ = measure(
+            lambda seq, data: dumps_envelope(dict(FIELDS, param_type=param_type, timestamp=float(seq)),
+                                             EncodedPayload(data).text).encode("utf-8"),
+            data_frames
+        )
+        print(f"{param_type:<15}{'json':<17}{json_bytes:>9.0f}{1:>9.2f}{'':>8}{json_us:>11.1f}{'':>14}")
+        raw_bytes = None
+        for codec in CODECS:
+            size, encode_us, messages = measure(
+                lambda seq, data: dumps_binary(
+                    dict(FIELDS, param_type=param_type, timestamp=float(seq)),
+                    [({"timestamp": float(seq), "seq": seq}, BinaryPayload(data))],
+                    codec, settings.WAVEFORM_CODEC_STEPS, settings.WAVEFORM_CODEC_DEFAULT_STEP,
+                    settings.WAVEFORM_CODEC_DEFLATE_LEVEL
+                ),
+                data_frames
+            )
+            raw_bytes = raw_bytes or size
+            # Largest decoding error, in quantization steps of the channel (float32 for raw).
+            worst = 0.0
+            for message, data in zip(messages, data_frames):
+                header, decoded = decode_binary(message)
+                for channel in header["channels"]:
+                    step = channel.get("step") or settings.WAVEFORM_CODEC_STEPS.get(
+                        channel["name"], settings.WAVEFORM_CODEC_DEFAULT_STEP)
+                    error = np.abs(decoded[channel["name"]] - data[channel["name"]]["values"]).max()
+                    worst = max(worst, error / step)
+            print(f"{'':<15}{codec:<17}{size:>9.0f}{json_bytes / size:>9.2f}{raw_bytes / size:>8.2f}"
+                  f"{encode_us:>11.1f}{worst:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
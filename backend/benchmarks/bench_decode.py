@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Micro-benchmark for the waveform table handlers.
+             Compares the NumPy decoders in app/binlog/decoders.py against the previous
+             list-of-floats implementation on synthetic binlog rows, reporting decode time,
+             decode + JSON serialization time and the bytes a decoded row keeps alive.
+
+Usage:
+    cd backend && python benchmarks/bench_decode.py [--rows 2000] [--ecg-samples 500]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.binlog.decoders import process_pressure_flow, process_ecg
+from app.core.serialization import dumps_message
+from config.settings import settings
+
+
+# ---------------------------------------------------------------------------
+# Previous list-based handlers, kept here as the reference implementation.
+# ---------------------------------------------------------------------------
+def _decode_keys_list(raw_params):
+    return {
+        key.decode('utf-8'): {
+            sub_key.decode('utf-8'): sub_val if not isinstance(sub_val, bytes)
+            else sub_val.decode('utf-8')
+            for sub_key, sub_val in value.items()
+        }
+        for key, value in raw_params.items()
+    }
+
+
+def list_pressure_flow(values):
+    decoded_params = _decode_keys_list(values["parameters"])
+    return "pressure_flow", {
+        channel: {
+            "unit": decoded_params[channel]["unit"],
+            "values": [float(v) for v in decoded_params[channel]["values"]]
+        }
+        for channel in ("pressure", "flow")
+    }
+
+
+def list_ecg(values):
+    decoded_params = _decode_keys_list(values["parameters"])
+    return "ECG", {
+        channel: {
+            "unit": decoded_params[channel]["unit"],
+            "values": [float(v) for v in decoded_params[channel]["values"]]
+        }
+        for channel in ("ecg", "emg", "impedance", "eeg")
+    }
+
+
+def make_row(channels, samples):
+    """
+    Build a row shaped like pymysqlreplication output (bytes keys, Python float samples).
+    """
+    return {
+        "parameters": {
+            name.encode(): {
+                b"unit": b"mV",
+                b"values": [round((i % 97) * 0.0137 + k, 4) for i in range(samples)]
+            }
+            for k, name in enumerate(channels)
+        }
+    }
+
+
+def measure(func, rows, with_json):
+    """
+    Return microseconds per row (best of 5 runs).
+    """
+    def run():
+        for row in rows:
+            param_type, data = func(row)
+            if with_json:
+                dumps_message({"param_type": param_type, "data": data})
+
+    seconds = min(timeit.repeat(run, number=1, repeat=5))
+    return seconds / len(rows) * 1e6
+
+
+def retained_bytes(func, make, count):
+    """
+    Return the bytes per row that stay allocated once the raw binlog row is dropped,
+    i.e. what a cache entry costs.
+    """
+    tracemalloc.start()
+    kept = []
+    for _ in range(count):
+        row = make()
+        kept.append(func(row))
+        del row
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2000, help="rows per measurement")
+    parser.add_argument("--ecg-samples", type=int, default=500, help="samples per ECG channel per row")
+    args = parser.parse_args()
+
+    make_pf = lambda: make_row(("pressure", "flow"), settings.SAMPLING_RATE)
+    make_ecg = lambda: make_row(("ecg", "emg", "impedance", "eeg"), args.ecg_samples)
+    pf_rows = [make_pf() for _ in range(args.rows)]
+    ecg_rows = [make_ecg() for _ in range(args.rows)]
+
+    # Both paths must produce the same samples (up to float32 rounding).
+    numpy_ecg = process_ecg(ecg_rows[0])[1]
+    list_ecg_data = list_ecg(ecg_rows[0])[1]
+    for channel, payload in list_ecg_data.items():
+        assert np.allclose(numpy_ecg[channel]["values"], payload["values"], rtol=1e-6)
+
+    print(f"waveform dtype: {settings.WAVEFORM_DTYPE}, rows: {args.rows}")
+    print(f"{'case':<24}{'decode us/row':>15}{'+json us/row':>15}{'retained B/row':>16}")
+    cases = [
+        ("pressure_flow list", list_pressure_flow, pf_rows, make_pf),
+        ("pressure_flow numpy", process_pressure_flow, pf_rows, make_pf),
+        ("ECG list", list_ecg, ecg_rows, make_ecg),
+        ("ECG numpy", process_ecg, ecg_rows, make_ecg),
+    ]
+    for name, func, rows, make in cases:
+        decode_us = measure(func, rows, with_json=False)
+        total_us = measure(func, rows, with_json=True)
+        retained = retained_bytes(func, make, min(args.rows, 200))
+        print(f"{name:<24}{decode_us:>15.1f}{total_us:>15.1f}{retained:>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Fan-out benchmark comparing the send engines (FANOUT_ENGINE).
+             An ingest thread appends pressure_flow frames at a fixed rate and queues one send
+             event per frame; N in-memory websockets are subscribed to the stream. Reports, per
+             engine, the time until the last socket received each frame (p50/p99), the wall
+             time until every frame reached every socket (or --timeout), the deliveries made and
+             the process CPU time per 1000 deliveries. A send engine falling more than CACHE_DEPTH
+             frames behind skips the frames already evicted from the cache.
+
+Usage:
+    cd backend && python benchmarks/bench_fanout.py [--sockets 1000] [--frames 100] [--rate 50] [--timeout 30]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.settings import settings
+# One send per frame: merged multi-frame messages would make the engines' counts differ.
+settings.SEND_QUEUE_POLICY = "drop_oldest"
+settings.SEND_QUEUE_MAX_EVENTS = 1000000
+
+from app.core.cache import data_cache
+from app.core.events import notifier
+from app.core.send_data import SendDataManager
+from app.binlog.decoders import PRESSURE_FLOW_CHANNELS
+
+
+class MemoryWebSocket:
+    """
+    Websocket stand-in recording, for every message, when the last subscriber received it.
+    """
+    def __init__(self, tracker):
+        self.tracker = tracker
+
+    async def send_text(self, message):
+        self.tracker.received(message)
+
+
+class DeliveryTracker:
+    def __init__(self, sockets, frames):
+        self.sockets = sockets
+        self.expected = sockets * frames
+        self.counts = {}
+        self.latencies = []
+        self.total = 0
+        self.done = threading.Event()
+
+    def received(self, message):
+        key = id(message)
+        count = self.counts.get(key, 0) + 1
+        self.counts[key] = count
+        self.total += 1
+        if count == self.sockets:
+            # The collection timestamp of the frame is the add time (see run()).
+            start = message.index('"timestamp": ') + 13
+            sent_at = float(message[start:message.index(",", start)])
+            self.latencies.append(time.time() - sent_at)
+            del self.counts[key]
+        if self.total >= self.expected:
+            self.done.set()
+
+
+def run(engine, sockets, frames, rate, frame, timeout):
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+    loop_thread.start()
+    manager = SendDataManager(max_workers=5, engine=engine, loop=loop)
+
+    tracker = DeliveryTracker(sockets, frames)
+    patient_id = f"bench-{engine}"
+    websockets = [MemoryWebSocket(tracker) for _ in range(sockets)]
+    for ws in websockets:
+        notifier.subscribe(patient_id, ["pressure_flow"], ws)
+
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    next_frame = started
+    for _ in range(frames):
+        now = time.perf_counter()
+        if now < next_frame:
+            time.sleep(next_frame - now)
+        seq = data_cache.update_data(patient_id, "pressure_flow", frame, time.time())
+        manager.add_event(patient_id, "pressure_flow", seq)
+        next_frame += 1.0 / rate
+    tracker.done.wait(timeout=timeout)
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    stats = manager.stats()
+
+    async def close():
+        for ws in websockets:
+            notifier.remove_websocket(ws)
+            manager.release(ws)
+        # Let the cancelled sender tasks finish.
+        await asyncio.sleep(0.1)
+
+    asyncio.run_coroutine_threadsafe(close(), loop).result()
+    manager.shutdown()
+    loop.call_soon_threadsafe(loop.stop)
+    loop_thread.join()
+    loop.close()
+    return np.array(tracker.latencies), wall, cpu, tracker.total, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sockets", type=int, default=1000, help="subscribed websockets")
+    parser.add_argument("--frames", type=int, default=100, help="frames sent")
+    parser.add_argument("--rate", type=float, default=50.0, help="frames per second")
+    parser.add_argument("--timeout", type=float, default=30.0, help="wait for the last deliveries")
+    parser.add_argument("--samples", type=int, default=125, help="samples per channel and frame")
+    args = parser.parse_args()
+
+    frame = {
+        channel: {"unit": "cmH2O", "values": np.random.rand(args.samples)}
+        for channel in PRESSURE_FLOW_CHANNELS
+    }
+    print(f"{args.sockets} sockets, {args.frames} frames at {args.rate:.0f}/s")
+    print(f"{'engine':<10}{'delivered':>11}{'p50 ms':>9}{'p99 ms':>9}{'wall s':>9}{'cpu ms/1k':>11}  stats")
+    for engine in ("threads", "asyncio"):
+        latencies, wall, cpu, total, stats = run(engine, args.sockets, args.frames, args.rate, frame, args.timeout)
+        # Latencies of the frames that reached every socket.
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1e3 if len(latencies) else (float("nan"),) * 2
+        print(f"{engine:<10}{total / (args.sockets * args.frames):>11.1%}{p50:>9.1f}{p99:>9.1f}{wall:>9.2f}"
+              f"{cpu / max(total, 1) * 1e6:>11.1f}  {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Read throughput benchmark of the subscription registry (app/core/events.py).
+             N websockets are subscribed over S streams. R reader threads, standing for the
+             ingest thread and the send workers, run the send path lookups of one event
+             (has_subscribers, get_subscribers, get_binary_subscribers, get_views) in a loop, while
+             a writer thread unsubscribes and resubscribes one websocket every --churn-interval
+             seconds. Reports the lookups per second of the copy-on-write registry and of a
+             registry whose reads take the lock and copy the set and whose changes log the full
+             table (the previous behaviour), with the writers' change latency.
+             Logging is disabled: the log lines are still formatted but not written.
+
+Usage:
+    cd backend && python benchmarks/bench_notifier.py [--subscribers 1000] [--streams 10] [--readers 1 5 16] [--seconds 2]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.logger import logger
+from app.core.events import DataUpdateNotifier, EMPTY_SUBSCRIPTION
+
+
+class LockedNotifier(DataUpdateNotifier):
+    """
+    Registry whose reads take the lock and copy, and whose changes log every subscription, as
+    before the copy-on-write snapshots.
+    """
+    def subscribe(self, *args, **kwargs):
+        marks = super().subscribe(*args, **kwargs)
+        with self.lock:
+            self._log_subscriptions()
+        return marks
+
+    def unsubscribe(self, *args, **kwargs):
+        super().unsubscribe(*args, **kwargs)
+        with self.lock:
+            self._log_subscriptions()
+
+    def has_subscribers(self, patient_id, param_type):
+        with self.lock:
+            return bool(self.streams.get((patient_id, param_type), EMPTY_SUBSCRIPTION).websockets)
+
+    def get_subscribers(self, patient_id, param_type, seq=None):
+        with self.lock:
+            return set(self.streams.get((patient_id, param_type), EMPTY_SUBSCRIPTION).websockets)
+
+    def get_binary_subscribers(self, patient_id, param_type):
+        with self.lock:
+            return dict(self.streams.get((patient_id, param_type), EMPTY_SUBSCRIPTION).binary)
+
+    def get_views(self, patient_id, param_type):
+        with self.lock:
+            return dict(self.streams.get((patient_id, param_type), EMPTY_SUBSCRIPTION).views)
+
+
+class FakeWebSocket:
+    pass
+
+
+def run(notifier, subscribers, streams, readers, seconds, churn_interval):
+    """
+    Return (lookups per second, change latencies in seconds).
+    """
+    websockets = [FakeWebSocket() for _ in range(subscribers)]
+    for i, ws in enumerate(websockets):
+        # Every tenth subscriber asks for binary frames, every fifth for a decimated view.
+        notifier.subscribe(
+            i % streams, ["pressure_flow"], ws,
+            fmt="binary" if i % 10 == 0 else "json", codec="delta16",
+            view=("minmax", 100) if i % 5 == 0 else None
+        )
+
+    stop = threading.Event()
+    reads = [0] * readers
+
+    def reader(index):
+        patient_id = index % streams
+        count = 0
+        while not stop.is_set():
+            if notifier.has_subscribers(patient_id, "pressure_flow"):
+                notifier.get_subscribers(patient_id, "pressure_flow", count)
+                notifier.get_binary_subscribers(patient_id, "pressure_flow")
+                notifier.get_views(patient_id, "pressure_flow")
+            count += 1
+            patient_id = (patient_id + 1) % streams
+        reads[index] = count
+
+    changes = []
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            ws = websockets[i % subscribers]
+            started = time.perf_counter()
+            notifier.unsubscribe(i % subscribers % streams, ["pressure_flow"], ws)
+            notifier.subscribe(i % subscribers % streams, ["pressure_flow"], ws)
+            changes.append(time.perf_counter() - started)
+            i += 1
+            time.sleep(churn_interval)
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    # Measured: busy readers delay the main thread's wakeup past --seconds.
+    return sum(reads) / (time.perf_counter() - started), np.array(changes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscribers", type=int, default=1000, help="subscribed websockets")
+    parser.add_argument("--streams", type=int, default=10, help="streams the websockets are spread over")
+    parser.add_argument("--readers", type=int, nargs="+", default=[1, 5, 16], help="reader thread counts")
+    parser.add_argument("--seconds", type=float, default=2.0, help="duration of each run")
+    parser.add_argument("--churn-interval", type=float, default=0.01, help="seconds between two subscription changes")
+    args = parser.parse_args()
+    logger.setLevel(logging.WARNING)
+
+    print(f"{args.subscribers} subscribers over {args.streams} streams, one change every {args.churn_interval * 1e3:.0f} ms")
+    print(f"{'registry':<16}{'readers':>8}{'lookups/s':>12}{'change p50 ms':>15}{'change p99 ms':>15}")
+    for readers in args.readers:
+        for name, notifier in (("copy-on-write", DataUpdateNotifier()), ("locked", LockedNotifier())):
+            rate, changes = run(notifier, args.subscribers, args.streams, readers, args.seconds, args.churn_interval)
+            p50, p99 = np.percentile(changes, [50, 99]) * 1e3 if len(changes) else (float("nan"),) * 2
+            print(f"{name:<16}{readers:>8}{rate:>12.0f}{p50:>15.3f}{p99:>15.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Throughput benchmark of the "threads" send engine by number of workers (SEND_WORKERS).
+             An ingest thread appends pressure_flow frames to S patient streams as fast as it can
+             and queues one send event per frame; every stream has K in-memory websockets. For
+             5, 16 and 32 workers, with the send queue sharded by stream ("ordered", the default)
+             and with one queue shared by all workers ("shared", the former layout), reports the
+             deliveries per second until every frame reached every socket, the process CPU time
+             per 1000 deliveries and the frames a socket received with a lower "seq" than the
+             frame before (out of order). The cache keeps every frame, so no frame is skipped.
+             Message building holds the GIL: the throughput grows with the workers only as far as
+             the cores and the sends release it.
+
+Usage:
+    cd backend && python benchmarks/bench_send_workers.py [--streams 32] [--sockets 10] [--frames 50] [--workers 5 16 32]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.settings import settings
+# One send per frame (no merged messages), and every frame stays cached until it is sent.
+settings.SEND_QUEUE_POLICY = "drop_oldest"
+settings.SEND_QUEUE_MAX_EVENTS = 1000000
+settings.CONNECTION_QUEUE_MAX_MESSAGES = 1000000
+settings.CACHE_MODE = "deque"
+settings.CACHE_DEPTH = 100000
+
+from app.core.cache import data_cache
+from app.core.events import notifier
+from app.core.send_data import SendDataManager
+from app.binlog.decoders import PRESSURE_FLOW_CHANNELS
+
+
+class MemoryWebSocket:
+    """
+    Websocket stand-in checking that the "seq" of its messages increases.
+    """
+    def __init__(self, tracker):
+        self.tracker = tracker
+        self.last_seq = -1
+
+    async def send_text(self, message):
+        start = message.index('"seq": ') + 7
+        seq = int(message[start:message.index(",", start)])
+        if seq < self.last_seq:
+            self.tracker.out_of_order += 1
+        self.last_seq = max(self.last_seq, seq)
+        self.tracker.received()
+
+
+class DeliveryTracker:
+    def __init__(self, expected):
+        self.expected = expected
+        self.total = 0
+        self.out_of_order = 0
+        self.done = threading.Event()
+
+    def received(self):
+        self.total += 1
+        if self.total >= self.expected:
+            self.done.set()
+
+
+def run(workers, ordered, streams, sockets, frames, frame, timeout):
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+    loop_thread.start()
+    manager = SendDataManager(max_workers=workers, engine="threads", loop=loop, ordered=ordered)
+
+    tracker = DeliveryTracker(streams * sockets * frames)
+    patients = [f"bench-{workers}-{ordered}-{i}" for i in range(streams)]
+    websockets = []
+    for patient_id in patients:
+        for _ in range(sockets):
+            ws = MemoryWebSocket(tracker)
+            notifier.subscribe(patient_id, ["pressure_flow"], ws)
+            websockets.append(ws)
+
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    for _ in range(frames):
+        for patient_id in patients:
+            seq = data_cache.update_data(patient_id, "pressure_flow", frame, time.time())
+            manager.add_event(patient_id, "pressure_flow", seq)
+    tracker.done.wait(timeout=timeout)
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    async def close():
+        for ws in websockets:
+            notifier.remove_websocket(ws)
+            manager.release(ws)
+        # Let the cancelled sender tasks finish.
+        await asyncio.sleep(0.1)
+
+    asyncio.run_coroutine_threadsafe(close(), loop).result()
+    manager.shutdown()
+    loop.call_soon_threadsafe(loop.stop)
+    loop_thread.join()
+    loop.close()
+    return tracker, wall, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=32, help="patient streams")
+    parser.add_argument("--sockets", type=int, default=10, help="websockets per stream")
+    parser.add_argument("--frames", type=int, default=50, help="frames per stream")
+    parser.add_argument("--workers", type=int, nargs="+", default=[5, 16, 32], help="worker counts")
+    parser.add_argument("--timeout", type=float, default=120.0, help="wait for the last deliveries")
+    parser.add_argument("--samples", type=int, default=125, help="samples per channel and frame")
+    args = parser.parse_args()
+
+    frame = {
+        channel: {"unit": "cmH2O", "values": np.random.rand(args.samples)}
+        for channel in PRESSURE_FLOW_CHANNELS
+    }
+    print(f"{args.streams} streams x {args.sockets} sockets, {args.frames} frames per stream, {os.cpu_count()} cores")
+    print(f"{'workers':<9}{'queue':<9}{'delivered':>11}{'deliveries/s':>14}{'cpu ms/1k':>11}{'out of order':>14}")
+    for workers in args.workers:
+        for ordered in (True, False):
+            tracker, wall, cpu = run(workers, ordered, args.streams, args.sockets, args.frames, frame, args.timeout)
+            print(f"{workers:<9}{'ordered' if ordered else 'shared':<9}{tracker.total / tracker.expected:>11.1%}"
+                  f"{tracker.total / wall:>14.0f}{cpu / max(tracker.total, 1) * 1e6:>11.1f}{tracker.out_of_order:>14}")
+
+
+if __name__ == "__main__":
+    main()
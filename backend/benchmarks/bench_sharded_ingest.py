@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Scaling benchmark of the sharded ingest pipeline (app/binlog/sharded.py).
+             Feeds the same binlog row events, from a capture file (see app/binlog/sources.py)
+             or synthetic pressure_flow and ECG rows, through ShardedIngest with 1, 2, 4, ...
+             worker processes, and through inline decoding in the reader thread (0 shards, the
+             INGEST_SHARDS=0 path), reporting rows per second from the first submit to the
+             drain() that covers the last row. Worker start-up is not timed.
+             By default the collector only counts the decoded rows, which measures the decode
+             stage the shards parallelize; with --commit it commits them to the cache as the
+             listener does during catch-up (commit_decoded with fanout=False), which adds the
+             single collector thread every shard feeds. Rows also cross two process boundaries
+             (pickled to a worker, and the decoded NumPy frames back), so the pipeline only
+             scales while decoding costs more than that transfer and there are cores to spare.
+
+Usage:
+    cd backend && python benchmarks/bench_sharded_ingest.py [--capture PATH] [--events 2000] [--rows-per-event 4]
+                                                            [--patients 32] [--shards 0 1 2 4] [--commit]
+"""
+
+import argparse
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.binlog.decoders import decode_rows
+from app.binlog.sharded import ShardedIngest
+from app.binlog.sources import read_capture
+from config.settings import settings
+
+
+def make_values(patient_id, collection_time, channels, samples):
+    """
+    Build row values shaped like pymysqlreplication output (bytes keys, Python float samples).
+    """
+    return {
+        "patient_id": patient_id,
+        "collection_time": collection_time,
+        "parameters": {
+            name.encode(): {
+                b"unit": b"mV",
+                b"values": [round((i % 97) * 0.0137 + k, 4) for i in range(samples)]
+            }
+            for k, name in enumerate(channels)
+        }
+    }
+
+
+def synthetic_events(count, rows_per_event, patients, ecg_samples):
+    """
+    Return [(table, rows)]: pressure_flow and ECG events alternately, each with rows of
+    rows_per_event consecutive patients.
+    """
+    start = datetime.datetime(2024, 1, 1)
+    events = []
+    for i in range(count):
+        collection_time = start + datetime.timedelta(seconds=i)
+        if i % 2:
+            table, channels, samples = "ecg_params", ("ecg", "emg", "impedance", "eeg"), ecg_samples
+        else:
+            table, channels, samples = "pressure_flow_params", ("pressure", "flow"), settings.SAMPLING_RATE
+        rows = [
+            {"values": make_values((i * rows_per_event + k) % patients + 1, collection_time, channels, samples)}
+            for k in range(rows_per_event)
+        ]
+        events.append((table, rows))
+    return events
+
+
+def captured_events(path):
+    return [
+        (table, [{"values": values} for values in rows])
+        for _, table, rows in read_capture(path)
+    ]
+
+
+class CountingSink:
+    """
+    Collector sink counting the decoded rows, optionally committing them to the cache.
+    """
+    def __init__(self, commit):
+        self.rows = 0
+        self._commit = None
+        if commit:
+            from app.binlog.listener import commit_decoded
+            self._commit = commit_decoded
+
+    def __call__(self, decoded, fanout):
+        if self._commit is not None:
+            self._commit(decoded, fanout=False)
+        self.rows += len(decoded)
+
+
+def run(events, shards, commit, queue_size):
+    """
+    Return (decoded rows, seconds) for one pass over the events.
+    """
+    sink = CountingSink(commit)
+    if shards == 0:
+        start = time.perf_counter()
+        for table, rows in events:
+            sink(decode_rows(table, rows), False)
+        return sink.rows, time.perf_counter() - start
+
+    ingest = ShardedIngest(sink=sink, shards=shards, queue_size=queue_size)
+    try:
+        # Wait for the workers to be up before timing.
+        ingest.drain()
+        start = time.perf_counter()
+        for table, rows in events:
+            ingest.submit(table, rows, False)
+        ingest.drain()
+        return sink.rows, time.perf_counter() - start
+    finally:
+        ingest.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--capture", help="capture file to replay instead of synthetic rows")
+    parser.add_argument("--events", type=int, default=2000, help="synthetic row events")
+    parser.add_argument("--rows-per-event", type=int, default=4, help="rows per synthetic event")
+    parser.add_argument("--patients", type=int, default=32, help="synthetic patients")
+    parser.add_argument("--ecg-samples", type=int, default=500, help="samples per ECG channel per row")
+    parser.add_argument("--shards", type=int, nargs="+", default=[0, 1, 2, 4, os.cpu_count() or 1],
+                        help="worker process counts (0: inline decoding)")
+    parser.add_argument("--queue-size", type=int, default=settings.INGEST_SHARD_QUEUE_SIZE,
+                        help="inbox and result queue capacity, in chunks")
+    parser.add_argument("--commit", action="store_true", help="commit the decoded rows to the cache")
+    args = parser.parse_args()
+
+    if args.capture:
+        events = captured_events(args.capture)
+    else:
+        events = synthetic_events(args.events, args.rows_per_event, args.patients, args.ecg_samples)
+    total = sum(len(rows) for _, rows in events)
+
+    print(f"events: {len(events)}, rows: {total}, cpus: {os.cpu_count()}, commit: {args.commit}")
+    print(f"{'shards':>8}{'rows/s':>12}{'speedup':>10}")
+    baseline = None
+    for shards in sorted(set(args.shards)):
+        rows, seconds = run(events, shards, args.commit, args.queue_size)
+        assert rows == total, f"{rows} of {total} rows decoded"
+        rate = rows / seconds
+        baseline = baseline or rate
+        print(f"{shards:>8}{rate:>12.0f}{rate / baseline:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -27,16 +27,147 @@ class Settings(BaseSettings):
     # Binlog configuration: Credentials for accessing the MySQL binlog.
     BINLOG_USER: str = os.getenv("BINLOG_USER")
     BINLOG_PASSWORD: str = os.getenv("BINLOG_PASSWORD")
+    # File storing the last binlog (log_file, log_pos) the listener committed.
+    BINLOG_CHECKPOINT_PATH: str = "data/binlog_checkpoint.json"
+    # Seconds between two checkpoint writes (0 disables checkpointing and resume).
+    BINLOG_CHECKPOINT_INTERVAL: float = 5.0
+    # After resuming, binlog events older than this many seconds only refresh the cache and the
+    # active parameter table; they are not sent to websocket clients.
+    BINLOG_CATCHUP_HORIZON: float = 10.0
+    # If set, every row event the listener receives is also recorded to this capture file
+    # (replay it with tools/ingest_capture.py).
+    BINLOG_CAPTURE_PATH: str = ""
     
+    # Seconds without data after which a patient parameter is marked inactive.
+    INACTIVITY_THRESHOLD: float = 20.0
+    # Interval (seconds) between two inactivity deadline checks.
+    ACTIVITY_CHECK_INTERVAL: float = 1.0
+    # Seconds without data after which an inactive parameter is forgotten.
+    ACTIVITY_EVICT_AFTER: float = 3600.0
+    # Interval (seconds) between two logs of the active parameter table.
+    ACTIVITY_LOG_INTERVAL: float = 60.0
+
     # Sampling rate for MATLAB analysis.
     SAMPLING_RATE: int = 125
+
+    # NumPy dtype used for decoded waveform samples ("float64" or "float32").
+    # float32 halves cache memory but its samples take longer to encode as JSON text.
+    WAVEFORM_DTYPE: str = "float64"
+    
+    # Records kept per patient parameter (outside ring buffers).
+    CACHE_DEPTH: int = 10
+    # Memory budget (MiB) of the cached records; beyond it whole patients are evicted,
+    # least recently used first (0 disables).
+    CACHE_MEMORY_BUDGET_MB: float = 1024.0
+    # Seconds without data after which a cached patient parameter is evicted (0 disables).
+    CACHE_STREAM_TTL: float = 3600.0
+    # Interval (seconds) between two cache eviction sweeps.
+    CACHE_SWEEP_INTERVAL: float = 10.0
+    # Cache layout: "deque" keeps the last CACHE_DEPTH payloads per patient parameter; "ring" keeps
+    # waveform parameters (CACHE_RING_RATES) in preallocated NumPy ring buffers sized in seconds.
+    CACHE_MODE: str = "deque"
+    # Seconds of waveform history kept per patient parameter in ring mode.
+    CACHE_RING_SECONDS: float = 60.0
+    # Sampling rate (Hz) of each waveform param type stored in ring buffers.
+    CACHE_RING_RATES: dict = {"pressure_flow": 125, "ECG": 360}
+    # NumPy dtype of the ring buffers.
+    CACHE_RING_DTYPE: str = "float32"
+    # Frame records kept per ring (older frames stay readable as samples only).
+    CACHE_RING_MAX_FRAMES: int = 1024
+    # Seconds of recent rows loaded from the *_params tables into the cache at startup, before
+    # the binlog listener starts (0 disables).
+    WARM_START_SECONDS: float = 30.0
+    # Maximum seconds of cached history a subscription can request with backfill_seconds.
+    BACKFILL_MAX_SECONDS: float = 60.0
+    # Shared-memory cache role of this process: "off"; "writer" (runs the binlog listener and
+    # publishes every cache record to shared memory); "reader" (no binlog listener, serves
+    # websockets from the writer's shared memory). Run one writer and any number of readers
+    # on distinct SERVER_PORTs behind a load balancer.
+    SHARED_CACHE_ROLE: str = "off"
+    # Name of the shared memory segment.
+    SHARED_CACHE_NAME: str = "dticu_cache"
+    # Patient parameters the segment holds (the least recently written one is replaced beyond it).
+    SHARED_CACHE_SLOTS: int = 256
+    # Maximum encoded size (bytes) of one shared record; larger records are not shared.
+    SHARED_CACHE_RECORD_BYTES: int = 32768
+    # Interval (seconds) at which reader processes poll the segment for new records.
+    SHARED_CACHE_POLL_INTERVAL: float = 0.01
+    # Port of the websocket server.
+    SERVER_PORT: int = 8000
     
     # Number of MATLAB engine instances to maintain in the pool.
     MATLAB_ENGINE_POOL_SIZE: int = 200
     
     # Maximum allowed WebSocket connections.
     MAX_CONNECTIONS: int = 1000
-    
+
+    # Batched binlog ingestion: rows are grouped per (patient_id, param_type) and committed
+    # to the cache, the active parameter table and the send queue once per batch.
+    INGEST_BATCH_ENABLED: bool = False
+    # Maximum number of rows buffered before a batch is flushed.
+    INGEST_BATCH_MAX_ROWS: int = 500
+    # Maximum time (seconds) a row may wait in a batch before it is flushed.
+    INGEST_BATCH_MAX_DELAY: float = 0.05
+    # Number of worker processes decoding binlog rows, sharded by patient_id (0 decodes in the
+    # listener thread).
+    INGEST_SHARDS: int = 0
+    # Capacity (in row chunks) of each shard's input queue and of the shared result queue.
+    INGEST_SHARD_QUEUE_SIZE: int = 1000
+
+    # Bounded send queue between ingestion and the send workers.
+    # Maximum number of pending send events over all streams.
+    SEND_QUEUE_MAX_EVENTS: int = 10000
+    # Overflow policy, applied once the bound is exceeded: "coalesce" (keep the latest event per
+    # stream, the latest SEND_QUEUE_MAX_MERGE_FRAMES frames per waveform stream), "drop_oldest"
+    # or "block" (the ingest thread waits).
+    SEND_QUEUE_POLICY: str = "coalesce"
+    # Waveform frames kept per stream when the coalesce policy shrinks the queue.
+    SEND_QUEUE_MAX_MERGE_FRAMES: int = 10
+    # Fan-out engine delivering queued events: "asyncio" (messages built inside the event loop)
+    # or "threads" (messages built by send worker threads). Both send through one task per websocket.
+    FANOUT_ENGINE: str = "asyncio"
+    # Number of send worker threads ("threads" engine). The send queue has one shard per worker,
+    # streams being routed by (patient_id, param_type), so each stream stays in order.
+    SEND_WORKERS: int = 5
+    # Bounded outbound queue of each websocket.
+    # Maximum number of messages pending for one websocket.
+    CONNECTION_QUEUE_MAX_MESSAGES: int = 256
+    # Slow-consumer policy: "drop_oldest" (drop the oldest pending waveform frames first),
+    # "coalesce" (once the queue is full or lags more than CONNECTION_MAX_LAG_SECONDS, keep the
+    # latest pending message per stream) or "disconnect" (close the websocket in that case).
+    CONNECTION_QUEUE_POLICY: str = "drop_oldest"
+    # Seconds the oldest pending message may wait before a websocket is considered lagging
+    # (disconnected, or its messages coalesced).
+    CONNECTION_MAX_LAG_SECONDS: float = 5.0
+    # Ward (central station) aggregate subscriptions.
+    # Seconds between two ward updates.
+    WARD_TICK_SECONDS: float = 1.0
+    # Newest pressure_flow frames the ward PEEP estimate looks at (enough to cover a breath).
+    WARD_PEEP_FRAMES: int = 5
+    # Quantization step of each waveform channel under the delta16 codecs of binary subscriptions
+    # (decoded samples are within step / 2 of the cached ones), in the channel's unit.
+    WAVEFORM_CODEC_STEPS: dict = {
+        "pressure": 0.01, "flow": 0.01, "ecg": 0.001, "emg": 0.001, "impedance": 0.001, "eeg": 0.001
+    }
+    # Quantization step of the channels missing from WAVEFORM_CODEC_STEPS.
+    WAVEFORM_CODEC_DEFAULT_STEP: float = 0.001
+    # zlib compression level of the delta16+deflate codec (1 is the fastest).
+    WAVEFORM_CODEC_DEFLATE_LEVEL: int = 1
+    # Seconds of signal a waveform display shows, used to turn the "width" (pixels) of a
+    # get_parameters request into points per second when it gives no "window_seconds".
+    DECIMATION_DEFAULT_WINDOW_SECONDS: float = 10.0
+
+    # Threads committing the frames pushed to the direct /ingest endpoint. Frames are committed
+    # off the event loop: a full send queue ("block" policy) must not stall the loop draining it.
+    INGEST_DEVICE_THREADS: int = 4
+    # Write-behind persistence of frames pushed to the direct /ingest endpoint.
+    # Maximum number of rows written per batch.
+    WRITE_BEHIND_MAX_ROWS: int = 500
+    # Maximum time (seconds) a frame waits before its batch is written.
+    WRITE_BEHIND_INTERVAL: float = 0.5
+    # Capacity of the pending row queue; frames are dropped from persistence when it is full.
+    WRITE_BEHIND_QUEUE_SIZE: int = 50000
+
 
 # Create a global settings instance to be used across the application.
 settings = Settings()
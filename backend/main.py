@@ -4,8 +4,11 @@
 Author: yadian zhao
 Institution: Canterbury University
 Description: This is the entry point of the application.
-             It initializes the MATLAB engine pool, starts background threads for binlog listening and active
-             parameter monitoring, and launches the FastAPI server using Uvicorn.
+             It initializes the MATLAB engine pool while warm-starting the cache from the database,
+             starts background threads for binlog listening and active parameter monitoring, and
+             launches the FastAPI server using Uvicorn.
+             With SHARED_CACHE_ROLE "reader" the process follows the shared cache of a writer
+             process instead of listening to the binlog.
 """
 
 import uvicorn
@@ -18,42 +21,70 @@ import os
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, project_root)
 
-# Import the FastAPI application from the WebSocket router.
-from app.routers.ws_router import fastapp
-# Import binlog listener functions and active parameter monitoring.
-from app.binlog.listener import binlog_listener, start_monitoring_active_params
-# Import the send data manager for handling data events.
-from app.core.send_data import send_data_manager
-# Import the main event loop instance.
-from app.core.event_loop import main_event_loop
-# Import the MATLAB engine pool.
-from app.matlab_engine.engine import ENGINE_POOL
-
 if __name__ == "__main__":
+    # The application modules are imported here rather than at module level: ingest worker
+    # processes (INGEST_SHARDS > 0) are spawned and re-import this module, and must not
+    # create the database pool, the send workers or the MATLAB engine pool.
+
+    # Import the FastAPI application from the WebSocket router.
+    from app.routers.ws_router import fastapp
+    # Import binlog listener functions and active parameter monitoring.
+    from app.binlog.listener import binlog_listener, start_monitoring_active_params, start_shared_cache_feed
+    # Import the ward update thread.
+    from app.core.ward import start_ward_aggregator, ward_aggregator
+    # Import the send data manager for handling data events.
+    from app.core.send_data import send_data_manager
+    # Import the write-behind writer persisting directly ingested frames.
+    from app.database.writer import write_behind
+    # Import the main event loop instance.
+    from app.core.event_loop import main_event_loop
+    # Import the MATLAB engine pool.
+    from app.matlab_engine.engine import ENGINE_POOL
+    # Import the startup cache warm-start.
+    from app.binlog.warm_start import start_warm_start
+    # Import the global cache (closed on exit when it is shared).
+    from app.core.cache import data_cache
+    from config.settings import settings
+
     # Set the main event loop to be used by asyncio.
     asyncio.set_event_loop(main_event_loop)
 
+    # Load the recent history into the cache while the MATLAB engines start.
+    warm_start_thread = None
+    if settings.SHARED_CACHE_ROLE != "reader":
+        warm_start_thread = start_warm_start()
+
     # Preload MATLAB engines for analysis.
     ENGINE_POOL.preload_engines()
+
+    # The binlog listener starts after the warm-start so live rows are cached after the history.
+    if warm_start_thread is not None:
+        warm_start_thread.join()
     
     # Start a background thread to monitor active parameters.
     monitor_thread = start_monitoring_active_params()
+    # Start the thread pushing ward (central station) updates.
+    ward_thread = start_ward_aggregator()
     
-    # Start the binlog listener in a separate daemon thread.
+    if settings.SHARED_CACHE_ROLE == "reader":
+        # Reader processes follow the writer's shared cache instead of the binlog.
+        feed_thread = start_shared_cache_feed()
+    else:
+        # Start the binlog listener in a separate daemon thread.
 
-    binlog_thread = threading.Thread(
-        target=binlog_listener,
-        name="BinlogListener",
-        daemon=True
-    )
-    binlog_thread.start()
+        binlog_thread = threading.Thread(
+            target=binlog_listener,
+            name="BinlogListener",
+            daemon=True
+        )
+        binlog_thread.start()
     
     # Configure the Uvicorn server with FastAPI application settings.
 
     config = uvicorn.Config(
         fastapp,
         host="0.0.0.0",
-        port=8000,
+        port=settings.SERVER_PORT,
         loop="asyncio",
         ws_ping_interval=3,
         ws_ping_timeout=3
@@ -69,3 +100,11 @@ if __name__ == "__main__":
         # Shutdown the send data manager gracefully on exit.
 
         send_data_manager.shutdown()
+        ward_aggregator.stop()
+        # Persist the frames still queued by the direct ingest endpoint.
+        write_behind.stop()
+        # Detach from (writer: remove) the shared cache segment.
+        if settings.SHARED_CACHE_ROLE == "reader":
+            data_cache.close()
+        elif data_cache.mirror is not None:
+            data_cache.mirror.close()
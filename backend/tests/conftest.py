@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Shared pytest setup. The tests exercise the in-process logic only (queues, cache,
+             codecs, notifier, ...) and never connect to MySQL or MATLAB, but config.settings
+             requires the connection settings: placeholders are set when the environment
+             does not provide them.
+
+Usage:
+    cd backend && python -m pytest -q tests
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+for name, value in (("DB_HOST", "localhost"), ("DB_USER", "test"), ("DB_PASSWORD", "test"),
+                    ("DB_NAME", "test"), ("MATLAB_CODE_PATH", "."), ("BINLOG_USER", "test"),
+                    ("BINLOG_PASSWORD", "test")):
+    os.environ.setdefault(name, value)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Tests of the active parameter tracker (app/binlog/activity.py): deadlines kept in a
+             heap, lazy re-scheduling of updated parameters, and eviction.
+"""
+
+from app.binlog.activity import ActivityTracker
+
+KEY = (1, "pressure_flow")
+
+
+def make_tracker():
+    transitions = []
+    tracker = ActivityTracker(threshold=10.0, evict_after=60.0, on_change=transitions.extend)
+    return tracker, transitions
+
+
+def test_touch_activates_once():
+    tracker, transitions = make_tracker()
+
+    tracker.touch(KEY, 100.0)
+    tracker.touch(KEY, 101.0)
+
+    assert tracker.is_active(KEY)
+    assert transitions == [(1, "pressure_flow", True, 100.0)]
+    assert tracker.params[KEY]["last_update"] == 101.0
+
+
+def test_expire_marks_inactive_after_threshold():
+    tracker, transitions = make_tracker()
+    tracker.touch(KEY, 100.0)
+
+    assert tracker.expire(now=109.0) == []
+    assert tracker.expire(now=110.0) == [(1, "pressure_flow", False, 100.0)]
+    assert not tracker.is_active(KEY)
+    assert transitions[-1] == (1, "pressure_flow", False, 100.0)
+
+
+def test_updated_parameter_is_rescheduled_not_expired():
+    tracker, _ = make_tracker()
+    tracker.touch(KEY, 100.0)
+    tracker.touch(KEY, 108.0)
+
+    # The heap entry of t=110 is stale: the parameter is re-pushed at 118.
+    assert tracker.expire(now=110.0) == []
+    assert tracker.is_active(KEY)
+    assert tracker.params[KEY]["deadline"] == 118.0
+    assert tracker.expire(now=118.0) == [(1, "pressure_flow", False, 108.0)]
+
+
+def test_inactive_parameter_is_evicted_after_evict_after():
+    tracker, _ = make_tracker()
+    tracker.touch(KEY, 100.0)
+    tracker.expire(now=110.0)
+
+    tracker.expire(now=159.0)
+    assert KEY in tracker.params
+    tracker.expire(now=160.0)
+    assert KEY not in tracker.params
+    assert tracker.evicted == 1
+    assert tracker.stats()["tracked"] == 0
+
+
+def test_reactivated_parameter_supersedes_eviction_entry():
+    tracker, transitions = make_tracker()
+    tracker.touch(KEY, 100.0)
+    tracker.expire(now=110.0)
+    tracker.touch(KEY, 150.0)
+
+    # The eviction entry (t=160) no longer matches the parameter's deadline.
+    tracker.expire(now=159.0)
+    assert tracker.is_active(KEY)
+    assert transitions[-1] == (1, "pressure_flow", True, 150.0)
+    assert tracker.evicted == 0
+
+
+def test_expire_only_pops_due_entries():
+    tracker, _ = make_tracker()
+    for patient_id in range(100):
+        tracker.touch((patient_id, "ECG"), 100.0 + patient_id)
+
+    expired = tracker.expire(now=115.0)
+
+    assert sorted(patient_id for patient_id, _, _, _ in expired) == list(range(6))
+    assert len(tracker.active_keys()) == 94
+
+
+def test_on_change_errors_are_contained():
+    def failing(transitions):
+        raise RuntimeError("websocket gone")
+    tracker = ActivityTracker(threshold=10.0, evict_after=60.0, on_change=failing)
+
+    tracker.touch(KEY, 100.0)
+
+    assert tracker.is_active(KEY)
+
+
+def test_on_evict_receives_evicted_keys():
+    evicted = []
+    tracker = ActivityTracker(threshold=10.0, evict_after=60.0, on_evict=evicted.extend)
+    tracker.touch(KEY, 100.0)
+    tracker.touch((2, "ECG"), 150.0)
+
+    tracker.expire(now=110.0)
+    tracker.expire(now=160.0)
+
+    assert evicted == [KEY]
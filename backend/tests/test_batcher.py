@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Tests of batched ingest (app/binlog/batcher.py with listener.commit_groups): only the
+             groups that were committed are counted in the ingest metrics.
+"""
+
+import pytest
+
+from app.binlog import listener
+from app.binlog.batcher import IngestBatcher
+from app.core.metrics import ingest_metrics
+
+
+@pytest.fixture
+def batcher():
+    batcher = IngestBatcher(commit=listener.commit_groups, max_rows=100, max_delay=60.0)
+    yield batcher
+    batcher.stop()
+
+
+def counters():
+    return ingest_metrics.batched_rows_total, ingest_metrics.groups_total, ingest_metrics.batches_total
+
+
+def test_failed_groups_are_not_counted(monkeypatch, batcher):
+    committed = []
+
+    def update_batch(patient_id, param_type, rows):
+        if patient_id == 2:
+            raise ValueError("channels of unequal lengths")
+        committed.append((patient_id, param_type, len(rows)))
+        return list(range(len(rows)))
+    monkeypatch.setattr(listener.data_cache, "update_batch", update_batch)
+    monkeypatch.setattr(listener.send_data_manager, "add_events", lambda *args: None)
+    monkeypatch.setattr(listener.activity_tracker, "touch_many", lambda updates: None)
+    before = counters()
+
+    for patient_id, count in ((1, 3), (2, 4), (3, 1)):
+        for i in range(count):
+            batcher.add(patient_id, "breath_cycle", {"i": i}, float(i))
+    batcher.flush()
+
+    assert committed == [(1, "breath_cycle", 3), (3, "breath_cycle", 1)]
+    rows, groups, batches = (after - start for after, start in zip(counters(), before))
+    assert (rows, groups, batches) == (4, 2, 1)
+
+
+def test_batch_with_no_committed_group_is_not_recorded(monkeypatch, batcher):
+    def update_batch(patient_id, param_type, rows):
+        raise ValueError("channels of unequal lengths")
+    monkeypatch.setattr(listener.data_cache, "update_batch", update_batch)
+    before = counters()
+
+    batcher.add(1, "breath_cycle", {}, 0.0)
+    batcher.flush()
+
+    assert counters() == before
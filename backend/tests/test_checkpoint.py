@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Tests of the binlog checkpoint and of the catch-up gate (app/binlog/checkpoint.py).
+"""
+
+import json
+import os
+import time
+
+import pytest
+
+from app.binlog.checkpoint import BinlogCheckpoint, CatchUpGate
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = tmp_path / "state" / "checkpoint.json"
+    checkpoint = BinlogCheckpoint(str(path), interval=5.0)
+
+    checkpoint.save("mysql-bin.000003", 1234)
+
+    loaded = BinlogCheckpoint(str(path), interval=5.0)
+    assert loaded.load() == ("mysql-bin.000003", 1234)
+    assert loaded.saved_at == pytest.approx(time.time(), abs=5)
+
+
+def test_checkpoint_save_is_atomic(tmp_path, monkeypatch):
+    path = tmp_path / "checkpoint.json"
+    checkpoint = BinlogCheckpoint(str(path), interval=0)
+    checkpoint.save("mysql-bin.000001", 100)
+
+    # A crash between the write and the rename leaves the previous checkpoint intact.
+    def failing_replace(src, dst):
+        raise OSError("disk full")
+    monkeypatch.setattr(os, "replace", failing_replace)
+    checkpoint.save("mysql-bin.000001", 200)
+
+    assert BinlogCheckpoint(str(path), interval=0).load() == ("mysql-bin.000001", 100)
+    assert json.loads(path.read_text())["log_pos"] == 100
+
+
+def test_checkpoint_missing_or_unreadable_file_is_ignored(tmp_path):
+    assert BinlogCheckpoint(str(tmp_path / "missing.json"), interval=5.0).load() == (None, None)
+
+    corrupt = tmp_path / "corrupt.json"
+    corrupt.write_text("{\"log_file\": ")
+    assert BinlogCheckpoint(str(corrupt), interval=5.0).load() == (None, None)
+
+
+def test_checkpoint_skips_unchanged_or_empty_positions(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    checkpoint = BinlogCheckpoint(str(path), interval=5.0)
+
+    checkpoint.save(None, 4)
+    assert not path.exists()
+
+    checkpoint.save("mysql-bin.000001", 4)
+    # The same position again is not rewritten.
+    path.write_text(json.dumps({"log_file": "edited", "log_pos": 0}))
+    checkpoint.save("mysql-bin.000001", 4)
+    assert json.loads(path.read_text())["log_file"] == "edited"
+
+
+def test_checkpoint_due_after_interval(monkeypatch, tmp_path):
+    clock = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: clock[0])
+    checkpoint = BinlogCheckpoint(str(tmp_path / "checkpoint.json"), interval=5.0)
+
+    assert checkpoint.due()
+    checkpoint.save("mysql-bin.000001", 4)
+    assert not checkpoint.due()
+    clock[0] += 5.0
+    assert checkpoint.due()
+
+
+def test_catch_up_gate_inactive_never_stale():
+    gate = CatchUpGate(horizon=10.0, active=False)
+
+    assert not gate.is_stale(0.0)
+    assert gate.skipped_events == 0
+
+
+def test_catch_up_gate_ends_at_first_recent_event():
+    gate = CatchUpGate(horizon=10.0, active=True)
+    now = time.time()
+
+    assert gate.is_stale(now - 60)
+    assert gate.is_stale(now - 30)
+    assert not gate.is_stale(now - 1)
+    # Catch-up is over for good: an old event (late device clock) is fanned out.
+    assert not gate.is_stale(now - 60)
+    assert gate.skipped_events == 2
+    assert not gate.active
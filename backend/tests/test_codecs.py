@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Tests of the binary waveform codecs (app/core/codecs.py) through the message encoder
+             (serialization.dumps_binary) and the reference decoder (codecs.decode_binary).
+"""
+
+import numpy as np
+import pytest
+
+from app.core.codecs import CODECS, decode_binary, encode_channel
+from app.core.serialization import BinaryPayload, dumps_binary
+
+STEP = 0.01
+
+
+def waveform(pressure, flow):
+    return {
+        "pressure": {"unit": "cmH2O", "values": np.asarray(pressure, dtype=np.float64)},
+        "flow": {"unit": "L/min", "values": np.asarray(flow, dtype=np.float64)}
+    }
+
+
+def encode(frames, codec, steps=None):
+    """
+    Encode [(data, timestamp, seq)] as one binary message and decode it.
+    """
+    message = dumps_binary(
+        {"type": "get_parameters", "param_type": "pressure_flow", "timestamp": frames[-1][1], "seq": frames[-1][2],
+         "status": "success"},
+        [({"data": data, "timestamp": timestamp, "seq": seq}, BinaryPayload(data)) for data, timestamp, seq in frames],
+        codec=codec, steps=steps or {}, default_step=STEP
+    )
+    return decode_binary(message)
+
+
+def channel_headers(header):
+    return {channel["name"]: channel for channel in header["channels"]}
+
+
+@pytest.mark.parametrize("codec", list(CODECS))
+def test_round_trip_within_half_a_step(codec):
+    rng = np.random.default_rng(0)
+    frames = [
+        (waveform(rng.normal(10, 3, 125), rng.normal(0, 30, 125)), 100.0 + i, i)
+        for i in range(3)
+    ]
+
+    header, channels = encode(frames, codec)
+
+    assert header["type"] == "get_parameters"
+    assert "status" not in header
+    assert header["frames"] == [[100.0, 0], [101.0, 1], [102.0, 2]]
+    for name in ("pressure", "flow"):
+        sent = np.concatenate([data[name]["values"] for data, _, _ in frames])
+        assert channel_headers(header)[name]["counts"] == [125, 125, 125]
+        if codec == "raw":
+            np.testing.assert_array_equal(channels[name], sent.astype(np.float32))
+        else:
+            assert channel_headers(header)[name]["encoding"] == "delta16"
+            assert np.abs(channels[name] - sent).max() <= STEP / 2 + 1e-9
+
+
+def test_per_channel_steps():
+    data = waveform(np.linspace(0, 5, 50), np.linspace(-5, 5, 50))
+
+    header, channels = encode([(data, 0.0, 0)], "delta16", steps={"flow": 0.5})
+
+    assert channel_headers(header)["flow"]["step"] == 0.5
+    assert channel_headers(header)["pressure"]["step"] == STEP
+    assert np.abs(channels["flow"] - data["flow"]["values"]).max() <= 0.25 + 1e-9
+
+
+def test_int16_overflow_falls_back_to_float32():
+    # A jump of 1000 is 100000 steps, beyond int16.
+    pressure = [0.0, 1000.0, 0.0]
+    data = waveform(pressure, [1.0, 2.0, 3.0])
+
+    header, channels = encode([(data, 0.0, 0)], "delta16+deflate")
+
+    assert channel_headers(header)["pressure"]["encoding"] == "float32"
+    assert channel_headers(header)["flow"]["encoding"] == "delta16"
+    np.testing.assert_array_equal(channels["pressure"], pressure)
+    assert np.abs(channels["flow"] - [1.0, 2.0, 3.0]).max() <= STEP / 2 + 1e-9
+
+
+def test_non_finite_samples_fall_back_to_float32():
+    pressure = [1.0, np.nan, 3.0, np.inf]
+    data = waveform(pressure, [0.0, 0.0, 0.0, 0.0])
+
+    header, channels = encode([(data, 0.0, 0)], "delta16")
+
+    assert channel_headers(header)["pressure"]["encoding"] == "float32"
+    np.testing.assert_array_equal(channels["pressure"], pressure)
+
+
+def test_encode_channel_edge_cases():
+    # Empty and single-sample channels.
+    assert encode_channel(np.array([]), "delta16", STEP)[0] == {"encoding": "float32"}
+    fields, data = encode_channel(np.array([1.234]), "delta16", STEP)
+    assert fields == {"encoding": "delta16", "step": STEP, "first": 123}
+    assert data == b""
+    # A non-positive step cannot quantize.
+    assert encode_channel(np.array([1.0, 2.0]), "delta16", 0)[0] == {"encoding": "float32"}
+
+
+def test_odd_sample_counts_stay_aligned():
+    frames = [(waveform(np.arange(n) * 0.1, np.arange(n) * -0.1), float(n), i) for i, n in enumerate((3, 5))]
+
+    header, channels = encode(frames, "delta16")
+
+    assert channel_headers(header)["pressure"]["counts"] == [3, 5]
+    expected = np.concatenate([np.arange(3), np.arange(5)]) * -0.1
+    assert np.abs(channels["flow"] - expected).max() <= STEP / 2 + 1e-9
+
+
+def test_decode_rejects_other_messages():
+    with pytest.raises(ValueError):
+        decode_binary(b"JSON" + b"\0" * 16)
+
+
+def test_non_waveform_frames_are_not_encoded():
+    data = {"HR": 72}
+
+    assert dumps_binary({"type": "get_parameters"}, [({"data": data, "timestamp": 0.0, "seq": 0}, BinaryPayload(data))]) is None
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Tests of the waveform decimation (app/core/decimation.py): index invariants of
+             minmax and LTTB, and the decimated payloads.
+"""
+
+import numpy as np
+import pytest
+
+from app.core.decimation import DecimatedPayload, lttb, minmax
+
+
+@pytest.fixture
+def signal():
+    rng = np.random.default_rng(1)
+    values = np.sin(np.linspace(0, 20, 500)) + rng.normal(0, 0.1, 500)
+    # A spike, as a QRS complex.
+    values[237] = 9.0
+    values[411] = -9.0
+    return values
+
+
+@pytest.mark.parametrize("points", [2, 3, 10, 50, 101, 500, 800])
+def test_minmax_keeps_two_ordered_indices_per_bucket(signal, points):
+    positions = minmax(signal, points)
+    buckets = max(1, min(points // 2, len(signal)))
+    edges = np.linspace(0, len(signal), buckets + 1).astype(np.int64)
+
+    assert len(positions) == 2 * buckets
+    assert np.all(np.diff(positions) >= 0)
+    for i in range(buckets):
+        low, high = positions[2 * i], positions[2 * i + 1]
+        assert edges[i] <= low <= high < edges[i + 1]
+        bucket = signal[edges[i]:edges[i + 1]]
+        assert {signal[low], signal[high]} == {bucket.min(), bucket.max()}
+
+
+def test_minmax_keeps_spikes(signal):
+    positions = minmax(signal, 20)
+
+    assert 237 in positions and 411 in positions
+
+
+@pytest.mark.parametrize("points", [3, 4, 10, 50, 499])
+def test_lttb_keeps_points_increasing_with_endpoints(signal, points):
+    positions = lttb(signal, points)
+    edges = np.linspace(1, len(signal) - 1, points - 1).astype(np.int64)
+
+    assert len(positions) == points
+    assert positions[0] == 0 and positions[-1] == len(signal) - 1
+    assert np.all(np.diff(positions) > 0)
+    # One sample from each of the points - 2 inner buckets.
+    for i, position in enumerate(positions[1:-1]):
+        assert edges[i] <= position < edges[i + 1]
+
+
+def test_lttb_keeps_spikes(signal):
+    positions = lttb(signal, 20)
+
+    assert 237 in positions and 411 in positions
+
+
+def test_lttb_small_targets():
+    values = np.arange(10, dtype=np.float64)
+
+    np.testing.assert_array_equal(lttb(values, 10), np.arange(10))
+    np.testing.assert_array_equal(lttb(values, 20), np.arange(10))
+    np.testing.assert_array_equal(lttb(values, 2), [0, 9])
+
+
+def waveform(values):
+    return {"ecg": {"unit": "mV", "values": values}}
+
+
+def test_decimated_payload_minmax(signal):
+    payload = DecimatedPayload(waveform(signal), "minmax", points_per_second=50, rate=250.0)
+
+    # 500 samples at 250 Hz are 2 s: 100 points.
+    assert len(payload.data["ecg"]["values"]) == 100
+    assert "positions" not in payload.data["ecg"]
+    assert payload.data["ecg"]["unit"] == "mV"
+    assert payload.nbytes > 0
+
+
+def test_decimated_payload_lttb_carries_positions(signal):
+    payload = DecimatedPayload(waveform(signal), "lttb", points_per_second=50, rate=250.0)
+
+    positions = payload.data["ecg"]["positions"]
+    assert len(positions) == 100
+    np.testing.assert_array_equal(payload.data["ecg"]["values"], signal[positions])
+
+
+def test_decimated_payload_keeps_frames_at_or_below_the_target(signal):
+    data = waveform(signal)
+
+    assert DecimatedPayload(data, "minmax", points_per_second=250, rate=250.0).data["ecg"] is data["ecg"]
+    non_waveform = {"HR": 72}
+    assert DecimatedPayload(non_waveform, "lttb", 10, 250.0).data is non_waveform
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Tests of the binlog row decoders (app/binlog/decoders.py): waveform documents with
+             bytes keys (binlog JSON) and str keys (json.loads), and rows that fail to decode.
+"""
+
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from app.binlog.decoders import (
+    PRESSURE_FLOW_CHANNELS,
+    decode_rows,
+    decode_waveform_channels
+)
+
+
+def waveform_document(keys=str):
+    """
+    Return a pressure_flow "parameters" document with str or bytes keys.
+    """
+    key = (lambda name: name.encode('utf-8')) if keys is bytes else (lambda name: name)
+    return {
+        key("pressure"): {key("unit"): b"cmH2O" if keys is bytes else "cmH2O", key("values"): [1.0, 2.5, 3.0]},
+        key("flow"): {key("unit"): "L/min", key("values"): [0.5, -0.5, 0.0]}
+    }
+
+
+@pytest.mark.parametrize("keys", [str, bytes])
+def test_decode_waveform_channels_accepts_str_and_bytes_keys(keys):
+    data = decode_waveform_channels(waveform_document(keys), PRESSURE_FLOW_CHANNELS, dtype=np.float64)
+
+    assert set(data) == set(PRESSURE_FLOW_CHANNELS)
+    assert data["pressure"]["unit"] == "cmH2O"
+    assert data["flow"]["unit"] == "L/min"
+    assert isinstance(data["pressure"]["values"], np.ndarray)
+    assert data["pressure"]["values"].dtype == np.float64
+    np.testing.assert_array_equal(data["pressure"]["values"], [1.0, 2.5, 3.0])
+    np.testing.assert_array_equal(data["flow"]["values"], [0.5, -0.5, 0.0])
+
+
+def test_decode_waveform_channels_only_decodes_requested_channels():
+    data = decode_waveform_channels(waveform_document(), ("flow",))
+
+    assert list(data) == ["flow"]
+
+
+def test_decode_waveform_channels_missing_channel_raises_key_error():
+    document = waveform_document()
+    del document["flow"]
+
+    with pytest.raises(KeyError):
+        decode_waveform_channels(document, PRESSURE_FLOW_CHANNELS)
+
+
+def test_decode_waveform_channels_non_numeric_samples_raise_value_error():
+    document = waveform_document()
+    document["pressure"]["values"] = ["high", 1.0, 2.0]
+
+    with pytest.raises(ValueError):
+        decode_waveform_channels(document, PRESSURE_FLOW_CHANNELS)
+
+
+def test_decode_rows_skips_rows_that_fail_to_decode():
+    collection_time = datetime(2025, 1, 1, 12, 0, 0)
+    broken = waveform_document(bytes)
+    del broken[b"flow"]
+    rows = [
+        {"values": {"patient_id": 1, "collection_time": collection_time, "parameters": waveform_document(bytes)}},
+        {"values": {"patient_id": 2, "collection_time": collection_time, "parameters": broken}},
+        {"values": {"patient_id": 3, "parameters": waveform_document()}},
+        {"values": {"patient_id": 4, "collection_time": collection_time, "parameters": waveform_document()}}
+    ]
+
+    decoded = decode_rows("pressure_flow_params", rows)
+
+    assert [(patient_id, param_type) for patient_id, param_type, _, _ in decoded] == [
+        (1, "pressure_flow"), (4, "pressure_flow")
+    ]
+    assert decoded[0][3] == collection_time.timestamp()
+
+
+def test_decode_rows_ignores_unknown_tables():
+    assert decode_rows("unknown_params", [{"values": {"patient_id": 1}}]) == []
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Tests of the send queue (app/core/event_queue.py): the bound under each overflow
+             policy, the unfinished entry accounting behind join(), and the sharded queue.
+"""
+
+import threading
+import time
+
+import pytest
+
+from app.core.event_queue import CoalescingEventQueue, ShardedEventQueue
+
+ECG = (1, "ECG")
+BREATH = (1, "breath_cycle")
+
+
+def drain(queue):
+    """
+    Take every pending entry, marking each done. Returns {key: [seq, ...]}.
+    """
+    entries = {}
+    while True:
+        item = queue.get(timeout=0)
+        if item is None:
+            return entries
+        key, events = item
+        entries[key] = events
+        queue.task_done()
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        CoalescingEventQueue(policy="newest")
+
+
+def test_events_of_a_stream_share_one_entry():
+    queue = CoalescingEventQueue(maxsize=100)
+    queue.put(ECG, [0, 1])
+    queue.put(BREATH, [0])
+    queue.put(ECG, [2])
+
+    assert queue.qsize() == 4
+    assert queue.get(timeout=0) == (ECG, [0, 1, 2])
+    assert queue.get(timeout=0) == (BREATH, [0])
+    assert queue.get(timeout=0) is None
+
+
+@pytest.mark.parametrize("policy", ["coalesce", "drop_oldest"])
+def test_every_event_is_kept_within_the_bound(policy):
+    queue = CoalescingEventQueue(maxsize=20, policy=policy, merge_types=("ECG",), max_merge_frames=2)
+    for seq in range(10):
+        queue.put(BREATH, [seq])
+        queue.put(ECG, [seq])
+
+    assert drain(queue) == {BREATH: list(range(10)), ECG: list(range(10))}
+    assert queue.stats()["coalesced"] == queue.stats()["dropped"] == 0
+
+
+def test_coalesce_beyond_the_bound_keeps_latest_events():
+    queue = CoalescingEventQueue(maxsize=4, policy="coalesce", merge_types=("ECG",), max_merge_frames=3)
+    for seq in range(4):
+        queue.put(BREATH, [seq])
+    for seq in range(4):
+        queue.put(ECG, [seq])
+
+    # Over the bound: the oldest stream keeps its latest event, the waveform its latest frames.
+    assert queue.qsize() <= 4
+    assert drain(queue) == {BREATH: [3], ECG: [1, 2, 3]}
+    assert queue.stats()["coalesced"] == 3
+
+
+def test_coalesce_drops_oldest_when_coalescing_is_not_enough():
+    queue = CoalescingEventQueue(maxsize=2, policy="coalesce")
+    for patient_id in range(4):
+        queue.put((patient_id, "breath_cycle"), [0])
+
+    assert queue.qsize() == 2
+    assert list(drain(queue)) == [(2, "breath_cycle"), (3, "breath_cycle")]
+    assert queue.stats()["dropped"] == 2
+
+
+def test_drop_oldest_beyond_the_bound():
+    queue = CoalescingEventQueue(maxsize=3, policy="drop_oldest")
+    queue.put(BREATH, [0, 1])
+    queue.put(ECG, [0, 1, 2])
+
+    assert drain(queue) == {ECG: [0, 1, 2]}
+    assert queue.stats()["dropped"] == 2
+
+
+def test_block_waits_for_space():
+    queue = CoalescingEventQueue(maxsize=2, policy="block")
+    queue.put(ECG, [0, 1])
+    done = threading.Event()
+
+    def producer():
+        queue.put(BREATH, [0])
+        done.set()
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    assert not done.wait(0.1)
+    assert queue.get(timeout=1) == (ECG, [0, 1])
+    assert done.wait(1)
+    thread.join(1)
+    assert queue.get(timeout=0) == (BREATH, [0])
+    assert queue.stats()["blocked"] == 1
+
+
+def test_block_accepts_an_oversized_put_into_an_empty_queue():
+    queue = CoalescingEventQueue(maxsize=2, policy="block")
+    queue.put(ECG, [0, 1, 2, 3])
+
+    assert queue.qsize() == 4
+
+
+def test_join_waits_for_task_done():
+    queue = CoalescingEventQueue(maxsize=10)
+    queue.put(ECG, [0])
+    queue.put(BREATH, [0])
+    finished = threading.Event()
+
+    def joiner():
+        queue.join()
+        finished.set()
+
+    thread = threading.Thread(target=joiner, daemon=True)
+    thread.start()
+    queue.get(timeout=0)
+    queue.task_done()
+    assert not finished.wait(0.1)
+    queue.get(timeout=0)
+    queue.task_done()
+    assert finished.wait(1)
+    thread.join(1)
+
+
+def test_dropped_entries_are_not_left_unfinished():
+    queue = CoalescingEventQueue(maxsize=1, policy="drop_oldest")
+    for patient_id in range(5):
+        queue.put((patient_id, "breath_cycle"), [0])
+    drain(queue)
+
+    # Entries dropped before any get() must not keep join() waiting.
+    thread = threading.Thread(target=queue.join, daemon=True)
+    thread.start()
+    thread.join(1)
+    assert not thread.is_alive()
+
+
+def test_stream_put_again_while_in_progress_is_a_new_entry():
+    queue = CoalescingEventQueue(maxsize=10)
+    queue.put(ECG, [0])
+    assert queue.get(timeout=0) == (ECG, [0])
+    queue.put(ECG, [1])
+    queue.task_done()
+
+    assert queue.get(timeout=0) == (ECG, [1])
+    queue.task_done()
+    queue.join()
+
+
+def test_sharded_queue_routes_a_stream_to_one_shard():
+    queue = ShardedEventQueue(shards=4, maxsize=400)
+    keys = [(patient_id, "ECG") for patient_id in range(20)]
+    for seq in range(3):
+        for key in keys:
+            queue.put(key, [seq])
+
+    assert queue.qsize() == 60
+    for key in keys:
+        shard = queue.shard(key)
+        assert [other for other in queue.shards if key in other._entries] == [shard]
+    entries = {}
+    for shard in queue.shards:
+        entries.update(drain(shard))
+    assert entries == {key: [0, 1, 2] for key in keys}
+    queue.join()
+
+
+def test_sharded_queue_splits_the_bound_and_sums_stats():
+    queue = ShardedEventQueue(shards=4, maxsize=8, policy="drop_oldest")
+    assert [shard.maxsize for shard in queue.shards] == [2, 2, 2, 2]
+
+    for patient_id in range(40):
+        queue.put((patient_id, "breath_cycle"), [0])
+
+    stats = queue.stats()
+    assert stats["shards"] == 4
+    assert stats["depth"] == sum(stats["shard_depths"]) <= 8
+    assert stats["enqueued"] == 40
+    assert stats["dropped"] == 40 - stats["depth"]
+
+
+def test_sharded_queue_workers_keep_stream_order():
+    queue = ShardedEventQueue(shards=4, maxsize=100000)
+    received = {}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def worker(shard):
+        while not stop.is_set():
+            item = shard.get(timeout=0.05)
+            if item is None:
+                continue
+            key, events = item
+            with lock:
+                received.setdefault(key, []).extend(events)
+            shard.task_done()
+
+    threads = [threading.Thread(target=worker, args=(shard,), daemon=True) for shard in queue.shards]
+    for thread in threads:
+        thread.start()
+    for seq in range(200):
+        for patient_id in range(8):
+            queue.put((patient_id, "ECG"), [seq])
+        if seq % 50 == 0:
+            time.sleep(0.01)
+    queue.join()
+    stop.set()
+    for thread in threads:
+        thread.join(1)
+
+    assert received == {(patient_id, "ECG"): list(range(200)) for patient_id in range(8)}
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Tests of the per-connection queues of the fan-out engine (app/core/fanout.py):
+             the drop_oldest, coalesce and disconnect slow-consumer policies and in-order delivery.
+             Messages are put without yielding to the event loop, so they stay pending until the
+             test awaits.
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from app.core.event_queue import CoalescingEventQueue
+from app.core.fanout import FanoutEngine
+
+ECG = (1, "ECG")
+BREATH = (1, "breath_cycle")
+
+
+class MemoryWebSocket:
+    def __init__(self):
+        self.messages = []
+        self.closed = None
+
+    async def send_text(self, message):
+        self.messages.append(message)
+
+    async def send_bytes(self, message):
+        self.messages.append(message)
+
+    async def close(self, code=1000, reason=""):
+        self.closed = code
+
+
+def run(test, policy, max_pending=4, max_lag=5.0):
+    """
+    Run test(engine, websocket, errors) in a fresh event loop.
+    """
+    async def main():
+        errors = []
+        engine = FanoutEngine(
+            CoalescingEventQueue(), dispatch=None, loop=asyncio.get_running_loop(),
+            on_error=lambda websocket, error: errors.append(error),
+            policy=policy, max_pending=max_pending, max_lag=max_lag
+        )
+        websocket = MemoryWebSocket()
+        await test(engine, websocket, errors)
+        engine.release(websocket)
+        await asyncio.sleep(0)
+    asyncio.run(main())
+
+
+def connection(engine, websocket):
+    return engine._connections[websocket]
+
+
+async def flush():
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        FanoutEngine(CoalescingEventQueue(), None, None, policy="newest")
+
+
+@pytest.mark.parametrize("policy", ["drop_oldest", "coalesce", "disconnect"])
+def test_messages_within_the_bound_are_delivered_in_order(policy):
+    async def test(engine, websocket, errors):
+        for i in range(4):
+            engine.send(websocket, f"m{i}", key=ECG, waveform=True)
+        await flush()
+        assert websocket.messages == ["m0", "m1", "m2", "m3"]
+        assert connection(engine, websocket).coalesced == 0
+        assert connection(engine, websocket).dropped == 0
+    run(test, policy)
+
+
+def test_bytes_are_sent_as_binary_frames():
+    async def test(engine, websocket, errors):
+        engine.send(websocket, b"\x00\x01", key=ECG, waveform=True)
+        await flush()
+        assert websocket.messages == [b"\x00\x01"]
+    run(test, "drop_oldest")
+
+
+def test_drop_oldest_drops_waveforms_first():
+    async def test(engine, websocket, errors):
+        engine.send(websocket, "status")
+        for i in range(4):
+            engine.send(websocket, f"ecg{i}", key=ECG, waveform=True)
+        pending = [entry[2] for entry in connection(engine, websocket).pending]
+        assert pending == ["status", "ecg1", "ecg2", "ecg3"]
+        assert connection(engine, websocket).dropped == 1
+    run(test, "drop_oldest")
+
+
+def test_coalesce_only_once_the_connection_is_full():
+    async def test(engine, websocket, errors):
+        for i in range(3):
+            engine.send(websocket, f"ecg{i}", key=ECG, waveform=True)
+        # Below max_pending every message is kept.
+        assert len(connection(engine, websocket).pending) == 3
+        engine.send(websocket, "breath0", key=BREATH)
+        # Full: a new message replaces the pending one of its stream, keeping its place.
+        engine.send(websocket, "ecg3", key=ECG, waveform=True)
+        engine.send(websocket, "breath1", key=BREATH)
+        pending = [entry[2] for entry in connection(engine, websocket).pending]
+        assert pending == ["ecg0", "ecg1", "ecg3", "breath1"]
+        assert connection(engine, websocket).coalesced == 2
+        await flush()
+        assert websocket.messages == ["ecg0", "ecg1", "ecg3", "breath1"]
+    run(test, "coalesce")
+
+
+def test_coalesce_when_the_oldest_message_lags():
+    async def test(engine, websocket, errors):
+        engine.send(websocket, "ecg0", key=ECG, waveform=True)
+        engine.send(websocket, "ecg1", key=ECG, waveform=True)
+        connection(engine, websocket).pending[0][4] -= 10.0
+        engine.send(websocket, "ecg2", key=ECG, waveform=True)
+        assert [entry[2] for entry in connection(engine, websocket).pending] == ["ecg0", "ecg2"]
+    run(test, "coalesce", max_pending=100, max_lag=1.0)
+
+
+def test_coalesce_never_merges_unkeyed_messages():
+    async def test(engine, websocket, errors):
+        for i in range(6):
+            engine.send(websocket, f"status{i}")
+        pending = [entry[2] for entry in connection(engine, websocket).pending]
+        assert pending == ["status2", "status3", "status4", "status5"]
+    run(test, "coalesce")
+
+
+def test_disconnect_when_full():
+    async def test(engine, websocket, errors):
+        for i in range(5):
+            engine.send(websocket, f"ecg{i}", key=ECG, waveform=True)
+        await flush()
+        assert websocket not in engine._connections
+        assert websocket.closed == 1013
+        assert engine.disconnects == 1
+        assert len(errors) == 1
+        # Later messages for the closed websocket are ignored.
+        engine.send(websocket, "late")
+        assert websocket not in engine._connections
+    run(test, "disconnect")
+
+
+def test_disconnect_when_lagging():
+    async def test(engine, websocket, errors):
+        engine.send(websocket, "ecg0", key=ECG, waveform=True)
+        connection(engine, websocket).pending[0][4] = time.monotonic() - 10.0
+        engine.send(websocket, "ecg1", key=ECG, waveform=True)
+        assert engine.disconnects == 1
+    run(test, "disconnect", max_pending=100, max_lag=1.0)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Tests of direct device ingest (app/services/ingest_service.py): frames are
+             persisted only once committed to the cache.
+"""
+
+import pytest
+
+from app.binlog import listener
+from app.services import ingest_service
+
+FRAME = {
+    "table": "pressure_flow_params",
+    "patient_id": 1,
+    "collection_time": 1700000000.0,
+    "parameters": {
+        "pressure": {"unit": "cmH2O", "values": [1.0, 2.0]},
+        "flow": {"unit": "L/min", "values": [3.0, 4.0]}
+    }
+}
+
+
+@pytest.fixture
+def persisted(monkeypatch):
+    submitted = []
+    monkeypatch.setattr(ingest_service.write_behind, "submit", lambda *args: submitted.append(args))
+    return submitted
+
+
+def test_committed_frame_is_persisted(monkeypatch, persisted):
+    committed = []
+    monkeypatch.setattr(listener, "commit_row", lambda *args: committed.append(args[:2]))
+
+    assert ingest_service.ingest_frame(FRAME) is None
+    assert committed == [(1, "pressure_flow")]
+    assert len(persisted) == 1
+    assert persisted[0][0] == "pressure_flow_params"
+
+
+def test_frame_failing_to_commit_is_rejected_and_not_persisted(monkeypatch, persisted):
+    def failing(*args):
+        raise ValueError("channels of unequal lengths")
+    monkeypatch.setattr(listener, "commit_row", failing)
+
+    assert ingest_service.ingest_frame(FRAME) == "Failed to commit pressure_flow_params frame"
+    assert persisted == []
+    assert ingest_service.ingest_frames([FRAME, "x"]) == [
+        (0, "Failed to commit pressure_flow_params frame"),
+        (1, "Frame must be a JSON object")
+    ]
+    assert persisted == []
+
+
+def test_invalid_frames_are_rejected(persisted):
+    assert ingest_service.ingest_frame(dict(FRAME, table="other")) == "Unknown table 'other'"
+    assert ingest_service.ingest_frame(dict(FRAME, collection_time=True)) == "Invalid collection_time True"
+    assert ingest_service.ingest_frame(dict(FRAME, parameters={})) == "Invalid pressure_flow_params frame"
+    assert persisted == []
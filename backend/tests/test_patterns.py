@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Tests of the pattern subscriptions of the notifier (app/core/events.py): matching,
+             the pattern indexes, attaching new streams and removal.
+"""
+
+import pytest
+
+from app.core.events import DataUpdateNotifier, SubscriptionPattern
+
+
+class FakeWebSocket:
+    pass
+
+
+@pytest.fixture
+def notifier():
+    return DataUpdateNotifier()
+
+
+def test_pattern_matches():
+    assert SubscriptionPattern().matches(1, "ECG")
+    assert SubscriptionPattern(patient_ids=frozenset([1, 2])).matches(2, "ECG")
+    assert not SubscriptionPattern(patient_ids=frozenset([1, 2])).matches(3, "ECG")
+    assert SubscriptionPattern(param_types=frozenset(["ECG"])).matches(9, "ECG")
+    assert not SubscriptionPattern(frozenset([1]), frozenset(["ECG"])).matches(1, "pressure_flow")
+
+
+def test_patterns_are_indexed_by_their_finite_side(notifier):
+    by_patient, by_param, wildcard = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+    notifier.subscribe_pattern(by_patient, patient_ids=[1, 2], param_types=["ECG"])
+    notifier.subscribe_pattern(by_param, param_types=["ECG", "pressure_flow"])
+    notifier.subscribe_pattern(wildcard)
+
+    assert set(notifier._patterns_by_patient) == {1, 2}
+    assert set(notifier._patterns_by_param) == {"ECG", "pressure_flow"}
+    assert set(notifier._wildcard_patterns) == {wildcard}
+
+
+def test_new_streams_attach_matching_patterns(notifier):
+    ecg_of_1, all_ecg, everything = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+    notifier.subscribe_pattern(ecg_of_1, patient_ids=[1], param_types=["ECG"])
+    notifier.subscribe_pattern(all_ecg, param_types=["ECG"], fmt="binary", codec="delta16")
+    notifier.subscribe_pattern(everything, view=("minmax", 50))
+
+    notifier.attach(1, "ECG")
+    notifier.attach(2, "ECG")
+    notifier.attach(1, "pressure_flow")
+
+    assert notifier.get_subscribers(1, "ECG") == {ecg_of_1, all_ecg, everything}
+    assert notifier.get_subscribers(2, "ECG") == {all_ecg, everything}
+    assert notifier.get_subscribers(1, "pressure_flow") == {everything}
+    # The pattern's format options carry over to the streams it attaches.
+    assert notifier.get_binary_subscribers(2, "ECG") == {all_ecg: "delta16"}
+    assert notifier.get_views(1, "pressure_flow") == {everything: ("minmax", 50)}
+
+
+def test_pattern_subscribes_streams_already_seen(notifier):
+    for patient_id in (1, 2, 3):
+        notifier.attach(patient_id, "ECG")
+    notifier.attach(1, "pressure_flow")
+    websocket = FakeWebSocket()
+
+    streams = notifier.subscribe_pattern(websocket, patient_ids=[1, 3])
+
+    assert sorted(streams, key=str) == [(1, "ECG"), (1, "pressure_flow"), (3, "ECG")]
+    assert notifier.has_subscribers(3, "ECG")
+    assert not notifier.has_subscribers(2, "ECG")
+
+
+def test_a_websocket_matched_by_several_patterns_is_subscribed_once(notifier):
+    websocket = FakeWebSocket()
+    notifier.subscribe_pattern(websocket, patient_ids=[1])
+    notifier.subscribe_pattern(websocket, param_types=["ECG"])
+
+    notifier.attach(1, "ECG")
+
+    assert notifier.get_subscribers(1, "ECG") == {websocket}
+    assert notifier._keys[websocket] == {(1, "ECG")}
+
+
+def test_attach_is_done_once_per_stream(notifier):
+    notifier.attach(1, "ECG")
+    websocket = FakeWebSocket()
+    notifier.subscribe_pattern(websocket, patient_ids=[1])
+    notifier.unsubscribe(1, ["ECG"], websocket)
+
+    # A known stream is not re-attached: the explicit unsubscribe sticks.
+    notifier.attach(1, "ECG")
+    assert not notifier.has_subscribers(1, "ECG")
+
+
+def test_remove_websocket_drops_patterns_and_their_streams(notifier):
+    websocket, other = FakeWebSocket(), FakeWebSocket()
+    notifier.subscribe_pattern(websocket, patient_ids=[1])
+    notifier.subscribe_pattern(websocket)
+    notifier.subscribe_pattern(other, param_types=["ECG"])
+    notifier.attach(1, "ECG")
+
+    notifier.remove_websocket(websocket)
+
+    assert notifier.get_subscribers(1, "ECG") == {other}
+    assert websocket not in notifier.patterns
+    assert notifier._patterns_by_patient == {}
+    assert notifier._wildcard_patterns == {}
+    notifier.attach(2, "ECG")
+    assert notifier.get_subscribers(2, "ECG") == {other}
+
+
+def test_remove_patterns_keeps_attached_streams(notifier):
+    websocket = FakeWebSocket()
+    notifier.subscribe_pattern(websocket, param_types=["ECG"])
+    notifier.attach(1, "ECG")
+
+    notifier.remove_patterns(websocket)
+    notifier.attach(2, "ECG")
+
+    assert notifier.get_subscribers(1, "ECG") == {websocket}
+    assert not notifier.has_subscribers(2, "ECG")
+    assert notifier.stats()["patterns"] == 0
+
+
+def test_forgotten_streams_are_attached_again_on_their_next_row(notifier):
+    notifier.attach(1, "ECG")
+    notifier.attach(1, "pressure_flow")
+    websocket = FakeWebSocket()
+    notifier.subscribe_pattern(websocket, param_types=["ECG"])
+
+    notifier.forget_streams([(1, "ECG"), (9, "ECG")])
+
+    assert notifier.stats()["seen_streams"] == 1
+    assert notifier._seen_by_patient == {1: {"pressure_flow"}}
+    assert notifier._seen_by_param == {"pressure_flow": {1}}
+    # The subscription made while the stream was seen is kept.
+    assert notifier.get_subscribers(1, "ECG") == {websocket}
+    # The next row re-attaches it: an explicit unsubscribe no longer sticks once forgotten.
+    notifier.unsubscribe(1, ["ECG"], websocket)
+    notifier.attach(1, "ECG")
+    assert notifier.get_subscribers(1, "ECG") == {websocket}
+    assert notifier.stats()["seen_streams"] == 2
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Tests of the waveform ring buffer (app/core/ring_buffer.py): wrap-around, frame
+             lookups, zero-copy views and copies of wrapped windows.
+"""
+
+import numpy as np
+import pytest
+
+from app.core.ring_buffer import WaveformRing
+
+
+def frame(start, n):
+    """
+    Return a two-channel frame whose pressure samples are start, start+1, ... and flow samples
+    their negatives.
+    """
+    values = np.arange(start, start + n, dtype=np.float64)
+    return {"pressure": {"unit": "cmH2O", "values": values}, "flow": {"unit": "L/min", "values": -values}}
+
+
+def make_ring(capacity=10, max_frames=8, first_seq=0):
+    return WaveformRing(("pressure", "flow"), {"pressure": "cmH2O", "flow": "L/min"}, capacity, max_frames,
+                        dtype=np.float64, first_seq=first_seq)
+
+
+def test_frames_are_numbered_in_arrival_order():
+    ring = make_ring()
+
+    assert ring.last_seq == -1
+    assert ring.latest() is None
+    assert [ring.append(frame(i * 3, 3), float(i)) for i in range(3)] == [0, 1, 2]
+    record = ring.get(1)
+    assert record["seq"] == 1 and record["timestamp"] == 1.0
+    np.testing.assert_array_equal(record["data"]["pressure"]["values"], [3, 4, 5])
+    np.testing.assert_array_equal(record["data"]["flow"]["values"], [-3, -4, -5])
+    assert record["data"]["pressure"]["unit"] == "cmH2O"
+
+
+def test_first_seq_continues_numbering():
+    ring = make_ring(first_seq=41)
+
+    assert ring.last_seq == 40
+    assert ring.latest() is None
+    assert ring.append(frame(0, 2), 0.0) == 41
+    assert ring.get(41)["seq"] == 41
+    assert ring.get(40) is None
+
+
+def test_wrap_around_forgets_overwritten_frames():
+    ring = make_ring(capacity=10)
+    for i in range(5):
+        ring.append(frame(i * 3, 3), float(i))
+
+    # 15 samples written into 10: frames 0 and 1 (samples 0-5) are partly overwritten.
+    assert ring.get(0) is None
+    assert ring.get(1) is None
+    assert len(ring) == 3
+    np.testing.assert_array_equal(ring.get(2)["data"]["pressure"]["values"], [6, 7, 8])
+    # Frame 3 (samples 9-11) wraps around the end of the ring.
+    np.testing.assert_array_equal(ring.get(3)["data"]["pressure"]["values"], [9, 10, 11])
+    np.testing.assert_array_equal(ring.get(4)["data"]["pressure"]["values"], [12, 13, 14])
+
+
+def test_frame_longer_than_the_ring_keeps_its_last_samples():
+    ring = make_ring(capacity=4)
+    seq = ring.append(frame(0, 7), 0.0)
+
+    np.testing.assert_array_equal(ring.get(seq)["data"]["pressure"]["values"], [3, 4, 5, 6])
+
+
+def test_max_frames_bounds_the_frame_records():
+    ring = make_ring(capacity=100, max_frames=4)
+    for i in range(6):
+        ring.append(frame(i, 1), float(i))
+
+    assert ring.get(1) is None
+    assert [record["seq"] for record in ring.since(-1)] == [2, 3, 4, 5]
+
+
+def test_unequal_channels_are_rejected():
+    ring = make_ring()
+    data = frame(0, 3)
+    data["flow"]["values"] = np.zeros(2)
+
+    with pytest.raises(ValueError):
+        ring.append(data, 0.0)
+    assert ring.last_seq == -1
+
+
+def test_accepts_only_the_same_channels():
+    ring = make_ring()
+
+    assert ring.accepts(frame(0, 1))
+    assert not ring.accepts({"pressure": frame(0, 1)["pressure"]})
+
+
+def test_timestamp_lookups():
+    ring = make_ring(capacity=100)
+    for i, timestamp in enumerate([10.0, 11.0, 11.0, 13.0]):
+        ring.append(frame(i, 1), timestamp)
+
+    assert ring.find(11.0)["seq"] == 2
+    assert ring.find(12.0) is None
+    assert ring.nearest(12.2)["seq"] == 3
+    assert ring.nearest(11.9)["seq"] == 2
+    assert ring.nearest(12.0)["seq"] == 3
+    assert ring.nearest(0.0)["seq"] == 0
+    assert ring.nearest(99.0)["seq"] == 3
+    assert [record["seq"] for record in ring.range(11.0, 13.0)] == [1, 2, 3]
+    assert ring.range(14.0, 20.0) == []
+    assert [record["seq"] for record in ring.since(1)] == [2, 3]
+
+
+def test_unwrapped_windows_are_views_and_wrapped_windows_copies():
+    ring = make_ring(capacity=10)
+    ring.append(frame(0, 4), 0.0)
+    ring.append(frame(4, 4), 1.0)
+    ring.append(frame(8, 4), 2.0)
+
+    unwrapped = ring.get(1)["data"]["pressure"]["values"]
+    wrapped = ring.get(2)["data"]["pressure"]["values"]
+    assert np.shares_memory(unwrapped, ring._samples)
+    assert not np.shares_memory(wrapped, ring._samples)
+    np.testing.assert_array_equal(wrapped, [8, 9, 10, 11])
+
+    # A view is only valid until the ring wraps over it.
+    ring.append(frame(12, 6), 3.0)
+    np.testing.assert_array_equal(unwrapped, [14, 15, 16, 17])
+    np.testing.assert_array_equal(wrapped, [8, 9, 10, 11])
+
+
+def test_last_samples_and_samples_since():
+    ring = make_ring(capacity=10)
+    assert ring.last_samples(5) is None
+    for i in range(4):
+        ring.append(frame(i * 3, 3), float(i))
+
+    last = ring.last_samples(5)
+    np.testing.assert_array_equal(last["data"]["pressure"]["values"], [7, 8, 9, 10, 11])
+    assert last["timestamp"] == 3.0
+    # Never more than the ring holds.
+    assert len(ring.last_samples(50)["data"]["flow"]["values"]) == 10
+
+    since = ring.samples_since(1.0)
+    np.testing.assert_array_equal(since["data"]["pressure"]["values"], [6, 7, 8, 9, 10, 11])
+    assert ring.samples_since(3.0) is None
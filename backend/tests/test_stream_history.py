@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""
+Author: yadian zhao
+Institution: Canterbury University
+Description: Tests of the indexed record history (app/core/stream_history.py) and of the cache
+             lookups built on it (app/core/cache.py, deque mode), including sequence numbering
+             across evictions.
+"""
+
+from app.core import cache as cache_module
+from app.core.cache import PatientDataCache
+from app.core.stream_history import StreamHistory
+
+
+def make_history(timestamps, depth=10, first_seq=0):
+    history = StreamHistory(depth, first_seq=first_seq)
+    for i, timestamp in enumerate(timestamps):
+        history.append({"i": i}, timestamp)
+    return history
+
+
+def seqs(records):
+    return [record["seq"] for record in records]
+
+
+def test_records_are_numbered_and_found_by_seq():
+    history = make_history([1.0, 2.0, 3.0])
+
+    assert history.last_seq == 2
+    assert history.get(1) == {"data": {"i": 1}, "timestamp": 2.0, "seq": 1}
+    assert history.get(3) is None
+    assert history.get(-1) is None
+    assert history.latest()["seq"] == 2
+
+
+def test_depth_drops_oldest_and_keeps_numbering():
+    history = make_history([float(i) for i in range(6)], depth=3)
+
+    assert len(history) == 3
+    assert history.get(2) is None
+    assert seqs(history) == [3, 4, 5]
+    assert history.find(1.0) is None
+    assert history.nearest(0.0)["seq"] == 3
+
+
+def test_first_seq_continues_numbering():
+    history = make_history([], first_seq=7)
+
+    assert history.last_seq == 6
+    assert history.append({}, 1.0) == 7
+    assert history.get(7)["timestamp"] == 1.0
+
+
+def test_find_returns_latest_record_with_exact_timestamp():
+    history = make_history([1.0, 2.0, 2.0, 3.0])
+
+    assert history.find(2.0)["seq"] == 2
+    assert history.find(2.5) is None
+    assert make_history([]).find(1.0) is None
+
+
+def test_nearest_prefers_later_record_on_tie():
+    history = make_history([10.0, 12.0, 20.0])
+
+    assert history.nearest(10.9)["seq"] == 0
+    assert history.nearest(11.0)["seq"] == 1
+    assert history.nearest(16.0)["seq"] == 2
+    assert history.nearest(0.0)["seq"] == 0
+    assert history.nearest(99.0)["seq"] == 2
+    assert make_history([]).nearest(1.0) is None
+
+
+def test_out_of_order_timestamps_are_indexed():
+    history = make_history([1.0, 5.0, 3.0, 4.0], depth=3)
+
+    # Record 0 was dropped; the index is sorted by timestamp.
+    assert seqs(history.range(0.0, 10.0)) == [2, 3, 1]
+    assert history.find(3.0)["seq"] == 2
+    assert history.nearest(4.6)["seq"] == 1
+
+
+def test_range_is_inclusive():
+    history = make_history([1.0, 2.0, 3.0, 4.0])
+
+    assert seqs(history.range(2.0, 3.0)) == [1, 2]
+    assert history.range(4.5, 9.0) == []
+
+
+def test_since_returns_newer_records_in_arrival_order():
+    history = make_history([1.0, 2.0, 3.0, 4.0, 5.0], depth=3)
+
+    assert seqs(history.since(2)) == [3, 4]
+    assert seqs(history.since(-1)) == [2, 3, 4]
+    assert history.since(4) == []
+
+
+def test_nbytes_follows_kept_records():
+    history = StreamHistory(2, sizeof=lambda data: data["size"])
+    for size in (10, 20, 30):
+        history.append({"size": size}, 0.0)
+
+    assert history.nbytes == 50
+
+
+def test_cache_lookups():
+    cache = PatientDataCache(mode="deque", depth=10)
+    for i, timestamp in enumerate([1.0, 2.0, 3.0]):
+        cache.update_data(1, "breath_cycle", {"i": i}, timestamp)
+
+    assert cache.get_data(1, "breath_cycle")["seq"] == 2
+    assert cache.get_data(1, "breath_cycle", target_timestamp=2.0)["data"] == {"i": 1}
+    assert cache.get_nearest(1, "breath_cycle", 2.4)["seq"] == 1
+    assert seqs(cache.get_range(1, "breath_cycle", 2.0, 3.0)) == [1, 2]
+    assert seqs(cache.get_since(1, "breath_cycle", 0)) == [1, 2]
+    assert cache.get_last_seq(1, "breath_cycle") == 2
+
+
+def test_cache_get_data_misses_return_none():
+    cache = PatientDataCache(mode="deque", depth=10)
+    cache.update_data(1, "breath_cycle", {"i": 0}, 1.0)
+
+    assert cache.get_data(1, "breath_cycle", target_timestamp=1.5) is None
+    assert cache.get_data(1, "ECG") is None
+    assert cache.get_data(2, "breath_cycle", target_timestamp=1.0) is None
+    assert cache.get_last_seq(2, "breath_cycle") == -1
+    # Reads never create entries.
+    assert cache.stats()["streams"] == 1
+
+
+def test_sequence_numbers_continue_after_eviction_within_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    cache = PatientDataCache(mode="deque", depth=10, stream_ttl=60.0)
+    for i in range(3):
+        cache.update_data(1, "breath_cycle", {"i": i}, float(i))
+
+    now[0] += 61.0
+    assert cache.sweep() == (1, 1)
+    assert cache.stats()["seq_bases"] == 1
+    cache.update_data(1, "breath_cycle", {"i": 3}, 3.0)
+
+    assert cache.get_last_seq(1, "breath_cycle") == 3
+    assert cache.stats()["seq_bases"] == 0
+
+
+def test_sequence_bases_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    cache = PatientDataCache(mode="deque", depth=10, stream_ttl=60.0)
+    cache.update_data(1, "breath_cycle", {"i": 0}, 0.0)
+    cache.update_data(1, "breath_cycle", {"i": 1}, 1.0)
+
+    now[0] += 61.0
+    cache.sweep()
+    now[0] += 60.0
+    cache.sweep()
+    assert cache.stats()["seq_bases"] == 1
+    now[0] += 1.0
+    cache.sweep()
+    assert cache.stats()["seq_bases"] == 0
+
+    # Numbering restarts as for a new parameter.
+    cache.update_data(1, "breath_cycle", {"i": 2}, 2.0)
+    assert cache.get_last_seq(1, "breath_cycle") == 0